@@ -16,7 +16,7 @@ HOST = os.getenv("LOCALHOST")
 DB = os.getenv("DB")
 PORT = os.getenv("PORT")
 
-URL = f"postgresql://{USERNAME}:{PASSWORD}@{HOST}:{PORT}/{DB}"
+URL = os.getenv("DATABASE_URL") or f"postgresql://{USERNAME}:{PASSWORD}@{HOST}:{PORT}/{DB}"
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
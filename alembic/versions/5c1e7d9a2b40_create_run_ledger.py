@@ -0,0 +1,42 @@
+"""create run ledger
+
+Revision ID: 5c1e7d9a2b40
+Revises: a23eff8ce309
+Create Date: 2026-10-17 10:12:41.518204
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5c1e7d9a2b40"
+down_revision: Union[str, None] = "a23eff8ce309"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "run_ledger",
+        sa.Column("product", sa.String(), nullable=False),
+        sa.Column("scenario", sa.String(), nullable=False),
+        sa.Column("month", sa.String(), nullable=False),
+        sa.Column("step", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("input_fingerprint", sa.String(length=64)),
+        sa.Column("output_checksum", sa.String(length=64)),
+        sa.Column("row_count", sa.Integer()),
+        sa.Column("duration_seconds", sa.Float()),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime()),
+        sa.Column("error", sa.Text()),
+        sa.PrimaryKeyConstraint("product", "scenario", "month", "step"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("run_ledger")
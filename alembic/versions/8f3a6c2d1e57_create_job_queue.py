@@ -0,0 +1,44 @@
+"""create job queue
+
+Revision ID: 8f3a6c2d1e57
+Revises: 5c1e7d9a2b40
+Create Date: 2026-10-17 11:02:18.730615
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8f3a6c2d1e57"
+down_revision: Union[str, None] = "5c1e7d9a2b40"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "job_queue",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("product", sa.String(), nullable=False),
+        sa.Column("scenario", sa.String(), nullable=False),
+        sa.Column("month", sa.String(), nullable=False),
+        sa.Column("step", sa.String(), nullable=False),
+        sa.Column("step_order", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("worker_id", sa.String()),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("lease_expires_at", sa.DateTime()),
+        sa.Column("heartbeat_at", sa.DateTime()),
+        sa.Column("error", sa.Text()),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("product", "scenario", "month", "step"),
+    )
+    op.create_index("ix_job_queue_status", "job_queue", ["status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_job_queue_status", table_name="job_queue")
+    op.drop_table("job_queue")
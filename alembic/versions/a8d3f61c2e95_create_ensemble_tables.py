@@ -0,0 +1,59 @@
+"""create ensemble tables
+
+Revision ID: a8d3f61c2e95
+Revises: f2a9c4e7b180
+Create Date: 2026-10-17 20:41:52.118306
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a8d3f61c2e95"
+down_revision: Union[str, None] = "f2a9c4e7b180"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PRODUCT_TABLES = ["temp", "tmin", "tmax", "prec", "bio"]
+
+product_name = postgresql.ENUM(name="product_name", create_type=False)
+
+
+def upgrade() -> None:
+    for product in PRODUCT_TABLES:
+        table = f"{product}_ensemble"
+        op.create_table(
+            table,
+            sa.Column("iso2_code", sa.String(length=2)),
+            sa.Column("adm0_name", sa.String(length=128)),
+            sa.Column("adm1_name", sa.String(length=128)),
+            sa.Column("adm2_name", sa.String(length=128)),
+            sa.Column("adm1_id", sa.String(length=128)),
+            sa.Column("adm2_id", sa.String(length=128), nullable=False),
+            sa.Column("product", product_name, nullable=False),
+            sa.Column("scenario", sa.String(length=16), nullable=False),
+            sa.Column("month", sa.SmallInteger(), nullable=False),
+            sa.Column("n_models", sa.SmallInteger(), nullable=False),
+            sa.Column("ensemble_mean", sa.Float()),
+            sa.Column("ensemble_std", sa.Float()),
+            sa.Column("ensemble_min", sa.Float()),
+            sa.Column("ensemble_max", sa.Float()),
+            sa.Column("ensemble_p10", sa.Float()),
+            sa.Column("ensemble_median", sa.Float()),
+            sa.Column("ensemble_p90", sa.Float()),
+            sa.Column("unit", sa.String(length=16)),
+            sa.Column("uploaded_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("adm2_id", "scenario", "month"),
+            schema="public",
+        )
+        op.create_index(f"ix_{table}_iso2_code", table, ["iso2_code"])
+        op.create_index(f"ix_{table}_adm0_name", table, ["adm0_name"])
+
+
+def downgrade() -> None:
+    for product in PRODUCT_TABLES:
+        op.drop_table(f"{product}_ensemble")
@@ -0,0 +1,35 @@
+"""create upload hash
+
+Revision ID: b7d2e4f19a03
+Revises: 8f3a6c2d1e57
+Create Date: 2026-10-17 17:58:41.204117
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b7d2e4f19a03"
+down_revision: Union[str, None] = "8f3a6c2d1e57"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "upload_hash",
+        sa.Column("table_name", sa.String(), nullable=False),
+        sa.Column("scenario", sa.String(), nullable=False),
+        sa.Column("month", sa.String(), nullable=False),
+        sa.Column("content_hash", sa.String(length=64), nullable=False),
+        sa.Column("row_count", sa.Integer(), nullable=False),
+        sa.Column("uploaded_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("table_name", "scenario", "month"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("upload_hash")
@@ -0,0 +1,26 @@
+"""add output sizes and modification times to the run ledger
+
+Revision ID: c3e8b5f0a164
+Revises: a8d3f61c2e95
+Create Date: 2026-10-17 22:41:07.318520
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c3e8b5f0a164"
+down_revision: Union[str, None] = "a8d3f61c2e95"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("run_ledger", sa.Column("output_stats", sa.Text()))
+
+
+def downgrade() -> None:
+    op.drop_column("run_ledger", "output_stats")
@@ -0,0 +1,99 @@
+"""partition product tables by scenario and month
+
+Revision ID: d41c8a7e6b92
+Revises: b7d2e4f19a03
+Create Date: 2026-10-17 18:31:07.519842
+
+"""
+import re
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "d41c8a7e6b92"
+down_revision: Union[str, None] = "b7d2e4f19a03"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PRODUCT_TABLES = ["temp", "tmin", "tmax", "prec", "bio"]
+
+# Scenarios of climatology.Scenario when the tables were partitioned. Uploads create
+# the partitions of scenarios added later.
+SCENARIOS = ["ACCESS1-0_rcp45", "ACCESS1-0_rcp85", "BNU-ESM_rcp26", "CCSM4_rcp60", "BNU-ESM_rcp45"]
+MONTHS = [str(month) for month in range(1, 13)]
+
+COLUMNS = "id, iso2_code, adm0_name, adm1_name, adm2_name, adm1_id, adm2_id, product, scenario, month, mean_raw, median_raw, min_raw, max_raw, uploaded_at"
+
+
+def product_columns() -> list[sa.Column]:
+    return [
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("iso2_code", sa.String(length=2), nullable=False),
+        sa.Column("adm0_name", sa.String(length=128)),
+        sa.Column("adm1_name", sa.String(length=128)),
+        sa.Column("adm2_name", sa.String(length=128)),
+        sa.Column("adm1_id", sa.String(length=128)),
+        sa.Column("adm2_id", sa.String(length=128)),
+        sa.Column("product", sa.String(), nullable=False),
+        sa.Column("scenario", sa.String(), nullable=False),
+        sa.Column("month", sa.String(), nullable=False),
+        sa.Column("mean_raw", sa.Float()),
+        sa.Column("median_raw", sa.Float()),
+        sa.Column("min_raw", sa.Float()),
+        sa.Column("max_raw", sa.Float()),
+        sa.Column("uploaded_at", sa.DateTime()),
+    ]
+
+
+def partition_name(table: str, scenario: str, month: Union[str, None] = None) -> str:
+    name = f"{table}_{re.sub('[^a-z0-9]+', '_', scenario.lower()).strip('_')}"
+    return name if month is None else f"{name}_m{month}"
+
+
+def upgrade() -> None:
+    for table in PRODUCT_TABLES:
+        op.rename_table(table, f"{table}_unpartitioned")
+        # Free the constraint and index names for the partitioned table
+        op.execute(f'ALTER TABLE "{table}_unpartitioned" DROP CONSTRAINT IF EXISTS "{table}_pkey"')
+        op.execute(f'ALTER TABLE "{table}_unpartitioned" DROP CONSTRAINT IF EXISTS "{table}_id_key"')
+
+        op.create_table(
+            table,
+            *product_columns(),
+            sa.PrimaryKeyConstraint("id", "scenario", "month"),
+            schema="public",
+            postgresql_partition_by="LIST (scenario)",
+        )
+        for scenario in SCENARIOS:
+            op.execute(
+                f'CREATE TABLE "{partition_name(table, scenario)}" PARTITION OF "{table}" '
+                f"FOR VALUES IN ('{scenario}') PARTITION BY LIST (month)"
+            )
+            for month in MONTHS:
+                op.execute(
+                    f'CREATE TABLE "{partition_name(table, scenario, month)}" '
+                    f"PARTITION OF \"{partition_name(table, scenario)}\" FOR VALUES IN ('{month}')"
+                )
+        op.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+
+        op.execute(f'INSERT INTO "{table}" ({COLUMNS}) SELECT {COLUMNS} FROM "{table}_unpartitioned"')
+        op.drop_table(f"{table}_unpartitioned")
+
+
+def downgrade() -> None:
+    for table in PRODUCT_TABLES:
+        op.rename_table(table, f"{table}_partitioned")
+        op.execute(f'ALTER TABLE "{table}_partitioned" DROP CONSTRAINT IF EXISTS "{table}_pkey"')
+
+        op.create_table(
+            table,
+            *product_columns(),
+            sa.PrimaryKeyConstraint("id"),
+            schema="public",
+        )
+        op.execute(f'INSERT INTO "{table}" ({COLUMNS}) SELECT {COLUMNS} FROM "{table}_partitioned"')
+        # Dropping the partitioned table drops its partitions
+        op.drop_table(f"{table}_partitioned")
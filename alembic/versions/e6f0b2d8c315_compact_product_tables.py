@@ -0,0 +1,147 @@
+"""compact product tables: enum product and scenario, smallint month, natural key
+
+Revision ID: e6f0b2d8c315
+Revises: d41c8a7e6b92
+Create Date: 2026-10-17 19:12:44.083516
+
+"""
+import re
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e6f0b2d8c315"
+down_revision: Union[str, None] = "d41c8a7e6b92"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PRODUCT_TABLES = ["temp", "tmin", "tmax", "prec", "bio"]
+PRODUCTS = ["temp", "bio", "prec", "tmax", "tmin"]
+SCENARIOS = ["ACCESS1-0_rcp45", "ACCESS1-0_rcp85", "BNU-ESM_rcp26", "CCSM4_rcp60", "BNU-ESM_rcp45"]
+MONTHS = list(range(1, 13))
+
+product_name = postgresql.ENUM(*PRODUCTS, name="product_name", create_type=False)
+scenario_name = postgresql.ENUM(*SCENARIOS, name="scenario_name", create_type=False)
+
+ADMIN_COLUMNS = "iso2_code, adm0_name, adm1_name, adm2_name, adm1_id, adm2_id"
+STAT_COLUMNS = "mean_raw, median_raw, min_raw, max_raw, uploaded_at"
+
+
+def partition_name(table: str, scenario: str, month: Union[int, None] = None) -> str:
+    name = f"{table}_{re.sub('[^a-z0-9]+', '_', scenario.lower()).strip('_')}"
+    return name if month is None else f"{name}_m{month}"
+
+
+def create_partitions(table: str, month_literal) -> None:
+    for scenario in SCENARIOS:
+        op.execute(
+            f'CREATE TABLE "{partition_name(table, scenario)}" PARTITION OF "{table}" '
+            f"FOR VALUES IN ('{scenario}') PARTITION BY LIST (month)"
+        )
+        for month in MONTHS:
+            op.execute(
+                f'CREATE TABLE "{partition_name(table, scenario, month)}" '
+                f'PARTITION OF "{partition_name(table, scenario)}" FOR VALUES IN ({month_literal(month)})'
+            )
+    op.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    product_name.create(bind, checkfirst=True)
+    scenario_name.create(bind, checkfirst=True)
+
+    for table in PRODUCT_TABLES:
+        # Backfill: keep the latest upload of every admin 2 area, scenario and month.
+        # Rows without an admin 2 id, or with unknown scenarios, have no natural key and are dropped.
+        op.execute(
+            f'CREATE TABLE "{table}_backfill" AS '
+            f"SELECT DISTINCT ON (adm2_id, scenario, month) {ADMIN_COLUMNS}, "
+            "product::product_name AS product, scenario::scenario_name AS scenario, "
+            f"month::smallint AS month, {STAT_COLUMNS} "
+            f'FROM "{table}" '
+            f"WHERE adm2_id IS NOT NULL AND scenario IN ({', '.join(repr(s) for s in SCENARIOS)}) "
+            "ORDER BY adm2_id, scenario, month, uploaded_at DESC NULLS LAST"
+        )
+        # Dropping the partitioned table drops its partitions
+        op.drop_table(table)
+
+        op.create_table(
+            table,
+            sa.Column("iso2_code", sa.String(length=2), nullable=False),
+            sa.Column("adm0_name", sa.String(length=128)),
+            sa.Column("adm1_name", sa.String(length=128)),
+            sa.Column("adm2_name", sa.String(length=128)),
+            sa.Column("adm1_id", sa.String(length=128)),
+            sa.Column("adm2_id", sa.String(length=128), nullable=False),
+            sa.Column("product", product_name, nullable=False),
+            sa.Column("scenario", scenario_name, nullable=False),
+            sa.Column("month", sa.SmallInteger(), nullable=False),
+            sa.Column("mean_raw", sa.Float()),
+            sa.Column("median_raw", sa.Float()),
+            sa.Column("min_raw", sa.Float()),
+            sa.Column("max_raw", sa.Float()),
+            sa.Column("uploaded_at", sa.DateTime()),
+            sa.PrimaryKeyConstraint("adm2_id", "scenario", "month"),
+            schema="public",
+            postgresql_partition_by="LIST (scenario)",
+        )
+        create_partitions(table, month_literal=str)
+
+        op.execute(
+            f'INSERT INTO "{table}" ({ADMIN_COLUMNS}, product, scenario, month, {STAT_COLUMNS}) '
+            f'SELECT {ADMIN_COLUMNS}, product, scenario, month, {STAT_COLUMNS} FROM "{table}_backfill"'
+        )
+        op.drop_table(f"{table}_backfill")
+
+        # Indexes of the dashboard's country filters, created on every partition
+        op.create_index(f"ix_{table}_iso2_code", table, ["iso2_code"])
+        op.create_index(f"ix_{table}_adm0_name", table, ["adm0_name"])
+
+
+def downgrade() -> None:
+    for table in PRODUCT_TABLES:
+        op.execute(
+            f'CREATE TABLE "{table}_backfill" AS '
+            f"SELECT product::text || '_' || scenario::text || '_' || month::text || '_' || adm2_id AS id, "
+            f"{ADMIN_COLUMNS}, product::text AS product, scenario::text AS scenario, "
+            f'month::text AS month, {STAT_COLUMNS} FROM "{table}"'
+        )
+        op.drop_table(table)
+
+        op.create_table(
+            table,
+            sa.Column("id", sa.String(), nullable=False),
+            sa.Column("iso2_code", sa.String(length=2), nullable=False),
+            sa.Column("adm0_name", sa.String(length=128)),
+            sa.Column("adm1_name", sa.String(length=128)),
+            sa.Column("adm2_name", sa.String(length=128)),
+            sa.Column("adm1_id", sa.String(length=128)),
+            sa.Column("adm2_id", sa.String(length=128)),
+            sa.Column("product", sa.String(), nullable=False),
+            sa.Column("scenario", sa.String(), nullable=False),
+            sa.Column("month", sa.String(), nullable=False),
+            sa.Column("mean_raw", sa.Float()),
+            sa.Column("median_raw", sa.Float()),
+            sa.Column("min_raw", sa.Float()),
+            sa.Column("max_raw", sa.Float()),
+            sa.Column("uploaded_at", sa.DateTime()),
+            sa.PrimaryKeyConstraint("id", "scenario", "month"),
+            schema="public",
+            postgresql_partition_by="LIST (scenario)",
+        )
+        create_partitions(table, month_literal=lambda month: f"'{month}'")
+
+        op.execute(
+            f'INSERT INTO "{table}" (id, {ADMIN_COLUMNS}, product, scenario, month, {STAT_COLUMNS}) '
+            f'SELECT id, {ADMIN_COLUMNS}, product, scenario, month, {STAT_COLUMNS} FROM "{table}_backfill"'
+        )
+        op.drop_table(f"{table}_backfill")
+
+    bind = op.get_bind()
+    scenario_name.drop(bind, checkfirst=True)
+    product_name.drop(bind, checkfirst=True)
@@ -0,0 +1,55 @@
+"""add statistics in physical units to product tables
+
+Revision ID: f2a9c4e7b180
+Revises: e6f0b2d8c315
+Create Date: 2026-10-17 20:03:19.640217
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f2a9c4e7b180"
+down_revision: Union[str, None] = "e6f0b2d8c315"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PRODUCT_TABLES = ["temp", "tmin", "tmax", "prec", "bio"]
+VALUE_COLUMNS = ["mean_value", "median_value", "min_value", "max_value"]
+
+# (unit, scale) of every product, and of every bioclimatic variable (month of the bio table),
+# as in pipeline/transforms.py when the columns were added
+PRODUCT_UNITS = {"temp": ("celsius", 0.1), "tmin": ("celsius", 0.1), "tmax": ("celsius", 0.1), "prec": ("mm", 1.0)}
+BIO_UNITS = {
+    **{month: ("celsius", 0.1) for month in [1, 2, 5, 6, 7, 8, 9, 10, 11]},
+    3: ("percent", 1.0),
+    4: ("celsius", 0.01),
+    12: ("mm", 1.0),
+}
+
+
+def upgrade() -> None:
+    # Columns added to a partitioned table are added to its partitions
+    for table in PRODUCT_TABLES:
+        for column in VALUE_COLUMNS:
+            op.add_column(table, sa.Column(column, sa.Float()))
+        op.add_column(table, sa.Column("unit", sa.String(length=16)))
+
+    for table in PRODUCT_TABLES:
+        units = {None: PRODUCT_UNITS[table]} if table in PRODUCT_UNITS else BIO_UNITS
+        for month, (unit, scale) in units.items():
+            values = ", ".join(f"{column} = {column.replace('_value', '_raw')} * {scale}" for column in VALUE_COLUMNS)
+            op.execute(
+                f"UPDATE \"{table}\" SET {values}, unit = '{unit}'"
+                + ("" if month is None else f" WHERE month = {month}")
+            )
+
+
+def downgrade() -> None:
+    for table in PRODUCT_TABLES:
+        op.drop_column(table, "unit")
+        for column in reversed(VALUE_COLUMNS):
+            op.drop_column(table, column)
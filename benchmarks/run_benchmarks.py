@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "pipeline"))
+from climatology import Month, Product, Scenario, get_climatology
+from config import read_config
+from functions import (calculate_zonal_statistics, crop_raster_with_geometry,
+                       write_local_raster, yearly_table_generator)
+from session import get_session
+from sqlalchemy import delete
+from store import get_partition_path, write_table
+from tables import UploadHashTable, get_table
+from upload import upload_to_db
+
+from benchmarks.synthetic import (SCALES, Scale, get_raster_bounds,
+                                  make_voronoi_zones, write_synthetic_raster)
+
+config = read_config("config.json")
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines.json"
+
+# A stage fails when it is slower than its baseline by more than this share,
+# and by more than the noise of a stage that only takes a few milliseconds
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_MIN_DELTA_SECONDS = 0.05
+
+# Precipitation has no unit conversion, so the yearly table times only reading and concatenating
+BENCHMARK_PRODUCT = Product.PREC
+BENCHMARK_SCENARIO = Scenario.ACCESS1_0_rcp45
+
+
+@dataclass
+class BenchmarkResult:
+    """Best of the timed repeats of a stage at a scale"""
+
+    stage: str
+    scale: str
+    seconds: float
+    repeats: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.scale}/{self.stage}"
+
+
+def time_stage(
+    stage: str,
+    scale: str,
+    function: Callable[[], None],
+    repeats: int,
+    setup: Optional[Callable[[], None]] = None,
+) -> BenchmarkResult:
+    """Times a stage several times and keeps the fastest run, which is the least disturbed by
+    other processes. setup runs before every repeat and is not timed.
+
+    Args:
+        stage (str): Name of the stage
+        scale (str): Name of the scale of the inputs
+        function (Callable[[], None]): Stage to time
+        repeats (int): Number of timed runs
+        setup (Optional[Callable[[], None]], optional): Untimed preparation of every run. Defaults to None.
+
+    Returns:
+        BenchmarkResult: Fastest run
+    """
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    result = BenchmarkResult(stage=stage, scale=scale, seconds=min(timings), repeats=repeats)
+    print(f"{result.key}: {result.seconds:.3f}s (best of {repeats})")
+    return result
+
+
+def run_benchmarks(
+    scale_name: str,
+    scale: Scale,
+    work_dir: Path,
+    repeats: int = 3,
+    engines: Optional[list[str]] = None,
+) -> list[BenchmarkResult]:
+    """Generates the synthetic inputs of a scale and times cropping, zonal statistics,
+    the yearly table and the upload to a SQLite stand-in of the database
+
+    Args:
+        scale_name (str): Name of the scale, used in the result keys
+        scale (Scale): Number of zones and raster size
+        work_dir (Path): Directory of the synthetic inputs and outputs
+        repeats (int, optional): Timed runs per stage. Defaults to 3.
+        engines (Optional[list[str]], optional): Zonal statistics engines to time. Defaults to config.zonal_engine.
+
+    Returns:
+        list[BenchmarkResult]: One result per stage
+    """
+    engines = engines or [config.zonal_engine]
+    raw_raster = write_synthetic_raster(work_dir / "raw.tif", width=scale.width, height=scale.height)
+    zones = make_voronoi_zones(
+        n_zones=scale.n_zones, bounds=get_raster_bounds(width=scale.width, height=scale.height)
+    )
+    chelsa_product = get_climatology(product=BENCHMARK_PRODUCT, scenario=BENCHMARK_SCENARIO, month=Month.JANUARY)
+
+    results = [
+        time_stage(
+            stage="crop_raster_with_geometry",
+            scale=scale_name,
+            function=lambda: crop_raster_with_geometry(raster_location=raw_raster, gdf=zones),
+            repeats=repeats,
+        )
+    ]
+    masked_raster = work_dir / "masked.tif"
+    write_local_raster(*crop_raster_with_geometry(raster_location=raw_raster, gdf=zones), out_path=masked_raster)
+
+    for engine in engines:
+        results.append(
+            time_stage(
+                stage=f"calculate_zonal_statistics[{engine}]",
+                scale=scale_name,
+                function=lambda: calculate_zonal_statistics(
+                    raster_location=raw_raster if engine == "coverage" else masked_raster,
+                    geometry=zones.copy(),
+                    chelsa_product=chelsa_product,
+                    place_id=config.adm_unique_id,
+                    engine=engine,
+                ),
+                repeats=repeats,
+            )
+        )
+
+    # The zonal statistics of one month are copied to every month of the yearly table
+    zonal_dir = work_dir / "zonal_statistics"
+    zonal_statistics = calculate_zonal_statistics(
+        raster_location=masked_raster,
+        geometry=zones.copy(),
+        chelsa_product=chelsa_product,
+        place_id=config.adm_unique_id,
+        engine=engines[0] if engines[0] != "coverage" else "vectorized",
+    )
+    for month in Month:
+        write_table(
+            df=zonal_statistics.assign(month=str(month.value)),
+            path=get_partition_path(
+                dataset_dir=zonal_dir,
+                product=BENCHMARK_PRODUCT.value,
+                scenario=BENCHMARK_SCENARIO.value,
+                month=month.value,
+            ),
+        )
+
+    results.append(
+        time_stage(
+            stage="yearly_table_generator",
+            scale=scale_name,
+            function=lambda: yearly_table_generator(
+                product=chelsa_product, zonal_dir=zonal_dir, sort_values=[config.adm_unique_id, "month"]
+            ),
+            repeats=repeats,
+        )
+    )
+
+    product_table = get_table(table_name=BENCHMARK_PRODUCT.value).__table__
+
+    def recreate_product_table() -> None:
+        # The stored content hashes are cleared too, otherwise repeats would skip the upload
+        with get_session() as Session:
+            with Session() as session:
+                product_table.drop(bind=session.connection(), checkfirst=True)
+                product_table.create(bind=session.connection())
+                UploadHashTable.__table__.create(bind=session.connection(), checkfirst=True)
+                session.execute(delete(UploadHashTable))
+                session.commit()
+
+    # Uploads go to a temporary database, and the caller's DATABASE_URL is restored afterwards
+    database_url = os.environ.get("DATABASE_URL")
+    os.environ["DATABASE_URL"] = f"sqlite:///{work_dir}/benchmark.db"
+    try:
+        results.append(
+            time_stage(
+                stage="upload_to_db",
+                scale=scale_name,
+                function=lambda: upload_to_db(
+                    df_path=get_partition_path(
+                        dataset_dir=zonal_dir,
+                        product=BENCHMARK_PRODUCT.value,
+                        scenario=BENCHMARK_SCENARIO.value,
+                        month=Month.JANUARY.value,
+                    ),
+                    table_name=BENCHMARK_PRODUCT.value,
+                ),
+                repeats=repeats,
+                setup=recreate_product_table,
+            )
+        )
+    finally:
+        if database_url is None:
+            os.environ.pop("DATABASE_URL", None)
+        else:
+            os.environ["DATABASE_URL"] = database_url
+
+    return results
+
+
+def read_baselines(baseline_path: Path = BASELINE_PATH) -> dict[str, float]:
+    """Baseline seconds per scale and stage, or an empty dict if there are no baselines"""
+    if not baseline_path.exists():
+        return {}
+    with open(baseline_path, encoding="utf-8") as f:
+        return json.load(f)["stages"]
+
+
+def write_baselines(results: list[BenchmarkResult], baseline_path: Path = BASELINE_PATH) -> None:
+    """Saves the results as baselines, keeping the baselines of stages and scales that did not run"""
+    stages = read_baselines(baseline_path=baseline_path)
+    stages.update({result.key: round(result.seconds, 4) for result in results})
+
+    baselines = {
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+        "machine": f"{platform.system()} {platform.machine()}, Python {platform.python_version()}",
+        "stages": dict(sorted(stages.items())),
+    }
+    with open(baseline_path, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=4)
+        f.write("\n")
+
+
+def find_regressions(
+    results: list[BenchmarkResult],
+    baselines: dict[str, float],
+    threshold: float = DEFAULT_THRESHOLD,
+    min_delta_seconds: float = DEFAULT_MIN_DELTA_SECONDS,
+) -> list[str]:
+    """Stages slower than their baseline by more than the threshold and by more than min_delta_seconds
+
+    Args:
+        results (list[BenchmarkResult]): Results of the run
+        baselines (dict[str, float]): Baseline seconds per scale and stage
+        threshold (float, optional): Allowed slowdown, as a share of the baseline. Defaults to DEFAULT_THRESHOLD.
+        min_delta_seconds (float, optional): Slowdowns of fewer seconds are ignored. Defaults to DEFAULT_MIN_DELTA_SECONDS.
+
+    Returns:
+        list[str]: One message per regressed stage
+    """
+    regressions = []
+    for result in results:
+        baseline = baselines.get(result.key)
+        if baseline is None or result.seconds - baseline <= min_delta_seconds:
+            continue
+        if result.seconds > baseline * (1 + threshold):
+            regressions.append(
+                f"{result.key}: {result.seconds:.3f}s vs baseline {baseline:.3f}s "
+                f"(+{(result.seconds / baseline - 1):.0%}, threshold {threshold:.0%})"
+            )
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic CHELSA-like inputs")
+    parser.add_argument("--scale", choices=SCALES, nargs="+", default=["small"])
+    parser.add_argument("--width", type=int, help="Override the raster width of the scales")
+    parser.add_argument("--height", type=int, help="Override the raster height of the scales")
+    parser.add_argument("--engines", nargs="+", help="Zonal statistics engines. Defaults to config.zonal_engine.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA_SECONDS)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Save the results as the new baselines")
+    args = parser.parse_args(argv)
+
+    results = []
+    for scale_name in args.scale:
+        scale = SCALES[scale_name]
+        scale = Scale(
+            n_zones=scale.n_zones, width=args.width or scale.width, height=args.height or scale.height
+        )
+        with tempfile.TemporaryDirectory(prefix=f"benchmark_{scale_name}_") as work_dir:
+            results.extend(
+                run_benchmarks(
+                    scale_name=scale_name,
+                    scale=scale,
+                    work_dir=Path(work_dir),
+                    repeats=args.repeats,
+                    engines=args.engines,
+                )
+            )
+
+    if args.update_baseline:
+        write_baselines(results=results, baseline_path=args.baseline)
+        print(f"Baselines saved to {args.baseline}")
+        return 0
+
+    regressions = find_regressions(
+        results=results,
+        baselines=read_baselines(baseline_path=args.baseline),
+        threshold=args.threshold,
+        min_delta_seconds=args.min_delta,
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Union
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from shapely import MultiPoint, box, voronoi_polygons
+
+# CHELSA rasters are int16 with -32768 as nodata, at 30 arc seconds
+CHELSA_DTYPE = "int16"
+CHELSA_NODATA = -32768
+CHELSA_RESOLUTION = 1 / 120
+
+# Upper left corner of the synthetic rasters, roughly the corner of West and Central Africa
+ORIGIN = (-18.0, 28.0)
+
+# Share of raster columns on the west side filled with nodata, standing in for the ocean
+OCEAN_FRACTION = 0.1
+
+
+@dataclass(frozen=True)
+class Scale:
+    """Size of the synthetic inputs of a benchmark run"""
+
+    n_zones: int
+    width: int
+    height: int
+
+
+SCALES = {
+    "small": Scale(n_zones=100, width=1200, height=900),
+    "medium": Scale(n_zones=1_000, width=3600, height=2700),
+    "large": Scale(n_zones=10_000, width=7200, height=5400),
+}
+
+
+def get_raster_bounds(width: int, height: int) -> tuple[float, float, float, float]:
+    """(left, bottom, right, top) of a synthetic raster"""
+    left, top = ORIGIN
+    return left, top - height * CHELSA_RESOLUTION, left + width * CHELSA_RESOLUTION, top
+
+
+def write_synthetic_raster(out_path: Union[str, Path], width: int, height: int, seed: int = 0) -> Path:
+    """Writes a CHELSA-like int16 GeoTIFF: a smooth north-south gradient in C/10 with noise,
+    and nodata over the ocean columns. The same seed always produces the same raster.
+
+    Args:
+        out_path (Union[str, Path]): Location of the GeoTIFF
+        width (int): Number of columns
+        height (int): Number of rows
+        seed (int, optional): Seed of the noise. Defaults to 0.
+
+    Returns:
+        Path: Location of the GeoTIFF
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(350, 150, height, dtype=np.float32)[:, np.newaxis]
+    noise = rng.normal(0, 20, size=(height, width)).astype(np.float32)
+    raster = np.rint(gradient + noise).astype(CHELSA_DTYPE)
+    raster[:, : int(width * OCEAN_FRACTION)] = CHELSA_NODATA
+
+    profile = {
+        "driver": "GTiff",
+        "dtype": CHELSA_DTYPE,
+        "count": 1,
+        "width": width,
+        "height": height,
+        "crs": "EPSG:4326",
+        "transform": from_origin(*ORIGIN, CHELSA_RESOLUTION, CHELSA_RESOLUTION),
+        "nodata": CHELSA_NODATA,
+        "tiled": True,
+        "compress": "deflate",
+    }
+    with rasterio.open(out_path, "w", **profile) as dest:
+        dest.write(raster, 1)
+
+    return Path(out_path)
+
+
+def make_voronoi_zones(
+    n_zones: int, bounds: tuple[float, float, float, float], seed: int = 0
+) -> gpd.GeoDataFrame:
+    """Admin-like boundaries: Voronoi cells of random points, clipped to the bounds, with the
+    cleaned columns of the admin 2 boundaries. Cells are grouped into countries and admin 1 areas
+    by their position. The same seed always produces the same zones.
+
+    Args:
+        n_zones (int): Number of zones
+        bounds (tuple[float, float, float, float]): (left, bottom, right, top) covered by the zones
+        seed (int, optional): Seed of the points. Defaults to 0.
+
+    Returns:
+        gpd.GeoDataFrame: Zones in EPSG:4326, in the order of their points
+    """
+    rng = np.random.default_rng(seed)
+    left, bottom, right, top = bounds
+    points = np.column_stack(
+        [rng.uniform(left, right, n_zones), rng.uniform(bottom, top, n_zones)]
+    )
+
+    extent = box(*bounds)
+    cells = voronoi_polygons(MultiPoint(points), extend_to=extent).geoms
+    # voronoi_polygons does not return the cells in the order of the points
+    cell_of_point = gpd.GeoSeries(list(cells)).sindex.query(
+        gpd.points_from_xy(points[:, 0], points[:, 1]), predicate="within"
+    )
+    order = np.full(n_zones, -1)
+    order[cell_of_point[0]] = cell_of_point[1]
+    geometries = [cells[i].intersection(extent) for i in order]
+
+    country = np.floor((points[:, 0] - left) / (right - left) * 4).astype(int)
+    adm1 = country * 10 + np.floor((points[:, 1] - bottom) / (top - bottom) * 5).astype(int)
+    iso2_codes = [chr(ord("A") + c) * 2 for c in country]
+
+    return gpd.GeoDataFrame(
+        {
+            "iso2_code": iso2_codes,
+            "adm0_name": [f"Country {code}" for code in iso2_codes],
+            "adm1_name": [f"Region {a}" for a in adm1],
+            "adm2_name": [f"District {i}" for i in range(n_zones)],
+            "adm1_id": [f"{code}{a:02d}" for code, a in zip(iso2_codes, adm1)],
+            "adm2_id": [f"{code}{a:02d}{i:05d}" for code, a, i in zip(iso2_codes, adm1, range(n_zones))],
+        },
+        geometry=geometries,
+        crs="EPSG:4326",
+    )
@@ -1,19 +1,63 @@
-from sqlalchemy import Column, DateTime, Float, String
+from climatology import Product, Scenario
+from sqlalchemy import Column, DateTime, Enum, Float, SmallInteger, String
+
+# Postgres enum types of the product and scenario columns. Adding a scenario to
+# climatology.Scenario needs a migration adding the value to scenario_name.
+ProductName = Enum(*[product.value for product in Product], name="product_name")
+ScenarioName = Enum(*[scenario.value for scenario in Scenario], name="scenario_name")
 
 
 class BaseTable:
-    id = Column(String, primary_key=True)
-    iso2_code = Column(String(2))
-    adm0_name = Column(String(128))
+    """Columns of a product table, one row per admin 2 area, scenario and month.
+    On Postgres, product tables are partitioned by scenario, and every scenario
+    partition by month (see partitions.py)."""
+
+    __table_args__ = {"postgresql_partition_by": "LIST (scenario)"}
+
+    iso2_code = Column(String(2), index=True)
+    adm0_name = Column(String(128), index=True)
     adm1_name = Column(String(128))
     adm2_name = Column(String(128))
     adm1_id = Column(String(128))
-    adm2_id = Column(String(128))
-    product = Column(String(), nullable=False)
-    scenario = Column(String(), nullable=False)
-    month = Column(String, nullable=False)
+    # Partitioned tables need the partition keys in their primary key
+    adm2_id = Column(String(128), primary_key=True)
+    product = Column(ProductName, nullable=False)
+    scenario = Column(ScenarioName, primary_key=True)
+    month = Column(SmallInteger, primary_key=True)
     mean_raw = Column(Float)
     median_raw = Column(Float)
     min_raw = Column(Float)
     max_raw = Column(Float)
+    # Statistics in physical units, see transforms.py
+    mean_value = Column(Float)
+    median_value = Column(Float)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    unit = Column(String(16))
+    uploaded_at = Column(DateTime, nullable=False)
+
+
+class EnsembleBaseTable:
+    """Multi-model ensemble statistics of a product, one row per admin 2 area, RCP pathway and
+    month, computed across the scenarios (GCMs) of the pathway (see ensemble.py)"""
+
+    iso2_code = Column(String(2), index=True)
+    adm0_name = Column(String(128), index=True)
+    adm1_name = Column(String(128))
+    adm2_name = Column(String(128))
+    adm1_id = Column(String(128))
+    adm2_id = Column(String(128), primary_key=True)
+    product = Column(ProductName, nullable=False)
+    # RCP pathway, eg. "rcp45"
+    scenario = Column(String(16), primary_key=True)
+    month = Column(SmallInteger, primary_key=True)
+    n_models = Column(SmallInteger, nullable=False)
+    ensemble_mean = Column(Float)
+    ensemble_std = Column(Float)
+    ensemble_min = Column(Float)
+    ensemble_max = Column(Float)
+    ensemble_p10 = Column(Float)
+    ensemble_median = Column(Float)
+    ensemble_p90 = Column(Float)
+    unit = Column(String(16))
     uploaded_at = Column(DateTime, nullable=False)
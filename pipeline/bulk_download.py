@@ -0,0 +1,298 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+import requests
+from climatology import (ChelsaProduct, Month, Product, Scenario,
+                         get_product_matrix)
+from config import read_config
+from download import get_download_bounds, process_raw_raster
+from ledger import (StepStatus, get_ledger_key, read_ledger,
+                    record_completed_step, record_step)
+from manifest import download_manifest
+from metrics import measure
+from processing_steps import RasterProcessingStep, get_step_outputs
+from rasterio.crs import CRS
+from rasterio.errors import RasterioIOError
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+config = read_config("config.json")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class DownloadResult:
+    """Outcome of a single raster download"""
+
+    chelsa_product: ChelsaProduct
+    succeeded: bool
+    bytes_downloaded: int = 0
+    attempts: int = 0
+    duration_seconds: float = 0
+    error: Optional[str] = None
+
+
+def get_download_matrix(
+    products: Optional[list[Product]] = None,
+    scenarios: Optional[list[Scenario]] = None,
+    months: Optional[list[Month]] = None,
+    windowed: bool = config.windowed_download,
+) -> list[ChelsaProduct]:
+    """Build the product x scenario x month catalogue of rasters that still need to be downloaded.
+    Scenarios that are not available for a product are skipped.
+
+    Args:
+        products (Optional[list[Product]], optional): Products to include. Defaults to all products.
+        scenarios (Optional[list[Scenario]], optional): Scenarios to include. Defaults to all scenarios.
+        months (Optional[list[Month]], optional): Months to include. Defaults to all months.
+        windowed (bool, optional): Whether rasters are downloaded as windows. Defaults to config.windowed_download.
+
+    Returns:
+        list[ChelsaProduct]: Products whose raw raster is not up to date according to the run ledger
+    """
+    catalogue = get_product_matrix(products=products, scenarios=scenarios, months=months)
+    settings = config.copy(update={"windowed_download": windowed})
+    ledger = read_ledger(chelsa_products=catalogue)
+    matrix = []
+    for chelsa_product in catalogue:
+        entry = ledger.get((*get_ledger_key(chelsa_product), RasterProcessingStep.DOWNLOAD.name))
+        if entry is None or not entry.is_current(
+            manifest=download_manifest(chelsa_product, settings),
+            output_paths=get_step_outputs(chelsa_product=chelsa_product, step=RasterProcessingStep.DOWNLOAD),
+        ):
+            matrix.append(chelsa_product)
+
+    return matrix
+
+
+def download_matrix(
+    products: Optional[list[Product]] = None,
+    scenarios: Optional[list[Scenario]] = None,
+    months: Optional[list[Month]] = None,
+    max_workers: int = config.download_workers,
+    retries: int = config.download_retries,
+    windowed: bool = config.windowed_download,
+) -> list[DownloadResult]:
+    """Download all missing raw rasters of the requested matrix with a bounded thread pool.
+    Connections are reused through a shared HTTP session, failed downloads are retried
+    with exponential backoff and partially downloaded files are resumed.
+
+    Args:
+        products (Optional[list[Product]], optional): Products to download. Defaults to all products.
+        scenarios (Optional[list[Scenario]], optional): Scenarios to download. Defaults to all scenarios.
+        months (Optional[list[Month]], optional): Months to download. Defaults to all months.
+        max_workers (int, optional): Maximum number of concurrent downloads. Defaults to config.download_workers.
+        retries (int, optional): Attempts per raster before giving up. Defaults to config.download_retries.
+        windowed (bool, optional): Only fetch the window covering the geometry. Defaults to config.windowed_download.
+
+    Returns:
+        list[DownloadResult]: One result per raster, in completion order
+    """
+    matrix = get_download_matrix(products=products, scenarios=scenarios, months=months, windowed=windowed)
+    if len(matrix) == 0:
+        logger.info("All requested rasters are already downloaded")
+        return []
+
+    bounds, bounds_crs = None, None
+    if windowed:
+        bounds, bounds_crs = get_download_bounds(geom_path=config.geom_path)
+
+    session = _get_http_session(pool_size=max_workers)
+    progress = _DownloadProgress(total=len(matrix))
+    results = []
+
+    logger.info(f"Downloading {len(matrix)} rasters with {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _download_with_retries,
+                chelsa_product=chelsa_product,
+                session=session,
+                retries=retries,
+                bounds=bounds,
+                bounds_crs=bounds_crs,
+            )
+            for chelsa_product in matrix
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            progress.update(result)
+            _record_download(result=result, windowed=windowed)
+            results.append(result)
+
+    session.close()
+    failed = [result for result in results if not result.succeeded]
+    logger.info(
+        f"Finished downloads: {len(results) - len(failed)} succeeded, {len(failed)} failed, {progress.bytes_downloaded} bytes"
+    )
+
+    return results
+
+
+def _record_download(result: DownloadResult, windowed: bool) -> None:
+    """Record a download in the run ledger, so the download step is not planned again"""
+    chelsa_product = result.chelsa_product
+    manifest = download_manifest(chelsa_product, config.copy(update={"windowed_download": windowed}))
+    if result.succeeded:
+        record_completed_step(
+            chelsa_product=chelsa_product,
+            manifest=manifest,
+            output_paths=[chelsa_product.raw_raster_path],
+            duration_seconds=result.duration_seconds,
+        )
+    else:
+        record_step(
+            chelsa_product=chelsa_product,
+            step=manifest.step,
+            status=StepStatus.FAILED,
+            input_fingerprint=manifest.fingerprint,
+            duration_seconds=result.duration_seconds,
+            error=result.error,
+        )
+
+
+class _DownloadProgress:
+    """Thread-safe counter used to log download progress"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.completed = 0
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+
+    def update(self, result: DownloadResult) -> None:
+        with self._lock:
+            self.completed += 1
+            self.bytes_downloaded += result.bytes_downloaded
+            status = "downloaded" if result.succeeded else f"failed ({result.error})"
+            logger.info(
+                f"[{self.completed}/{self.total}] {result.chelsa_product.product.value}_{result.chelsa_product.scenario.value}_{result.chelsa_product.month.value} {status}"
+            )
+
+
+def _get_http_session(pool_size: int) -> requests.Session:
+    """HTTP session whose connection pool is large enough for every worker to keep its connection alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _download_with_retries(
+    chelsa_product: ChelsaProduct,
+    session: requests.Session,
+    retries: int,
+    bounds: Optional[Tuple[float, float, float, float]] = None,
+    bounds_crs: Optional[CRS] = None,
+    backoff: float = 2.0,
+) -> DownloadResult:
+    """Download a single raster, retrying with exponential backoff
+
+    Args:
+        chelsa_product (ChelsaProduct): Product, scenario and month to download
+        session (requests.Session): Shared HTTP session
+        retries (int): Maximum number of attempts
+        bounds (Optional[Tuple[float, float, float, float]], optional): Window to fetch. Defaults to None (whole raster).
+        bounds_crs (Optional[CRS], optional): CRS of the bounds. Defaults to None.
+        backoff (float, optional): Base number of seconds to wait between attempts. Defaults to 2.0.
+
+    Returns:
+        DownloadResult: Outcome of the download
+    """
+    error = None
+    start = time.perf_counter()
+    for attempt in range(1, retries + 1):
+        try:
+            with measure("download"):
+                if bounds is None:
+                    bytes_downloaded = _download_full_raster(chelsa_product=chelsa_product, session=session)
+                else:
+                    bytes_downloaded = _download_raster_window(
+                        chelsa_product=chelsa_product, bounds=bounds, bounds_crs=bounds_crs
+                    )
+            return DownloadResult(
+                chelsa_product=chelsa_product,
+                succeeded=True,
+                bytes_downloaded=bytes_downloaded,
+                attempts=attempt,
+                duration_seconds=time.perf_counter() - start,
+            )
+        except (requests.RequestException, RasterioIOError, OSError) as e:
+            error = str(e)
+            logger.warning(f"Attempt {attempt} failed for {chelsa_product.raw_raster_path}: {error}")
+            if attempt < retries:
+                time.sleep(backoff ** attempt)
+
+    return DownloadResult(
+        chelsa_product=chelsa_product,
+        succeeded=False,
+        attempts=retries,
+        duration_seconds=time.perf_counter() - start,
+        error=error,
+    )
+
+
+def _download_full_raster(chelsa_product: ChelsaProduct, session: requests.Session) -> int:
+    """Stream the whole raster to disk. A partial file left by a failed attempt is resumed
+    with a byte range request, and only renamed to the raw raster path once complete.
+
+    Returns:
+        int: Number of bytes transferred
+    """
+    url = chelsa_product.get_url(scenario=chelsa_product.scenario, month=chelsa_product.month)
+    out_path = Path(chelsa_product.raw_raster_path)
+    partial_path = out_path.with_suffix(".tif.part")
+
+    offset = partial_path.stat().st_size if partial_path.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+
+    bytes_downloaded = 0
+    with session.get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 416:
+            # Range not satisfiable: the partial file already holds the whole raster
+            os.replace(partial_path, out_path)
+            return 0
+
+        response.raise_for_status()
+        mode = "ab" if response.status_code == 206 else "wb"
+        with open(partial_path, mode) as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                file.write(chunk)
+                bytes_downloaded += len(chunk)
+
+    os.replace(partial_path, out_path)
+    return bytes_downloaded
+
+
+def _download_raster_window(
+    chelsa_product: ChelsaProduct,
+    bounds: Tuple[float, float, float, float],
+    bounds_crs: Optional[CRS],
+) -> int:
+    """Fetch the window of the raster covering the bounds, writing it atomically
+
+    Returns:
+        int: Size of the written raster in bytes
+    """
+    out_path = Path(chelsa_product.raw_raster_path)
+    partial_path = out_path.with_name(f"{out_path.stem}.partial.tif")
+
+    process_raw_raster(
+        product=chelsa_product,
+        scenario=chelsa_product.scenario,
+        month=chelsa_product.month,
+        raw_out_path=partial_path,
+        bounds=bounds,
+        bounds_crs=bounds_crs,
+    )
+    os.replace(partial_path, out_path)
+    return out_path.stat().st_size
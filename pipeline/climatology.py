@@ -3,6 +3,7 @@ from abc import ABC
 from dataclasses import dataclass, field
 from enum import Enum, auto
 from pathlib import Path
+from typing import Optional
 
 
 class Product(Enum):
@@ -107,6 +108,7 @@ class ChelsaProduct(ABC):
         """
 
         from config import read_config
+        from store import get_partition_path
 
         config = read_config("config.json")
 
@@ -116,8 +118,11 @@ class ChelsaProduct(ABC):
 
         self.raw_raster_dir = Path(f"{base_path}/{config.raw_raster_dir}/")
         self.cropped_raster_dir = Path(f"{base_path}/{config.cropped_raster_dir}/")
-        self.zonal_stats_dir = Path(f"{base_path}/{config.zonal_stats_dir}/")
-        self.yearly_aggregate_dir = Path(f"{base_path}/{config.yearly_aggregate_dir}/")
+        # Zonal statistics and yearly tables are Parquet datasets of all products and scenarios
+        self.zonal_stats_dir = Path(f"{config.root_dir}/{self.phase.value}/{config.zonal_stats_dir}/")
+        self.yearly_aggregate_dir = Path(f"{config.root_dir}/{self.phase.value}/{config.yearly_aggregate_dir}/")
+        self.ensemble_dir = Path(f"{config.root_dir}/{self.phase.value}/{config.ensemble_dir}/")
+        self.rollup_dir = Path(f"{config.root_dir}/{self.phase.value}/{config.rollup_dir}/")
 
         self.raw_raster_path = Path(
             f"{self.raw_raster_dir}/{self.scenario.value}_{self.month.value}.tif"
@@ -125,18 +130,27 @@ class ChelsaProduct(ABC):
         self.cropped_raster_path = Path(
             f"{self.cropped_raster_dir}/{self.scenario.value}_{self.month.value}.tif"
         )
-        self.zonal_file_path = Path(
-            f"{self.zonal_stats_dir}/{self.scenario.value}_{self.month.value}.csv"
+        self.zonal_file_path = get_partition_path(
+            dataset_dir=self.zonal_stats_dir,
+            product=self.product.value,
+            scenario=self.scenario.value,
+            month=self.month.value,
         )
-        self.yearly_aggregate_path = Path(
-            f"{self.yearly_aggregate_dir}/{self.scenario.value}_{self.month.value}_yearly.csv"
+        self.rollup_file_path = get_partition_path(
+            dataset_dir=self.rollup_dir,
+            product=self.product.value,
+            scenario=self.scenario.value,
+            month=self.month.value,
+        )
+        self.yearly_aggregate_path = get_partition_path(
+            dataset_dir=self.yearly_aggregate_dir, product=self.product.value, scenario=self.scenario.value
         )
 
         directories = [
             self.raw_raster_dir,
             self.cropped_raster_dir,
-            self.zonal_stats_dir,
-            self.yearly_aggregate_dir,
+            self.zonal_file_path.parent,
+            self.yearly_aggregate_path.parent,
         ]
 
         self._create_directories(pathways=directories)
@@ -264,11 +278,42 @@ def get_climatology(
         )
 
     factories = {
-        "temp": Temperature(scenario=scenario, month=month),
-        "bio": Bio(scenario=scenario, month=month),
-        "prec": Precipitation(scenario=scenario, month=month),
-        "tmax": MaximumTemperature(scenario=scenario, month=month),
-        "tmin": MinimumTemperature(scenario=scenario, month=month),
+        "temp": Temperature,
+        "bio": Bio,
+        "prec": Precipitation,
+        "tmax": MaximumTemperature,
+        "tmin": MinimumTemperature,
     }
 
-    return factories[lower_case_product]
+    return factories[lower_case_product](scenario=scenario, month=month)
+
+
+def get_product_matrix(
+    products: Optional[list[Product]] = None,
+    scenarios: Optional[list[Scenario]] = None,
+    months: Optional[list[Month]] = None,
+) -> list[ChelsaProduct]:
+    """Product x scenario x month catalogue. Scenarios that are not available for a product are skipped.
+
+    Args:
+        products (Optional[list[Product]], optional): Products to include. Defaults to all products.
+        scenarios (Optional[list[Scenario]], optional): Scenarios to include. Defaults to all scenarios.
+        months (Optional[list[Month]], optional): Months to include. Defaults to all months.
+
+    Returns:
+        list[ChelsaProduct]: Concrete products, ordered by product, scenario and month
+    """
+    products = products or [product for product in Product]
+    scenarios = scenarios or [scenario for scenario in Scenario]
+    months = months or [month for month in Month]
+
+    matrix = []
+    for product in products:
+        for scenario in scenarios:
+            for month in months:
+                chelsa_product = get_climatology(product=product, scenario=scenario, month=month)
+                if scenario not in chelsa_product.available_scenarios:
+                    break
+                matrix.append(chelsa_product)
+
+    return matrix
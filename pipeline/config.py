@@ -1,5 +1,6 @@
 import json
 from pathlib import Path
+from typing import Literal, Optional
 
 from climatology import Month, Product, Scenario
 from pydantic import BaseSettings, ValidationError
@@ -16,9 +17,38 @@ class CMIPConfig(BaseSettings):
     cropped_raster_dir: str
     zonal_stats_dir: str
     yearly_aggregate_dir: str
+    ensemble_dir: str = "ensemble"
+    rollup_dir: str = "rollups"
+    cache_dir: str = "cache"
     product: Product
     scenario: Scenario
     month: Month
+    windowed_download: bool = True
+    download_workers: int = 8
+    download_retries: int = 3
+    zonal_engine: Literal["rasterstats", "vectorized", "coverage", "streaming", "parallel"] = "rasterstats"
+    coverage_supersample: int = 10
+    streaming: bool = False
+    memory_budget_mb: int = 512
+    histogram_bins: int = 2048
+    admin_rollups: list[Literal["adm1", "adm0"]] = []
+    zonal_workers: Optional[int] = None
+    zone_cache: bool = True
+    cpu_workers: Optional[int] = None
+    upload_workers: int = 2
+    failure_policy: Literal["continue", "fail_fast"] = "continue"
+    queue_lease_seconds: int = 300
+    queue_max_attempts: int = 3
+    metrics: bool = True
+    metrics_dir: str = "metrics"
+    trace_memory: bool = False
+    profile_stages: list[str] = []
+    profiler: Literal["cprofile", "pyinstrument"] = "cprofile"
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_pre_ping: bool = True
+    db_statement_timeout_seconds: Optional[int] = None
+    upload_mode: Literal["merge", "replace"] = "merge"
 
 
 def read_config(config_file: str) -> CMIPConfig:
@@ -0,0 +1,243 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+from affine import Affine
+from config import read_config
+from rasterio.crs import CRS
+from scipy import sparse
+from vector_processing import fingerprint_geometry_file, load_geometry
+from zonal_engine import rasterize_zones
+from zone_cache import fingerprint_grid
+
+logger = logging.getLogger(__name__)
+
+config = read_config("config.json")
+
+AVAILABLE_WEIGHTED_STATISTICS = ["count", "sum", "min", "max", "mean", "median"]
+
+# Upper bound of sub-pixels rasterized at once when estimating coverage
+MAX_SUBPIXELS_PER_STRIP = 2**24
+
+
+def compute_coverage_weights(
+    geometry: gpd.GeoDataFrame,
+    transform: Affine,
+    shape: Tuple[int, int],
+    supersample: int = config.coverage_supersample,
+) -> sparse.csr_matrix:
+    """Fraction of every pixel covered by every geometry, as a sparse (zone, pixel) matrix.
+    Coverage is estimated by rasterizing the geometries on a grid supersample times finer
+    than the raster and counting the sub-pixels of each pixel that fall in each geometry.
+    The fine grid is processed in strips of rows to bound memory.
+
+    Args:
+        geometry (gpd.GeoDataFrame): Geometries that define the zones, in the raster's CRS
+        transform (Affine): Transform of the raster grid
+        shape (Tuple[int, int]): (height, width) of the raster grid
+        supersample (int, optional): Sub-pixels per pixel side. Defaults to config.coverage_supersample.
+
+    Returns:
+        sparse.csr_matrix: Matrix of shape (n_zones, height * width) with coverage fractions in [0, 1]
+    """
+    height, width = shape
+    strip_rows = max(1, MAX_SUBPIXELS_PER_STRIP // (width * supersample * supersample))
+    fine_columns = np.arange(width * supersample) // supersample
+
+    n_pixels = height * width
+    zones, pixels, counts = [], [], []
+    for row_start in range(0, height, strip_rows):
+        row_stop = min(row_start + strip_rows, height)
+        strip_transform = (
+            transform
+            * Affine.translation(0, row_start)
+            * Affine.scale(1 / supersample, 1 / supersample)
+        )
+        fine_zones = rasterize_zones(
+            geometry=geometry,
+            transform=strip_transform,
+            shape=((row_stop - row_start) * supersample, width * supersample),
+        )
+
+        fine_rows, fine_cols = np.nonzero(fine_zones)
+        strip_pixels = (row_start + fine_rows // supersample) * width + fine_columns[fine_cols]
+        strip_zones = fine_zones[fine_rows, fine_cols].astype(np.int64) - 1
+
+        # Count sub-pixels per (zone, pixel) pair before moving on to the next strip
+        pairs, pair_counts = np.unique(strip_zones * n_pixels + strip_pixels, return_counts=True)
+        zones.append(pairs // n_pixels)
+        pixels.append(pairs % n_pixels)
+        counts.append(pair_counts)
+
+    weights = sparse.csr_matrix(
+        (np.concatenate(counts) / supersample**2, (np.concatenate(zones), np.concatenate(pixels))),
+        shape=(len(geometry), n_pixels),
+    )
+    weights.sort_indices()
+
+    return weights
+
+
+def get_coverage_weights(
+    geom_path: Path,
+    transform: Affine,
+    shape: Tuple[int, int],
+    crs: CRS,
+    geometry: Optional[gpd.GeoDataFrame] = None,
+    supersample: int = config.coverage_supersample,
+    cache_dir: Path = Path(f"{config.root_dir}/{config.cache_dir}/coverage/"),
+) -> sparse.csr_matrix:
+    """Returns the coverage weight matrix of a geometry file for a raster grid.
+    The matrix is computed once per geometry file, raster grid and supersampling factor,
+    and saved as a compressed .npz file for later runs.
+
+    Args:
+        geom_path (Path): Path to the geometry file. Its contents are part of the cache key.
+        transform (Affine): Transform of the raster grid
+        shape (Tuple[int, int]): (height, width) of the raster grid
+        crs (CRS): CRS of the raster grid
+        geometry (Optional[gpd.GeoDataFrame], optional): Already loaded geometry, used on a cache miss. Defaults to None (read from geom_path).
+        supersample (int, optional): Sub-pixels per pixel side. Defaults to config.coverage_supersample.
+        cache_dir (Path, optional): Directory of cached matrices. Defaults to <root_dir>/<cache_dir>/coverage.
+
+    Returns:
+        sparse.csr_matrix: Matrix of shape (n_zones, height * width) with coverage fractions
+    """
+    key = hashlib.sha256(
+        f"{fingerprint_geometry_file(geom_path)}:{fingerprint_grid(transform, shape, crs)}:{supersample}".encode()
+    ).hexdigest()[:32]
+    cache_path = Path(f"{cache_dir}/{key}.npz")
+
+    if os.path.exists(cache_path):
+        return sparse.load_npz(cache_path).tocsr()
+
+    logger.info(f"Computing coverage weights for {geom_path} on a {shape[0]}x{shape[1]} grid")
+    if geometry is None:
+        geometry = load_geometry(geom_path=geom_path, target_crs=crs)
+    if geometry.crs is not None and CRS.from_user_input(geometry.crs) != CRS.from_user_input(crs):
+        geometry = geometry.to_crs(crs)
+
+    weights = compute_coverage_weights(
+        geometry=geometry, transform=transform, shape=shape, supersample=supersample
+    )
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = Path(f"{cache_dir}/{key}.{os.getpid()}.tmp.npz")
+    sparse.save_npz(temporary_path, weights)
+    os.replace(temporary_path, cache_path)
+
+    return weights
+
+
+def weighted_zonal_statistics(
+    raster: np.ndarray,
+    weights: sparse.csr_matrix,
+    stats: list[str],
+    nodata: Optional[float] = None,
+) -> dict[str, np.ndarray]:
+    """Coverage-weighted statistics of every zone.
+    Sums and means are sparse matrix-vector products. Minimum and maximum consider every
+    pixel with non-zero coverage, and the median is the weighted median of those pixels.
+
+    Args:
+        raster (np.ndarray): Single band raster values on the grid of the weights
+        weights (sparse.csr_matrix): Coverage weights, as returned by get_coverage_weights
+        stats (list[str]): Statistics to calculate. Options are count, sum, min, max, mean and median.
+        nodata (Optional[float], optional): Raster value that symbolizes no data. Defaults to None.
+
+    Returns:
+        dict[str, np.ndarray]: Array of length n_zones per statistic. count is the covered
+        number of valid pixels, which may be fractional. Zones without valid pixels have a
+        count of 0 and NaN for the other statistics.
+    """
+    unavailable = [stat for stat in stats if stat not in AVAILABLE_WEIGHTED_STATISTICS]
+    if unavailable:
+        raise ValueError(
+            f"Statistics {unavailable} are not available. Options include {AVAILABLE_WEIGHTED_STATISTICS}"
+        )
+
+    values = np.asarray(raster, dtype=np.float64).ravel()
+    if values.shape[0] != weights.shape[1]:
+        raise ValueError("Raster and coverage weights must be on the same grid.")
+
+    valid = ~np.isnan(values)
+    if nodata is not None:
+        valid &= values != nodata
+    filled = np.where(valid, values, 0)
+
+    count = weights @ valid.astype(np.float64)
+    has_pixels = count > 0
+    results = {}
+
+    if "count" in stats:
+        results["count"] = count
+
+    if "sum" in stats or "mean" in stats:
+        total = weights @ filled
+        if "sum" in stats:
+            results["sum"] = np.where(has_pixels, total, np.nan)
+        if "mean" in stats:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                results["mean"] = np.where(has_pixels, total / count, np.nan)
+
+    if any(stat in stats for stat in ["min", "max", "median"]):
+        zone_of_entry = np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr))
+        entry_values = np.where(valid[weights.indices], values[weights.indices], np.nan)
+        entry_weights = np.where(valid[weights.indices], weights.data, 0)
+
+        if "min" in stats:
+            results["min"] = _reduce_rows(np.fmin, entry_values, weights.indptr, has_pixels)
+        if "max" in stats:
+            results["max"] = _reduce_rows(np.fmax, entry_values, weights.indptr, has_pixels)
+        if "median" in stats:
+            results["median"] = _weighted_median(
+                entry_values, entry_weights, zone_of_entry, weights.shape[0], has_pixels
+            )
+
+    return results
+
+
+def _reduce_rows(
+    ufunc: np.ufunc, entry_values: np.ndarray, indptr: np.ndarray, has_pixels: np.ndarray
+) -> np.ndarray:
+    """Reduce the entries of every non-empty CSR row, with NaN for zones without valid pixels"""
+    out = np.full(len(indptr) - 1, np.nan)
+    non_empty = np.diff(indptr) > 0
+    if non_empty.any():
+        out[non_empty] = ufunc.reduceat(entry_values, indptr[:-1][non_empty])
+    return np.where(has_pixels, out, np.nan)
+
+
+def _weighted_median(
+    entry_values: np.ndarray,
+    entry_weights: np.ndarray,
+    zone_of_entry: np.ndarray,
+    n_zones: int,
+    has_pixels: np.ndarray,
+) -> np.ndarray:
+    """Weighted median per zone: the smallest value whose cumulative weight reaches half the zone's weight"""
+    order = np.lexsort((entry_values, zone_of_entry))
+    sorted_zones = zone_of_entry[order]
+    sorted_values = entry_values[order]
+    cumulative = np.cumsum(entry_weights[order])
+
+    zone_starts = np.searchsorted(sorted_zones, np.arange(n_zones))
+    zone_stops = np.searchsorted(sorted_zones, np.arange(n_zones), side="right")
+    offset = np.where(zone_starts > 0, cumulative[np.maximum(zone_starts - 1, 0)], 0)
+    zone_total = np.where(zone_stops > zone_starts, cumulative[np.maximum(zone_stops - 1, 0)], 0) - offset
+
+    # Cumulative weights are non-decreasing, so the first entry reaching the half weight is a search
+    positions = np.searchsorted(cumulative, offset + zone_total / 2, side="left")
+    positions = np.minimum(positions, np.maximum(zone_stops - 1, 0))
+
+    # Invalid entries sort last within a zone and must never be picked
+    valid_entries = np.bincount(zone_of_entry[~np.isnan(entry_values)], minlength=n_zones)
+    positions = np.minimum(positions, np.maximum(zone_starts + valid_entries - 1, 0))
+
+    median = np.full(n_zones, np.nan)
+    median[has_pixels] = sorted_values[positions[has_pixels]]
+    return median
@@ -1,8 +1,11 @@
 from pathlib import Path
 
 from config import read_config
-from functions import crop_raster_with_geometry, write_local_raster
-from vector_processing import COLUMN_MAPPING, get_geometry
+from functions import (_check_tif_extension, crop_raster_with_geometry,
+                       crop_raster_with_zone_grid, get_raster_crs,
+                       write_local_raster)
+from streaming import stream_crop_raster
+from vector_processing import load_geometry
 
 config = read_config("config.json")
 
@@ -11,11 +14,26 @@ def process_masked_raster(
         raw_raster_location: Path,
         masked_out_path: Path,
         geom_path: Path = config.geom_path,
+        use_zone_cache: bool = config.zone_cache,
         ) -> None:
 
-    geometry = get_geometry(geom_path=geom_path,
-                             column_mapping=COLUMN_MAPPING)
-    masked_raster, profile = crop_raster_with_geometry(raster_location=raw_raster_location,
-                                         gdf=geometry,
-                                         )
+    geometry = load_geometry(geom_path=geom_path,
+                             target_crs=get_raster_crs(raw_raster_location))
+    if config.streaming:
+        stream_crop_raster(raster_location=_check_tif_extension(raw_raster_location),
+                           gdf=geometry,
+                           out_path=_check_tif_extension(masked_out_path),
+                           geom_path=geom_path if use_zone_cache else None,
+                           )
+        return
+
+    if use_zone_cache:
+        masked_raster, profile = crop_raster_with_zone_grid(raster_location=raw_raster_location,
+                                                            gdf=geometry,
+                                                            geom_path=geom_path,
+                                                            )
+    else:
+        masked_raster, profile = crop_raster_with_geometry(raster_location=raw_raster_location,
+                                             gdf=geometry,
+                                             )
     write_local_raster(raster=masked_raster, profile=profile, out_path=masked_out_path)
@@ -0,0 +1,184 @@
+import logging
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import rasterio
+from climatology import ChelsaProduct, Month, Product, Scenario, get_climatology
+from config import read_config
+from functions import (_add_product_identifiers, _check_tif_extension,
+                       finalize_yearly_table)
+from rasterio.profiles import Profile
+from rollups import calculate_rollups
+from store import write_table
+from streaming import ZonalAccumulator, accumulate_block
+from transforms import apply_transforms
+from vector_processing import load_geometry
+from zonal_engine import rasterize_zones, zonal_statistics_cube
+from zone_cache import get_zone_grid
+
+logger = logging.getLogger(__name__)
+
+config = read_config("config.json")
+
+
+def stack_cropped_rasters(chelsa_products: list[ChelsaProduct]) -> Tuple[np.ndarray, Profile]:
+    """Stacks the cropped rasters of several months (and/or products) into one (band, y, x) cube.
+    All rasters must share the same grid.
+
+    Args:
+        chelsa_products (list[ChelsaProduct]): Products whose cropped rasters are stacked, in band order
+
+    Returns:
+        Tuple[np.ndarray, Profile]: Cube and the profile of the first raster, with count set to the number of bands
+    """
+    profile = None
+    bands = []
+    for chelsa_product in chelsa_products:
+        location = _check_tif_extension(chelsa_product.cropped_raster_path)
+        with rasterio.open(location, "r") as src:
+            if profile is None:
+                profile = src.profile.copy()
+            elif (src.transform, src.shape, src.crs) != (profile["transform"], (profile["height"], profile["width"]), profile["crs"]):
+                raise ValueError(f"{location} is not on the same grid as the other rasters of the cube.")
+            bands.append(src.read(1))
+
+    cube = np.stack(bands)
+    profile.update({"count": cube.shape[0]})
+    return cube, profile
+
+
+def calculate_cube_statistics(
+    products: list[Product],
+    scenario: Scenario,
+    place_id: str = config.adm_unique_id,
+    geom_path: Path = config.geom_path,
+    provided_stats: str = config.zonal_stats_aggregates,
+    nodata: float = -999,
+) -> dict[Product, pd.DataFrame]:
+    """Computes zonal statistics of all months of a scenario, for one or more products, in one pass.
+    The 12 monthly rasters of every product are stacked into a single cube and all
+    bands are reduced over the zones together. The geometry is loaded and the zones
+    are rasterized once for all products and months. With config.admin_rollups, every band
+    also accumulates the partial aggregates of its zones, which are rolled up to admin 1
+    and admin 0 areas as by the per-month engines.
+
+    Args:
+        products (list[Product]): Products to include in the cube. Their cropped rasters must share a grid.
+        scenario (Scenario): Scenario to process
+        place_id (str, optional): Column that contains a unique ID per geometry. Defaults to config.adm_unique_id.
+        geom_path (Path, optional): Path to geometry used for zonal statistics. Defaults to config.geom_path.
+        provided_stats (str, optional): Statistics to calculate. Defaults to config.zonal_stats_aggregates.
+        nodata (float, optional): Raster value that symbolizes no data. Defaults to -999.
+
+    Returns:
+        dict[Product, pd.DataFrame]: Yearly table per product, with one row per zone and month
+    """
+    chelsa_products = [
+        get_climatology(product=product, scenario=scenario, month=month)
+        for product in products
+        for month in Month
+    ]
+    cube, profile = stack_cropped_rasters(chelsa_products=chelsa_products)
+
+    geometry = load_geometry(geom_path=geom_path, target_crs=profile["crs"])
+    shape = (profile["height"], profile["width"])
+
+    if config.zone_cache:
+        zones = get_zone_grid(
+            geom_path=geom_path,
+            transform=profile["transform"],
+            shape=shape,
+            crs=profile["crs"],
+            geometry=geometry,
+        )
+    else:
+        zones = rasterize_zones(geometry=geometry, transform=profile["transform"], shape=shape)
+
+    stats_list = provided_stats.split(" ")
+    results = zonal_statistics_cube(
+        cube=cube, zones=zones, n_zones=len(geometry), stats=stats_list, nodata=nodata
+    )
+    attributes = pd.DataFrame(geometry.drop(columns=["geometry"]))
+
+    monthly_tables = {product: [] for product in products}
+    for band, chelsa_product in enumerate(chelsa_products):
+        monthly_table = attributes.copy()
+        for stat in stats_list:
+            monthly_table[f"{stat}_raw"] = results[stat][band]
+        monthly_table = apply_transforms(chelsa_product=chelsa_product, df=monthly_table)
+        monthly_table = _add_product_identifiers(
+            chelsa_product=chelsa_product, place_id=place_id, df=monthly_table
+        )
+
+        rollups = None
+        if config.admin_rollups:
+            accumulator = _accumulate_band(
+                band=cube[band],
+                zones=zones,
+                n_zones=len(geometry),
+                stats_list=stats_list,
+                nodata=nodata,
+                source_nodata=profile["nodata"],
+            )
+            rollups = calculate_rollups(
+                accumulator=accumulator,
+                geometry=attributes,
+                chelsa_product=chelsa_product,
+                stats_list=stats_list,
+                levels=config.admin_rollups,
+            )
+        monthly_tables[chelsa_product.product].append((chelsa_product, monthly_table, rollups))
+
+    return {
+        product: _write_cube_outputs(monthly_tables=tables, place_id=place_id)
+        for product, tables in monthly_tables.items()
+    }
+
+
+def _accumulate_band(
+    band: np.ndarray,
+    zones: np.ndarray,
+    n_zones: int,
+    stats_list: list[str],
+    nodata: float,
+    source_nodata: Optional[float] = None,
+) -> ZonalAccumulator:
+    """Partial aggregates of every zone of a band of the cube, with histograms only for the median"""
+    return accumulate_block(
+        raster=band,
+        zones=zones,
+        n_zones=n_zones,
+        n_bins=config.histogram_bins if "median" in stats_list else 1,
+        nodata=nodata,
+        source_nodata=source_nodata,
+    )
+
+
+def _write_cube_outputs(
+    monthly_tables: list[Tuple[ChelsaProduct, pd.DataFrame, Optional[pd.DataFrame]]], place_id: str
+) -> pd.DataFrame:
+    """Writes the monthly zonal statistics (and rollups) of a product and returns its yearly table.
+    The yearly table is saved under the yearly aggregate path of the last month.
+
+    Args:
+        monthly_tables (list[Tuple[ChelsaProduct, pd.DataFrame, Optional[pd.DataFrame]]]): Zonal statistics
+            and rollups of every month of a product
+        place_id (str): Column that contains a unique ID per geometry
+
+    Returns:
+        pd.DataFrame: Yearly table
+    """
+    for chelsa_product, monthly_table, rollups in monthly_tables:
+        write_table(df=monthly_table, path=chelsa_product.zonal_file_path)
+        if rollups is not None:
+            write_table(df=rollups, path=chelsa_product.rollup_file_path)
+
+    last_month = monthly_tables[-1][0]
+    yearly_table = pd.concat([table for _, table, _ in monthly_tables], axis=0, ignore_index=True)
+    yearly_table["month"] = yearly_table["month"].astype(int)
+    yearly_table = finalize_yearly_table(yearly_table=yearly_table, sort_values=[place_id, "month"])
+    write_table(df=yearly_table, path=last_month.yearly_aggregate_path)
+
+    return yearly_table
@@ -1,25 +1,49 @@
 
 from pathlib import Path
+from typing import Optional, Tuple
 
 from climatology import ChelsaProduct, Month, Scenario
-from functions import read_raster, write_local_raster
+from functions import read_raster, read_raster_window, write_local_raster
+from rasterio.crs import CRS
+from vector_processing import load_geometry
 
 
 def process_raw_raster(
         product: ChelsaProduct,
         scenario: Scenario,
         month: Month,
-        raw_out_path: Path) -> None:
-    """Downloads CHELSA raster given a URL
+        raw_out_path: Path,
+        bounds: Optional[Tuple[float, float, float, float]] = None,
+        bounds_crs: Optional[CRS] = None) -> None:
+    """Downloads CHELSA raster given a URL.
+    If bounds are provided, only the window covering the bounds is fetched and saved.
 
     Args:
         product (ChelsaProduct): Product to be downloaded
         scenario (Scenario): Scenario for product
         month (Month): Month for scenario
         raw_out_path (Path): Location for saved raster
+        bounds (Optional[Tuple[float, float, float, float]], optional): Area of interest as (left, bottom, right, top). Defaults to None (whole raster).
+        bounds_crs (Optional[CRS], optional): CRS of the bounds. Defaults to None (raster's CRS).
     """
     
     url = product.get_url(scenario=scenario, month=month)
-    raster, profile = read_raster(location=url)
+    if bounds is None:
+        raster, profile = read_raster(location=url)
+    else:
+        raster, profile = read_raster_window(location=url, bounds=bounds, bounds_crs=bounds_crs)
     write_local_raster(raster=raster, profile=profile, out_path=raw_out_path)
 
+
+def get_download_bounds(geom_path: Path) -> Tuple[Tuple[float, float, float, float], CRS]:
+    """Bounds of the geometry used for masking, used to limit raster downloads to the area of interest
+
+    Args:
+        geom_path (Path): Path to the geometry used for masking and zonal statistics
+
+    Returns:
+        Tuple[Tuple[float, float, float, float], CRS]: Total bounds of the geometry and its CRS
+    """
+    geometry = load_geometry(geom_path=geom_path)
+    return tuple(geometry.total_bounds), geometry.crs
+
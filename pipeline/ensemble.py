@@ -0,0 +1,134 @@
+import logging
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from climatology import ChelsaProduct, Scenario
+from ledger import file_checksum
+from manifest import Manifest, read_manifest
+from metrics import measure
+from store import get_partition_path, read_table, write_table
+
+logger = logging.getLogger(__name__)
+
+# Statistic of the yearly tables combined across the models of a pathway
+ENSEMBLE_VALUE = "mean_value"
+ENSEMBLE_PERCENTILES = {"ensemble_p10": 10, "ensemble_median": 50, "ensemble_p90": 90}
+ADMIN_COLUMNS = ["iso2_code", "adm0_name", "adm1_name", "adm2_name", "adm1_id"]
+
+
+def get_rcp(scenario: Scenario) -> str:
+    """RCP pathway of a scenario, eg. "rcp45" for ACCESS1-0_rcp45"""
+    return scenario.value.rsplit("_", 1)[-1]
+
+
+def get_ensemble_table_name(chelsa_product: ChelsaProduct) -> str:
+    """Database table of the ensemble statistics of a product, eg. tmin_ensemble"""
+    return f"{chelsa_product.product.value}_ensemble"
+
+
+def ensemble_manifest(yearly_paths: dict[Scenario, Path]) -> Manifest:
+    """Manifest of the ensemble of a pathway: its models and the checksums of their yearly tables"""
+    return Manifest(
+        step="ENSEMBLE",
+        inputs={scenario.value: file_checksum(yearly_path) for scenario, yearly_path in yearly_paths.items()},
+    )
+
+
+def process_ensemble_statistics(chelsa_product: ChelsaProduct) -> list[Path]:
+    """Computes the multi-model ensemble statistics of a product for every RCP pathway whose
+    models or yearly tables differ from those its ensemble was computed from, eg. when a new
+    scenario lands. The scenarios of a pathway (one per GCM) with a yearly table are the models
+    of its ensemble. Ensembles are compared by content, through the manifest saved next to them,
+    so a yearly table written while an ensemble was being computed is never missed.
+
+    Args:
+        chelsa_product (ChelsaProduct): Any month and scenario of the product
+
+    Returns:
+        list[Path]: Partition files of the ensembles that were saved
+    """
+    product = chelsa_product.product.value
+    yearly_paths = {
+        scenario: get_partition_path(dataset_dir=chelsa_product.yearly_aggregate_dir, product=product, scenario=scenario.value)
+        for scenario in chelsa_product.available_scenarios
+    }
+    models = {}
+    for scenario, yearly_path in yearly_paths.items():
+        if yearly_path.exists():
+            models.setdefault(get_rcp(scenario), []).append(scenario)
+
+    stale = {}
+    manifests = {}
+    for rcp, scenarios in models.items():
+        ensemble_path = get_partition_path(dataset_dir=chelsa_product.ensemble_dir, product=product, scenario=rcp)
+        # Checksums are taken before the yearly tables are read: a table rewritten in between
+        # makes the saved manifest outdated, and the ensemble is computed again next time
+        manifests[rcp] = ensemble_manifest({scenario: yearly_paths[scenario] for scenario in scenarios})
+        saved = read_manifest(ensemble_path) if ensemble_path.exists() else None
+        if saved is None or saved["fingerprint"] != manifests[rcp].fingerprint:
+            stale[rcp] = ensemble_path
+
+    if not stale:
+        logger.info(f"Ensemble statistics of {product} are up to date")
+        return []
+
+    with measure("ensemble_statistics") as stage:
+        yearly_tables = read_table(
+            path=chelsa_product.yearly_aggregate_dir,
+            decode_dictionaries=True,
+            product=product,
+            scenario=[scenario.value for rcp in stale for scenario in models[rcp]],
+        )
+        ensembles = calculate_ensemble_statistics(yearly_tables=yearly_tables)
+        stage.rows = len(ensembles)
+
+        for rcp, ensemble_path in stale.items():
+            write_table(df=ensembles[ensembles["scenario"] == rcp], path=ensemble_path)
+            manifests[rcp].write(artefact_path=ensemble_path)
+            logger.info(f"Saved ensemble statistics of {product} {rcp} ({[s.value for s in models[rcp]]}) to {ensemble_path}")
+
+    return list(stale.values())
+
+
+def calculate_ensemble_statistics(yearly_tables: pd.DataFrame) -> pd.DataFrame:
+    """Ensemble mean, spread (standard deviation), range and percentiles of every admin 2 area
+    and month across the scenarios of each RCP pathway. The yearly tables are pivoted into one
+    matrix with a column per model, and every statistic is computed along its rows at once.
+
+    Args:
+        yearly_tables (pd.DataFrame): Yearly tables of several scenarios of a product
+
+    Returns:
+        pd.DataFrame: One row per pathway, admin 2 area and month, with "scenario" set to the pathway
+    """
+    df = yearly_tables.assign(rcp=yearly_tables["scenario"].str.rsplit("_", n=1).str[-1])
+    matrix = df.pivot_table(index=["rcp", "adm2_id", "month"], columns="scenario", values=ENSEMBLE_VALUE, aggfunc="first")
+    values = matrix.to_numpy(dtype=np.float64)
+
+    with warnings.catch_warnings():
+        # Areas without values in any model have NaN statistics
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        statistics = {
+            "n_models": np.count_nonzero(~np.isnan(values), axis=1),
+            "ensemble_mean": np.nanmean(values, axis=1),
+            "ensemble_std": np.nanstd(values, axis=1),
+            "ensemble_min": np.nanmin(values, axis=1),
+            "ensemble_max": np.nanmax(values, axis=1),
+        }
+        percentiles = np.nanpercentile(values, list(ENSEMBLE_PERCENTILES.values()), axis=1)
+    statistics.update(zip(ENSEMBLE_PERCENTILES, percentiles))
+
+    ensembles = pd.DataFrame(statistics, index=matrix.index).reset_index()
+    ensembles = ensembles[ensembles["n_models"] > 0].rename(columns={"rcp": "scenario"})
+
+    attributes = df.drop_duplicates(subset=["adm2_id"])[
+        ["adm2_id", "product", *[column for column in ADMIN_COLUMNS if column in df]]
+    ]
+    ensembles = ensembles.merge(attributes, on="adm2_id", how="left")
+    if "unit" in df:
+        # Units of the bio product differ by month
+        ensembles = ensembles.merge(df.drop_duplicates(subset=["month"])[["month", "unit"]], on="month", how="left")
+
+    return ensembles
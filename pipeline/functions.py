@@ -1,20 +1,50 @@
+import logging
+import math
 import os
 from pathlib import Path
-from typing import Literal, Tuple, Union
+from typing import Literal, Optional, Tuple, Union
 
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import rasterio
-from climatology import ChelsaProduct, TemperatureProduct
+from climatology import ChelsaProduct
 from config import read_config
+from coverage import (compute_coverage_weights, get_coverage_weights,
+                      weighted_zonal_statistics)
+from metrics import instrumented, measure
+from parallel_zonal import parallel_zonal_statistics
 from rasterio import mask
+from rasterio.crs import CRS
+from rasterio.features import geometry_window
 from rasterio.profiles import Profile
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
 from rasterstats import zonal_stats
+from rollups import ROLLUP_ENGINES, calculate_rollups
+from store import list_partitions, read_arrow_table
+from streaming import (ZonalAccumulator, accumulate_block,
+                       accumulate_zonal_statistics)
+from transforms import apply_transforms
+from zonal_engine import rasterize_zones, zonal_statistics
+from zone_cache import get_zone_grid
+
+logger = logging.getLogger(__name__)
 
 config = read_config("config.json")
 
+# GDAL options for reading remote rasters with HTTP range requests.
+# Directory listings are skipped so that only the .tif itself is requested.
+REMOTE_RASTER_OPTIONS = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif",
+    "GDAL_HTTP_MULTIRANGE": "YES",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+}
+
 
+@instrumented("read_raster")
 def read_raster(location: Union[str, Path]) -> Tuple[np.ndarray, Profile]:
     """Read a raster from a URL or path provided as a string
 
@@ -26,13 +56,114 @@ def read_raster(location: Union[str, Path]) -> Tuple[np.ndarray, Profile]:
         profile: rasterio raster profile
     """
 
-    location = _check_tif_extension(location)
-    with rasterio.open(location, "r") as rast:
-        raster = rast.read()
-        profile = rast.profile
+    location = _get_raster_location(location)
+    with rasterio.Env(**REMOTE_RASTER_OPTIONS):
+        with rasterio.open(location, "r") as rast:
+            raster = rast.read()
+            profile = rast.profile
     return raster, profile
 
 
+def read_raster_window(
+    location: Union[str, Path],
+    bounds: Tuple[float, float, float, float],
+    bounds_crs: Optional[CRS] = None,
+    pad: int = 1,
+) -> Tuple[np.ndarray, Profile]:
+    """Read only the pixels of a raster that fall within the provided bounds.
+    Remote rasters are opened through GDAL's /vsicurl/ handler, so only the
+    byte ranges of the blocks covering the window are transferred.
+
+    Args:
+        location (Union[str, Path]): URL or path of the raster
+        bounds (Tuple[float, float, float, float]): Area of interest as (left, bottom, right, top)
+        bounds_crs (Optional[CRS], optional): CRS of the bounds. Defaults to the raster's CRS.
+        pad (int, optional): Pixels added around the window so later masking sees whole edge pixels. Defaults to 1.
+
+    Returns:
+        raster: np.ndarray with raster values inside the window
+        profile: rasterio raster profile, with width, height and transform of the window
+    """
+
+    location = _get_raster_location(location)
+    with rasterio.Env(**REMOTE_RASTER_OPTIONS):
+        with rasterio.open(location, "r") as rast:
+            if bounds_crs is not None and CRS.from_user_input(bounds_crs) != rast.crs:
+                bounds = transform_bounds(bounds_crs, rast.crs, *bounds)
+
+            window = _bounds_to_window(dataset_reader=rast, bounds=bounds, pad=pad)
+            raster = rast.read(window=window)
+            profile: Profile = rast.profile.copy()
+
+            profile.update(
+                {
+                    "width": window.width,
+                    "height": window.height,
+                    "transform": rast.window_transform(window),
+                }
+            )
+
+    return raster, profile
+
+
+def get_raster_crs(location: Union[str, Path]) -> CRS:
+    """CRS of a raster, read from its header only
+
+    Args:
+        location (Union[str, Path]): URL or path of the raster
+
+    Returns:
+        CRS: CRS of the raster
+    """
+    with rasterio.Env(**REMOTE_RASTER_OPTIONS):
+        with rasterio.open(_get_raster_location(location), "r") as src:
+            return src.crs
+
+
+def _bounds_to_window(
+    dataset_reader: rasterio.DatasetReader,
+    bounds: Tuple[float, float, float, float],
+    pad: int = 0,
+) -> Window:
+    """Convert bounds to a whole-pixel window, clipped to the raster extent
+
+    Args:
+        dataset_reader (rasterio.DatasetReader): Raster the window refers to
+        bounds (Tuple[float, float, float, float]): (left, bottom, right, top) in the raster's CRS
+        pad (int, optional): Number of pixels added on every side. Defaults to 0.
+
+    Returns:
+        Window: Integer window covering the bounds
+    """
+    window = rasterio.windows.from_bounds(*bounds, transform=dataset_reader.transform)
+
+    col_start = max(math.floor(window.col_off) - pad, 0)
+    row_start = max(math.floor(window.row_off) - pad, 0)
+    col_stop = min(math.ceil(window.col_off + window.width) + pad, dataset_reader.width)
+    row_stop = min(math.ceil(window.row_off + window.height) + pad, dataset_reader.height)
+
+    if col_stop <= col_start or row_stop <= row_start:
+        raise ValueError(f"Bounds {bounds} do not overlap raster.")
+
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def _get_raster_location(location: Union[str, Path]) -> Union[str, Path]:
+    """Prefix URLs with /vsicurl/ so GDAL reads them with range requests.
+    Local locations are checked for a .tif extension.
+
+    Args:
+        location (Union[str, Path]): URL or path of the raster
+
+    Returns:
+        Union[str, Path]: Location that can be opened by rasterio
+    """
+    if isinstance(location, str) and location.startswith(("http://", "https://")):
+        return f"/vsicurl/{location}"
+
+    return _check_tif_extension(location)
+
+
 def _check_tif_extension(location: Union[str, Path]) -> Path:
     """Adds .tif to raster location if it is not available
 
@@ -139,9 +270,10 @@ def crop_raster_with_geometry(
     with rasterio.open(raster_location, "r") as src:
         gdf = _check_crs(dataset_reader=src, vector=gdf)
 
-        cropped_raster, cropped_transform = mask.mask(
-            dataset=src, shapes=gdf.geometry, crop=True
-        )
+        with measure("mask.mask"):
+            cropped_raster, cropped_transform = mask.mask(
+                dataset=src, shapes=gdf.geometry, crop=True
+            )
 
         cropped_profile: Profile = src.profile.copy()
 
@@ -156,6 +288,53 @@ def crop_raster_with_geometry(
     return cropped_raster, cropped_profile
 
 
+def crop_raster_with_zone_grid(
+    raster_location: Path, gdf: gpd.GeoDataFrame, geom_path: Path
+) -> Tuple[np.ndarray, Profile]:
+    """Masks raster with the cached zone-id grid of the geometry instead of rasterizing the
+    geometry again. Produces the same crop as crop_raster_with_geometry.
+
+    Args:
+        raster_location (Path): Location of raster file
+        gdf (gpd.GeoDataFrame): Geodataframe that will be used to mask raster
+        geom_path (Path): Path of the geometry file, used as part of the zone grid cache key
+
+    Returns:
+        Tuple[np.ndarray, Profile]: Masked raster and masked raster profile
+    """
+
+    raster_location = _check_tif_extension(location=raster_location)
+
+    with rasterio.open(raster_location, "r") as src:
+        gdf = _check_crs(dataset_reader=src, vector=gdf)
+        window = geometry_window(src, gdf.geometry)
+        cropped_transform = src.window_transform(window)
+        shape = (int(window.height), int(window.width))
+
+        zones = get_zone_grid(
+            geom_path=geom_path,
+            transform=cropped_transform,
+            shape=shape,
+            crs=src.crs,
+            geometry=gdf,
+        )
+        cropped_raster = src.read(window=window, masked=True)
+        cropped_raster.mask = cropped_raster.mask | (zones == 0)
+        cropped_raster = cropped_raster.filled(src.nodata if src.nodata is not None else 0)
+
+        cropped_profile: Profile = src.profile.copy()
+
+        cropped_profile.update(
+            {
+                "width": shape[1],
+                "height": shape[0],
+                "transform": cropped_transform,
+            }
+        )
+
+    return cropped_raster, cropped_profile
+
+
 def _check_crs(
     dataset_reader: rasterio.DatasetReader, vector: gpd.GeoDataFrame
 ) -> gpd.GeoDataFrame:
@@ -176,12 +355,16 @@ def _check_crs(
         return vector
 
 
+@instrumented("zonal_stats")
 def calculate_zonal_statistics(
     raster_location: Path,
     geometry: gpd.GeoDataFrame,
     chelsa_product: ChelsaProduct,
     place_id: str,
     provided_stats: Literal["mean median min max"] = config.zonal_stats_aggregates,
+    engine: Literal["rasterstats", "vectorized", "coverage", "streaming", "parallel"] = config.zonal_engine,
+    geom_path: Optional[Path] = None,
+    rollup_levels: Optional[list[str]] = None,
 ) -> pd.DataFrame:
     """Calculates zonal statistics based on provided list of desired statistics
 
@@ -190,94 +373,272 @@ def calculate_zonal_statistics(
         geometry (gpd.GeoDataFrame): geometry that will be the unit of analysis for zonal stats
         month (Month): Scenario's month
         provided_stats (str, optional): Statistics to calculate. Defaults to "min mean max".
+        engine (str, optional): "rasterstats" masks each geometry separately, "vectorized" rasterizes all
+            geometries once into a zone-id grid, "coverage" weights pixels by the fraction covered by each
+            geometry and should be given the unmasked raster, "streaming" reads the raster strip by strip
+            within config.memory_budget_mb, "parallel" runs rasterstats on config.zonal_workers processes
+            sharing the raster in memory. Defaults to config.zonal_engine.
+        geom_path (Optional[Path], optional): Path of the geometry file. If provided, the vectorized, coverage
+            and streaming engines reuse the cached zone-id grid or coverage weights of that file. Defaults to None.
+        rollup_levels (Optional[list[str]], optional): Admin levels (adm1, adm0) to roll the geometries up to.
+            The vectorized and streaming engines then also accumulate pixel count, sum, min, max and a
+            histogram of every geometry in the same pass over the raster, and combine them along the admin
+            hierarchy. The statistics of the geometries themselves are those of the engine either way.
+            Defaults to None (geometries only).
 
     Returns:
-        pd.DataFrame: Tabular results, where each row is a geometry in the geometry
+        pd.DataFrame: Tabular results, where each row is a geometry in the geometry.
+            With rollup_levels, rows of the rolled up areas follow, and a level column tells them apart.
     """
     raster_location = _check_tif_extension(raster_location)
-    results = zonal_stats(
-        vectors=geometry.geometry,
-        raster=raster_location,
-        nodata=-999,
-        stats=provided_stats,
-    )
-
     stats_list = provided_stats.split(" ")
+
+    if rollup_levels and engine not in ROLLUP_ENGINES:
+        logger.warning(f"The {engine} engine does not produce mergeable aggregates, skipping rollups to {rollup_levels}")
+        rollup_levels = None
+
+    n_bins = config.histogram_bins if "median" in stats_list else 1
+    accumulator = None
+    if engine == "vectorized":
+        stat_columns, accumulator = _vectorized_zonal_statistics(
+            raster_location=raster_location,
+            geometry=geometry,
+            stats_list=stats_list,
+            nodata=-999,
+            geom_path=geom_path,
+            rollup_bins=n_bins if rollup_levels else None,
+        )
+    elif engine == "coverage":
+        stat_columns = _coverage_zonal_statistics(
+            raster_location=raster_location,
+            geometry=geometry,
+            stats_list=stats_list,
+            nodata=-999,
+            geom_path=geom_path,
+        )
+    elif engine == "streaming":
+        accumulator = accumulate_zonal_statistics(
+            raster_location=raster_location,
+            geometry=geometry,
+            nodata=-999,
+            geom_path=geom_path,
+            n_bins=n_bins,
+        )
+        stat_columns = accumulator.statistics(stats_list)
+    elif engine == "parallel":
+        stat_columns = parallel_zonal_statistics(
+            raster_location=raster_location,
+            geometry=geometry,
+            stats_list=stats_list,
+            nodata=-999,
+        )
+    elif engine == "rasterstats":
+        results = zonal_stats(
+            vectors=geometry.geometry,
+            raster=raster_location,
+            nodata=-999,
+            stats=provided_stats,
+        )
+        stat_columns = {stat: [result[stat] for result in results] for stat in stats_list}
+    else:
+        raise ValueError(
+            "This zonal statistics engine is not available. \
+                         Options include ['rasterstats', 'vectorized', 'coverage', 'streaming', 'parallel']"
+        )
+
     for stat in stats_list:
         column_name = f"{stat}_raw"
-        geometry[column_name] = [result[stat] for result in results]
+        geometry[column_name] = stat_columns[stat]
 
     geometry.drop(columns=["geometry"], inplace=True)
+    geometry = apply_transforms(chelsa_product=chelsa_product, df=geometry)
     geometry_with_ids = _add_product_identifiers(
         chelsa_product=chelsa_product, place_id=place_id, df=geometry
     )
 
+    if rollup_levels:
+        rollups = calculate_rollups(
+            accumulator=accumulator,
+            geometry=geometry_with_ids,
+            chelsa_product=chelsa_product,
+            stats_list=stats_list,
+            levels=rollup_levels,
+        )
+        geometry_with_ids = geometry_with_ids.assign(level="adm2")
+        if len(rollups) > 0:
+            geometry_with_ids = pd.concat([geometry_with_ids, rollups], ignore_index=True)
+
     return geometry_with_ids
 
 
-def _monthly_temperature_conversion(temperature: float) -> float:
-    """Monthly climatologies are in C/10 units
-    https://chelsa-climate.org/wp-admin/download-page/CHELSA_tech_specification.pdf (pg.36)
+def _vectorized_zonal_statistics(
+    raster_location: Path,
+    geometry: gpd.GeoDataFrame,
+    stats_list: list[str],
+    nodata: float = -999,
+    geom_path: Optional[Path] = None,
+    rollup_bins: Optional[int] = None,
+) -> Tuple[dict[str, np.ndarray], Optional[ZonalAccumulator]]:
+    """Rasterizes all geometries once into a zone-id grid aligned to the raster
+    and calculates the statistics of every zone in one pass
 
     Args:
-        temperature (float): Numeric value to convert to Celcius
+        raster_location (Path): Location of the raster
+        geometry (gpd.GeoDataFrame): Geometries used as zones
+        stats_list (list[str]): Statistics to calculate
+        nodata (float, optional): Raster value that symbolizes no data. Defaults to -999.
+        geom_path (Optional[Path], optional): Path of the geometry file. If provided, the zone-id grid
+            is read from the zone grid cache. Defaults to None.
+        rollup_bins (Optional[int], optional): If provided, partial aggregates of every zone with up to this
+            many histogram bins are also accumulated from the raster in memory, for rollups. Defaults to None.
+
+    Returns:
+        Tuple[dict[str, np.ndarray], Optional[ZonalAccumulator]]: One value per geometry for every statistic,
+            in the geometry's row order, and the partial aggregates if rollup_bins is provided
     """
-    return temperature / 10
+    with rasterio.open(raster_location, "r") as src:
+        zones_geometry = _check_crs(dataset_reader=src, vector=geometry)
+        raster = src.read(1)
+        source_nodata = src.nodata
+        if geom_path is not None:
+            zones = get_zone_grid(
+                geom_path=geom_path,
+                transform=src.transform,
+                shape=src.shape,
+                crs=src.crs,
+                geometry=zones_geometry,
+            )
+        else:
+            zones = rasterize_zones(
+                geometry=zones_geometry, transform=src.transform, shape=src.shape
+            )
 
+    stat_columns = zonal_statistics(
+        raster=raster,
+        zones=zones,
+        n_zones=len(geometry),
+        stats=stats_list,
+        nodata=nodata,
+    )
+    accumulator = None
+    if rollup_bins is not None:
+        accumulator = accumulate_block(
+            raster=raster,
+            zones=zones,
+            n_zones=len(geometry),
+            n_bins=rollup_bins,
+            nodata=nodata,
+            source_nodata=source_nodata,
+        )
 
-def _check_temperature_converter(
-    product: ChelsaProduct,
-    df: pd.DataFrame,
-    provided_stats: str = config.zonal_stats_aggregates,
-) -> pd.DataFrame:
-    """Checks if product is a temperature product. If so, new column is created with celsius values.
+    return stat_columns, accumulator
+
+
+def _coverage_zonal_statistics(
+    raster_location: Path,
+    geometry: gpd.GeoDataFrame,
+    stats_list: list[str],
+    nodata: float = -999,
+    geom_path: Optional[Path] = None,
+) -> dict[str, np.ndarray]:
+    """Calculates coverage-weighted statistics over the window of the raster covering the geometry.
+    Pixels on the edge of a geometry contribute by the fraction of the pixel that is covered.
 
     Args:
-        product (ChelsaProduct): Instance of any ChelsaProduct
-        df (pd.DataFrame): Dataframe that with values that will be checked and converted to C
-        provided_stats (str, optional): Columns with C/10 temperatures to be converted to C. Defaults to "min mean max".
+        raster_location (Path): Location of the raster. Should not be masked, so that edge pixels keep their values.
+        geometry (gpd.GeoDataFrame): Geometries used as zones
+        stats_list (list[str]): Statistics to calculate
+        nodata (float, optional): Raster value that symbolizes no data. Defaults to -999.
+        geom_path (Optional[Path], optional): Path of the geometry file. If provided, coverage weights
+            are read from the coverage cache. Defaults to None.
 
     Returns:
-        pd.DataFrame: _description_
+        dict[str, np.ndarray]: One value per geometry for every statistic, in the geometry's row order
     """
+    with rasterio.open(raster_location, "r") as src:
+        zones_geometry = _check_crs(dataset_reader=src, vector=geometry)
+        window = geometry_window(src, zones_geometry.geometry, pad_x=1, pad_y=1)
+        transform = src.window_transform(window)
+        shape = (int(window.height), int(window.width))
+        raster = src.read(1, window=window)
+        source_nodata = src.nodata
+        crs = src.crs
+
+    if geom_path is not None:
+        weights = get_coverage_weights(
+            geom_path=geom_path, transform=transform, shape=shape, crs=crs, geometry=zones_geometry
+        )
+    else:
+        weights = compute_coverage_weights(geometry=zones_geometry, transform=transform, shape=shape)
 
-    if type(product).__name__ in [tp.name for tp in TemperatureProduct]:
-        cols_to_convert_celsius = provided_stats.split(" ")
-        for stat in cols_to_convert_celsius:
-            raw_column_name = f"{stat}_raw_value"
-            celsius_column_name = f"{stat}_celsius_value"
-            df[celsius_column_name] = df[raw_column_name].apply(
-                _monthly_temperature_conversion
-            )
+    if source_nodata is not None:
+        raster = np.where(raster == source_nodata, nodata, raster)
 
-    return df
+    return weighted_zonal_statistics(raster=raster, weights=weights, stats=stats_list, nodata=nodata)
 
 
 def yearly_table_generator(
-    product: ChelsaProduct, zonal_dir: Path, sort_values: list[str]
+    product: ChelsaProduct,
+    zonal_dir: Path,
+    sort_values: list[str],
+    yearly_path: Optional[Path] = None,
 ) -> pd.DataFrame:
-    """Iterates through CSV files in zonal directory and appends them together to create a yearly table,
-    with one row per month.
+    """Creates the yearly table of a product's scenario, with one row per month, from the month
+    partitions of the zonal statistics dataset. Months are read as Arrow tables and combined
+    without copying, then sorted once.
+    If the yearly table was already built at yearly_path, only the months written since are read
+    from the zonal statistics; the other months are taken from the existing yearly table.
 
     Args:
-        product (ChelsaProduct): Type of CHELSA product. Used to determine raw value conversion
-        zonal_dir (Path): Path where list of zonal stat files can be found
+        product (ChelsaProduct): Product and scenario of the yearly table
+        zonal_dir (Path): Root directory of the zonal statistics dataset
         sort_values (list[str]): Columns used to sort the yearly dataframe
+        yearly_path (Optional[Path], optional): Existing yearly table to append to. Defaults to None.
 
     Returns:
         pd.DataFrame: Yearly table
     """
+    month_paths = list_partitions(
+        dataset_dir=zonal_dir, product=product.product.value, scenario=product.scenario.value
+    )
 
-    li = []
-    yearly_table = pd.DataFrame()
-    for file in os.listdir(zonal_dir):
-        if file.endswith(".csv"):
-            with open(f"{os.path.join(zonal_dir, file)}", "r") as f:
-                df = pd.read_csv(f, index_col=None, header=0, encoding="utf-8")
-                li.append(df)
-                yearly_table = pd.concat(li, axis=0, ignore_index=True)
+    if not month_paths:
+        raise FileNotFoundError(
+            f"No zonal statistics of {product.product.value} {product.scenario.value} in {zonal_dir}"
+        )
+
+    reused_months = []
+    if yearly_path is not None and os.path.exists(yearly_path):
+        built_at = os.stat(yearly_path).st_mtime_ns
+        reused_months = [month for month, path in month_paths.items() if os.stat(path).st_mtime_ns < built_at]
+
+    tables = [read_arrow_table(path=path) for month, path in month_paths.items() if month not in reused_months]
+    if reused_months:
+        columns = tables[0].column_names if tables else None
+        tables.append(read_arrow_table(path=yearly_path, columns=columns, month=reused_months))
+
+    schema = tables[0].schema
+    yearly_table = pa.concat_tables([table.select(schema.names).cast(schema) for table in tables]).to_pandas()
+
+    return finalize_yearly_table(yearly_table=yearly_table, sort_values=sort_values)
+
+
+def finalize_yearly_table(yearly_table: pd.DataFrame, sort_values: list[str]) -> pd.DataFrame:
+    """Sorts a yearly table. Values are converted to physical units with the zonal statistics.
 
-    yearly_table = _check_temperature_converter(product=product, df=yearly_table)
+    Args:
+        yearly_table (pd.DataFrame): Zonal statistics of all months
+        sort_values (list[str]): Columns used to sort the yearly dataframe
+
+    Returns:
+        pd.DataFrame: Yearly table
+    """
+    # Categoricals sort in the order of their categories, which is the order values were first read
+    for column in sort_values:
+        if isinstance(yearly_table[column].dtype, pd.CategoricalDtype):
+            yearly_table[column] = yearly_table[column].cat.reorder_categories(
+                sorted(yearly_table[column].cat.categories)
+            )
     yearly_table.sort_values(by=sort_values, inplace=True)
 
     return yearly_table
@@ -0,0 +1,359 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+from climatology import ChelsaProduct
+from manifest import Manifest
+from metrics import measure
+from session import get_session
+from sqlalchemy import select
+from tables import RunLedgerTable
+
+logger = logging.getLogger(__name__)
+
+# Ledger month of steps that cover all months of a product's scenario, such as the yearly table
+ALL_MONTHS = "all"
+
+_file_checksums: dict[tuple, str] = {}
+_ledger_created = False
+
+
+class StepStatus(Enum):
+    """Status of a processing step in the run ledger"""
+
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+@dataclass
+class LedgerEntry:
+    """Status of a step, the fingerprint of the inputs it last ran with, and the checksum,
+    sizes and modification times of its outputs"""
+
+    status: StepStatus
+    input_fingerprint: Optional[str] = None
+    output_checksum: Optional[str] = None
+    output_stats: Optional[str] = None
+
+    def is_current(self, manifest: Manifest, output_paths: Optional[list[Path]] = None) -> bool:
+        """True if the step succeeded with the inputs described by the manifest and its outputs
+        are still the files it wrote. Outputs may have been deleted since, or never be on this
+        host when the ledger is shared by workers of several hosts. Outputs whose sizes and
+        modification times are unchanged are not read; the others are compared by checksum.
+
+        Args:
+            manifest (Manifest): Current manifest of the step
+            output_paths (Optional[list[Path]], optional): Files the step writes. Defaults to None (no files).
+
+        Returns:
+            bool: Whether the step can be skipped
+        """
+        if self.status != StepStatus.SUCCEEDED or self.input_fingerprint != manifest.fingerprint:
+            return False
+
+        output_paths = output_paths or []
+        try:
+            stats = stat_outputs(output_paths=output_paths)
+        except FileNotFoundError:
+            return False
+
+        return (
+            self.output_checksum is None
+            or len(output_paths) == 0
+            or stats == self.output_stats
+            or fingerprint_inputs(input_paths=output_paths) == self.output_checksum
+        )
+
+
+@dataclass
+class StepRun:
+    """Outputs of a processing step, filled in while the step runs and recorded when it finishes"""
+
+    output_paths: list[Path] = field(default_factory=list)
+    row_count: Optional[int] = None
+
+
+def get_ledger_key(chelsa_product: ChelsaProduct, month: Optional[str] = None) -> tuple[str, str, str]:
+    """(product, scenario, month) key of a product's month in the run ledger
+
+    Args:
+        chelsa_product (ChelsaProduct): Product, scenario and month
+        month (Optional[str], optional): Month to use instead of the product's month, eg. ALL_MONTHS. Defaults to None.
+
+    Returns:
+        tuple[str, str, str]: Ledger key
+    """
+    return (
+        chelsa_product.product.value,
+        chelsa_product.scenario.value,
+        month if month is not None else str(chelsa_product.month.value),
+    )
+
+
+def read_ledger(chelsa_products: list[ChelsaProduct]) -> dict[tuple[str, str, str, str], LedgerEntry]:
+    """Ledger entries of every recorded step of the products' scenarios, read in a single query.
+    All months of each product and scenario are returned, not only the months requested.
+
+    Args:
+        chelsa_products (list[ChelsaProduct]): Products whose scenarios are read
+
+    Returns:
+        dict[tuple[str, str, str, str], LedgerEntry]: Entry per (product, scenario, month, step)
+    """
+    create_ledger_table()
+    pairs = {get_ledger_key(chelsa_product)[:2] for chelsa_product in chelsa_products}
+    if len(pairs) == 0:
+        return {}
+
+    query = select(
+        RunLedgerTable.product,
+        RunLedgerTable.scenario,
+        RunLedgerTable.month,
+        RunLedgerTable.step,
+        RunLedgerTable.status,
+        RunLedgerTable.input_fingerprint,
+        RunLedgerTable.output_checksum,
+        RunLedgerTable.output_stats,
+    ).where(
+        RunLedgerTable.product.in_({product for product, _ in pairs}),
+        RunLedgerTable.scenario.in_({scenario for _, scenario in pairs}),
+    )
+
+    with get_session() as Session:
+        with Session() as session:
+            rows = session.execute(query).all()
+
+    return {
+        (product, scenario, month, step): LedgerEntry(
+            status=StepStatus(status),
+            input_fingerprint=input_fingerprint,
+            output_checksum=output_checksum,
+            output_stats=output_stats,
+        )
+        for product, scenario, month, step, status, input_fingerprint, output_checksum, output_stats in rows
+        if (product, scenario) in pairs
+    }
+
+
+def record_step(
+    chelsa_product: ChelsaProduct,
+    step: str,
+    status: StepStatus,
+    month: Optional[str] = None,
+    input_fingerprint: Optional[str] = None,
+    output_checksum: Optional[str] = None,
+    output_stats: Optional[str] = None,
+    row_count: Optional[int] = None,
+    duration_seconds: Optional[float] = None,
+    error: Optional[str] = None,
+) -> None:
+    """Insert or update the ledger entry of a step. Starting a step (RUNNING) counts an attempt.
+
+    Args:
+        chelsa_product (ChelsaProduct): Product, scenario and month the step ran for
+        step (str): Name of the processing step
+        status (StepStatus): Status of the step
+        month (Optional[str], optional): Ledger month, if not the product's month. Defaults to None.
+        input_fingerprint (Optional[str], optional): Hash of the step's inputs. Defaults to None.
+        output_checksum (Optional[str], optional): Hash of the step's outputs. Defaults to None.
+        output_stats (Optional[str], optional): Sizes and modification times of the step's outputs. Defaults to None.
+        row_count (Optional[int], optional): Rows produced or uploaded by the step. Defaults to None.
+        duration_seconds (Optional[float], optional): Duration of the step. Defaults to None.
+        error (Optional[str], optional): Error of a failed step. Defaults to None.
+    """
+    create_ledger_table()
+    product, scenario, ledger_month = get_ledger_key(chelsa_product=chelsa_product, month=month)
+    now = datetime.now()
+
+    with get_session() as Session:
+        with Session() as session:
+            entry = session.get(RunLedgerTable, (product, scenario, ledger_month, step))
+            if entry is None:
+                entry = RunLedgerTable(
+                    product=product, scenario=scenario, month=ledger_month, step=step, attempts=0, started_at=now
+                )
+                session.add(entry)
+
+            if status == StepStatus.RUNNING:
+                entry.attempts += 1
+                entry.started_at = now
+                entry.finished_at = None
+            else:
+                entry.finished_at = now
+
+            entry.status = status.value
+            entry.input_fingerprint = input_fingerprint
+            entry.output_checksum = output_checksum
+            entry.output_stats = output_stats
+            entry.row_count = row_count
+            entry.duration_seconds = duration_seconds
+            entry.error = error
+            session.commit()
+
+
+@contextmanager
+def track_step(
+    chelsa_product: ChelsaProduct,
+    manifest: Manifest,
+    month: Optional[str] = None,
+) -> Iterator[StepRun]:
+    """Records a step in the run ledger: RUNNING when it starts, then SUCCEEDED with
+    output checksums, row count and duration, or FAILED with the error, which is re-raised.
+    The manifest's fingerprint is recorded as the input fingerprint, and the manifest is
+    saved next to every output of a successful step, and the step is measured under its name.
+
+    Args:
+        chelsa_product (ChelsaProduct): Product, scenario and month the step runs for
+        manifest (Manifest): Manifest of the step
+        month (Optional[str], optional): Ledger month, if not the product's month. Defaults to None.
+
+    Yields:
+        Iterator[StepRun]: Outputs to fill in while the step runs
+    """
+    record_step(
+        chelsa_product=chelsa_product,
+        step=manifest.step,
+        status=StepStatus.RUNNING,
+        month=month,
+        input_fingerprint=manifest.fingerprint,
+    )
+
+    run = StepRun()
+    start = time.perf_counter()
+    with measure(manifest.step) as stage:
+        try:
+            yield run
+        except Exception as e:
+            record_step(
+                chelsa_product=chelsa_product,
+                step=manifest.step,
+                status=StepStatus.FAILED,
+                month=month,
+                input_fingerprint=manifest.fingerprint,
+                duration_seconds=time.perf_counter() - start,
+                error=repr(e),
+            )
+            raise
+        stage.rows = run.row_count
+
+    record_completed_step(
+        chelsa_product=chelsa_product,
+        manifest=manifest,
+        output_paths=run.output_paths,
+        row_count=run.row_count,
+        duration_seconds=time.perf_counter() - start,
+        month=month,
+    )
+
+
+def record_completed_step(
+    chelsa_product: ChelsaProduct,
+    manifest: Manifest,
+    output_paths: Optional[list[Path]] = None,
+    row_count: Optional[int] = None,
+    duration_seconds: Optional[float] = None,
+    month: Optional[str] = None,
+) -> None:
+    """Record a successful step and save its manifest next to each of its outputs
+
+    Args:
+        chelsa_product (ChelsaProduct): Product, scenario and month the step ran for
+        manifest (Manifest): Manifest of the step
+        output_paths (Optional[list[Path]], optional): Files written by the step. Defaults to None (no files).
+        row_count (Optional[int], optional): Rows produced or uploaded by the step. Defaults to None.
+        duration_seconds (Optional[float], optional): Duration of the step. Defaults to None.
+        month (Optional[str], optional): Ledger month, if not the product's month. Defaults to None.
+    """
+    output_paths = output_paths or []
+    for output_path in output_paths:
+        manifest.write(artefact_path=output_path, output_checksum=file_checksum(output_path))
+
+    record_step(
+        chelsa_product=chelsa_product,
+        step=manifest.step,
+        status=StepStatus.SUCCEEDED,
+        month=month,
+        input_fingerprint=manifest.fingerprint,
+        output_checksum=fingerprint_inputs(input_paths=output_paths) if output_paths else None,
+        output_stats=stat_outputs(output_paths=output_paths) if output_paths else None,
+        row_count=row_count,
+        duration_seconds=duration_seconds,
+    )
+
+
+def fingerprint_inputs(input_paths: Optional[list[Path]] = None, parameters: Optional[list] = None) -> str:
+    """Hash of the contents of files and of other parameters
+
+    Args:
+        input_paths (Optional[list[Path]], optional): Files to hash. Defaults to None (no files).
+        parameters (Optional[list], optional): Values hashed by their string representation. Defaults to None.
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    for path in input_paths or []:
+        digest.update(file_checksum(path).encode())
+    for parameter in parameters or []:
+        digest.update(f"|{parameter}".encode())
+    return digest.hexdigest()
+
+
+def stat_outputs(output_paths: list[Path]) -> str:
+    """Sizes and modification times of files, compared to tell whether they changed without reading them
+
+    Args:
+        output_paths (list[Path]): Files to stat
+
+    Raises:
+        FileNotFoundError: If a file does not exist
+
+    Returns:
+        str: JSON list of (size, modification time in ns) of every file
+    """
+    stats = [os.stat(output_path) for output_path in output_paths]
+    return json.dumps([(stat.st_size, stat.st_mtime_ns) for stat in stats])
+
+
+def file_checksum(path: Union[str, Path]) -> str:
+    """SHA-256 of a file. Checksums are memoized per file size and modification time.
+
+    Args:
+        path (Union[str, Path]): Path to the file
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    stat = os.stat(path)
+    memo_key = (str(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_checksums:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _file_checksums[memo_key] = digest.hexdigest()
+
+    return _file_checksums[memo_key]
+
+
+def create_ledger_table() -> None:
+    """Create the run ledger table if it does not exist (once per process).
+    Postgres databases get the table from the Alembic migration; this covers local SQLite databases."""
+    global _ledger_created
+    if _ledger_created:
+        return
+
+    with get_session() as Session:
+        with Session() as session:
+            RunLedgerTable.__table__.create(bind=session.connection(), checkfirst=True)
+            session.commit()
+    _ledger_created = True
@@ -1,9 +1,20 @@
 import logging
+import time
 
-from climatology import Month, Product, Scenario, get_climatology
+from bulk_download import download_matrix
+from climatology import (ChelsaProduct, Month, Product, Scenario,
+                         get_climatology)
 from config import read_config
+from cube import calculate_cube_statistics
+from ledger import ALL_MONTHS, record_completed_step
 from log import setup_logger
-from processing_steps import execute_processing_steps, get_processing_steps
+from manifest import get_step_manifest
+from metrics import export_metrics, measure
+from processing_steps import (RasterProcessingStep, execute_processing_steps,
+                              get_processing_steps, get_step_outputs,
+                              plan_processing_steps,
+                              update_ensemble_statistics)
+from store import count_rows
 
 config = read_config("config.json")
 logger = setup_logger()
@@ -34,15 +45,116 @@ def run_single_month(product: Product, scenario: Scenario, month: Month):
     execute_processing_steps(
         processing_steps=processing_steps, chelsa_product=chelsa_product
     )
+    export_metrics(run_name="single_month")
 
 
 def run_all_months(product: Product, scenario: Scenario):
-    """All months for a given product's scenario"""
+    """All months for a given product's scenario.
+    Rasters are downloaded concurrently before the months are processed."""
     available_months = [month for month in Month]
 
-    for month in available_months:
-        run_single_month(product=product, scenario=scenario, month=month)
+    download_matrix(products=[product], scenarios=[scenario], months=available_months)
 
+    # All months are planned with a single ledger query
+    chelsa_products = [
+        get_climatology(product=product, scenario=scenario, month=month) for month in available_months
+    ]
+    for chelsa_product, processing_steps in zip(
+        chelsa_products, plan_processing_steps(chelsa_products=chelsa_products)
+    ):
+        logger.info(
+            f"Processing steps: {[step.name for step in processing_steps]} for {product.name}_{scenario.name}_{chelsa_product.month.name}"
+        )
+        execute_processing_steps(processing_steps=processing_steps, chelsa_product=chelsa_product)
+
+    export_metrics(run_name="all_months")
+    logging.shutdown()
+
+
+def run_scenario_cube(products: list[Product], scenario: Scenario):
+    """All months of a scenario, for one or more products, with zonal statistics computed
+    in a single pass over a cube of the 12 monthly rasters of every product.
+    The yearly table is produced directly by the cube, so the yearly table step is skipped.
+    The cube is the "vectorized" engine; with another config.zonal_engine, the zonal statistics
+    and yearly tables are processed month by month with that engine instead.
+
+    Args:
+        products (list[Product]): CHELSA products, sharing a raster grid
+        scenario (Scenario): CMIP scenario
+    """
+    available_months = [month for month in Month]
+    download_matrix(products=products, scenarios=[scenario], months=available_months)
+
+    chelsa_products = [
+        get_climatology(product=product, scenario=scenario, month=month)
+        for product in products
+        for month in available_months
+    ]
+    planned_steps = plan_processing_steps(chelsa_products=chelsa_products)
+
+    raster_steps = [RasterProcessingStep.DOWNLOAD, RasterProcessingStep.MASK]
+    for chelsa_product, processing_steps in zip(chelsa_products, planned_steps):
+        execute_processing_steps(
+            processing_steps=[step for step in processing_steps if step in raster_steps],
+            chelsa_product=chelsa_product,
+        )
+
+    if config.zonal_engine != "vectorized":
+        logger.info(f"The cube computes vectorized statistics, processing months with the {config.zonal_engine} engine")
+        table_steps = [RasterProcessingStep.ZONAL_STATISTICS, RasterProcessingStep.YEARLY_TABLE]
+        for chelsa_product, processing_steps in zip(chelsa_products, planned_steps):
+            execute_processing_steps(
+                processing_steps=[step for step in processing_steps if step in table_steps],
+                chelsa_product=chelsa_product,
+            )
+    elif any(RasterProcessingStep.ZONAL_STATISTICS in steps for steps in planned_steps):
+        logger.info(f"Calculating cube statistics for {[product.name for product in products]}_{scenario.name}")
+        start = time.perf_counter()
+        with measure("cube_statistics"):
+            calculate_cube_statistics(products=products, scenario=scenario)
+        _record_cube_outputs(chelsa_products=chelsa_products, duration_seconds=time.perf_counter() - start)
+        for chelsa_product in {chelsa_product.product: chelsa_product for chelsa_product in chelsa_products}.values():
+            update_ensemble_statistics(chelsa_product=chelsa_product)
+
+    for chelsa_product, processing_steps in zip(chelsa_products, planned_steps):
+        if RasterProcessingStep.UPLOAD in processing_steps:
+            execute_processing_steps(
+                processing_steps=[RasterProcessingStep.UPLOAD], chelsa_product=chelsa_product
+            )
+
+    export_metrics(run_name="scenario_cube")
+    logging.shutdown()
+
+
+def _record_cube_outputs(chelsa_products: list[ChelsaProduct], duration_seconds: float) -> None:
+    """Record the monthly zonal statistics and yearly tables written by the cube in the run ledger.
+    The duration of the cube is shared equally by its months."""
+    for chelsa_product in chelsa_products:
+        record_completed_step(
+            chelsa_product=chelsa_product,
+            manifest=get_step_manifest(chelsa_product=chelsa_product, step=RasterProcessingStep.ZONAL_STATISTICS.name),
+            output_paths=get_step_outputs(chelsa_product=chelsa_product, step=RasterProcessingStep.ZONAL_STATISTICS),
+            row_count=count_rows(chelsa_product.zonal_file_path),
+            duration_seconds=duration_seconds / len(chelsa_products),
+        )
+
+    # The yearly table of every product is written under its last month
+    last_months = {chelsa_product.product: chelsa_product for chelsa_product in chelsa_products}
+    for chelsa_product in last_months.values():
+        record_completed_step(
+            chelsa_product=chelsa_product,
+            manifest=get_step_manifest(chelsa_product=chelsa_product, step=RasterProcessingStep.YEARLY_TABLE.name),
+            output_paths=get_step_outputs(chelsa_product=chelsa_product, step=RasterProcessingStep.YEARLY_TABLE),
+            row_count=count_rows(chelsa_product.yearly_aggregate_path),
+            month=ALL_MONTHS,
+        )
+
+
+def download_all():
+    """Concurrently download every product, scenario and month that is not yet available"""
+    download_matrix()
+
+    export_metrics(run_name="download")
     logging.shutdown()
 
 
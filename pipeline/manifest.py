@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional, Union
+
+from climatology import ChelsaProduct, Month, get_climatology
+from config import CMIPConfig, read_config
+from vector_processing import COLUMN_MAPPING, fingerprint_geometry_file
+
+config = read_config("config.json")
+
+# Version of the code of every step. Bump a step's version when a change alters its outputs,
+# so its artefacts, and the artefacts that depend on them, are recomputed.
+STEP_VERSIONS = {
+    "DOWNLOAD": 1,
+    "MASK": 1,
+    "ZONAL_STATISTICS": 4,
+    "YEARLY_TABLE": 2,
+    "UPLOAD": 1,
+    "ENSEMBLE": 1,
+}
+
+
+@dataclass
+class Manifest:
+    """Everything an artefact of a step is computed from: the fingerprints of its inputs,
+    the config fields that affect it and the version of the step's code"""
+
+    step: str
+    inputs: dict[str, str] = field(default_factory=dict)
+    settings: dict[str, str] = field(default_factory=dict)
+    code_version: int = 0
+
+    def __post_init__(self):
+        self.code_version = self.code_version or STEP_VERSIONS[self.step]
+
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha256(json.dumps(asdict(self), sort_keys=True).encode()).hexdigest()
+
+    def write(self, artefact_path: Union[str, Path], output_checksum: Optional[str] = None) -> None:
+        """Save the manifest next to the artefact, as <artefact>.manifest.json
+
+        Args:
+            artefact_path (Union[str, Path]): Path of the artefact
+            output_checksum (Optional[str], optional): Checksum of the artefact. Defaults to None.
+        """
+        manifest = {**asdict(self), "fingerprint": self.fingerprint, "output_checksum": output_checksum}
+        temporary_path = Path(f"{get_manifest_path(artefact_path)}.{os.getpid()}.tmp")
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        os.replace(temporary_path, get_manifest_path(artefact_path))
+
+
+def get_manifest_path(artefact_path: Union[str, Path]) -> Path:
+    """Path of the manifest of an artefact"""
+    return Path(f"{artefact_path}.manifest.json")
+
+
+def read_manifest(artefact_path: Union[str, Path]) -> Optional[dict]:
+    """Manifest saved next to an artefact, or None if there is none"""
+    manifest_path = get_manifest_path(artefact_path)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def download_manifest(chelsa_product: ChelsaProduct, settings: CMIPConfig = config) -> Manifest:
+    """Manifest of a raw raster. Windowed downloads depend on the geometry's bounds."""
+    inputs = {"url": chelsa_product.get_url(chelsa_product.scenario, chelsa_product.month)}
+    if settings.windowed_download:
+        inputs["geometry"] = fingerprint_geometry_file(settings.geom_path)
+
+    return Manifest(
+        step="DOWNLOAD",
+        inputs=inputs,
+        settings={"windowed_download": str(settings.windowed_download)},
+    )
+
+
+def mask_manifest(chelsa_product: ChelsaProduct, settings: CMIPConfig = config) -> Manifest:
+    """Manifest of a masked raster"""
+    return Manifest(
+        step="MASK",
+        inputs={
+            "raw_raster": download_manifest(chelsa_product, settings).fingerprint,
+            "geometry": fingerprint_geometry_file(settings.geom_path),
+        },
+        settings={"zone_cache": str(settings.zone_cache), "streaming": str(settings.streaming)},
+    )
+
+
+def zonal_manifest(chelsa_product: ChelsaProduct, settings: CMIPConfig = config) -> Manifest:
+    """Manifest of a month's zonal statistics. The coverage engine reads the raw raster,
+    other engines the masked raster."""
+    if settings.zonal_engine == "coverage":
+        raster = {"raw_raster": download_manifest(chelsa_product, settings).fingerprint}
+    else:
+        raster = {"masked_raster": mask_manifest(chelsa_product, settings).fingerprint}
+
+    engine_settings = {
+        "coverage": {"coverage_supersample": str(settings.coverage_supersample)},
+        "streaming": {"histogram_bins": str(settings.histogram_bins), "memory_budget_mb": str(settings.memory_budget_mb)},
+    }
+    # Rollups accumulate a histogram whatever the engine. Its bins are capped by the memory budget
+    rollup_settings = (
+        {
+            "admin_rollups": " ".join(settings.admin_rollups),
+            "histogram_bins": str(settings.histogram_bins),
+            "memory_budget_mb": str(settings.memory_budget_mb),
+        }
+        if settings.admin_rollups
+        else {}
+    )
+    return Manifest(
+        step="ZONAL_STATISTICS",
+        inputs={**raster, "geometry": fingerprint_geometry_file(settings.geom_path)},
+        settings={
+            "zonal_stats_aggregates": settings.zonal_stats_aggregates,
+            "zonal_engine": settings.zonal_engine,
+            "adm_unique_id": settings.adm_unique_id,
+            "column_mapping": json.dumps(COLUMN_MAPPING, sort_keys=True),
+            **engine_settings.get(settings.zonal_engine, {}),
+            **rollup_settings,
+        },
+    )
+
+
+def yearly_manifest(chelsa_product: ChelsaProduct, settings: CMIPConfig = config) -> Manifest:
+    """Manifest of the yearly table of a product's scenario, built from the zonal statistics of all months"""
+    return Manifest(
+        step="YEARLY_TABLE",
+        inputs={
+            f"zonal_statistics_{month.value}": zonal_manifest(
+                get_climatology(product=chelsa_product.product, scenario=chelsa_product.scenario, month=month),
+                settings,
+            ).fingerprint
+            for month in Month
+        },
+        settings={"adm_unique_id": settings.adm_unique_id},
+    )
+
+
+def upload_manifest(chelsa_product: ChelsaProduct, settings: CMIPConfig = config) -> Manifest:
+    """Manifest of the upload of a month's zonal statistics"""
+    return Manifest(
+        step="UPLOAD",
+        inputs={"zonal_statistics": zonal_manifest(chelsa_product, settings).fingerprint},
+    )
+
+
+def get_step_manifest(chelsa_product: ChelsaProduct, step: str, settings: CMIPConfig = config) -> Manifest:
+    """Manifest of a processing step of a product, scenario and month
+
+    Args:
+        chelsa_product (ChelsaProduct): Product, scenario and month
+        step (str): Name of the processing step
+        settings (CMIPConfig, optional): Config the step runs with. Defaults to config.
+
+    Returns:
+        Manifest: Manifest of the step's artefact
+    """
+    factories = {
+        "DOWNLOAD": download_manifest,
+        "MASK": mask_manifest,
+        "ZONAL_STATISTICS": zonal_manifest,
+        "YEARLY_TABLE": yearly_manifest,
+        "UPLOAD": upload_manifest,
+    }
+
+    return factories[step](chelsa_product, settings)
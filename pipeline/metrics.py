@@ -0,0 +1,281 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from config import read_config
+
+logger = logging.getLogger(__name__)
+
+config = read_config("config.json")
+
+# Counters of /proc/self/io: bytes passed to read and write system calls, including sockets
+PROC_IO_PATH = "/proc/self/io"
+
+
+@dataclass
+class StageMetrics:
+    """Measurements of one call of an instrumented stage or function.
+    Bytes are counted for the whole process, so concurrent threads are included."""
+
+    name: str
+    started_at: str
+    wall_seconds: float = 0
+    cpu_seconds: float = 0
+    peak_rss_bytes: int = 0
+    tracemalloc_peak_bytes: Optional[int] = None
+    bytes_read: Optional[int] = None
+    bytes_written: Optional[int] = None
+    rows: Optional[int] = None
+
+
+class MetricsRegistry:
+    """Thread-safe store of the measurements of a run"""
+
+    def __init__(self):
+        self._records: list[StageMetrics] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: StageMetrics) -> None:
+        with self._lock:
+            self._records.append(record)
+
+    def merge(self, records: list[StageMetrics]) -> None:
+        """Add measurements taken in another process"""
+        with self._lock:
+            self._records.extend(records)
+
+    def drain(self) -> list[StageMetrics]:
+        """Remove and return all measurements, eg. to send them from a worker process to its parent"""
+        with self._lock:
+            records, self._records = self._records, []
+        return records
+
+    def records(self) -> list[StageMetrics]:
+        with self._lock:
+            return list(self._records)
+
+    def summary(self) -> dict[str, dict]:
+        """Totals per stage: calls, wall and CPU time, bytes and rows, and the highest memory peaks"""
+        summary: dict[str, dict] = {}
+        for record in self.records():
+            stage = summary.setdefault(
+                record.name,
+                {
+                    "calls": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "peak_rss_bytes": 0,
+                    "tracemalloc_peak_bytes": 0,
+                    "bytes_read": 0,
+                    "bytes_written": 0,
+                    "rows": 0,
+                },
+            )
+            stage["calls"] += 1
+            stage["wall_seconds"] += record.wall_seconds
+            stage["cpu_seconds"] += record.cpu_seconds
+            stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], record.peak_rss_bytes)
+            stage["tracemalloc_peak_bytes"] = max(stage["tracemalloc_peak_bytes"], record.tracemalloc_peak_bytes or 0)
+            stage["bytes_read"] += record.bytes_read or 0
+            stage["bytes_written"] += record.bytes_written or 0
+            stage["rows"] += record.rows or 0
+        return summary
+
+
+registry = MetricsRegistry()
+_depth = threading.local()
+
+
+@contextmanager
+def measure(name: str, profile: Optional[bool] = None) -> Iterator[StageMetrics]:
+    """Measures wall time, CPU time, peak memory and bytes read and written of a block.
+    Set rows on the yielded record to report the rows produced. Memory allocated by
+    Python is traced with tracemalloc when config.trace_memory is set, and stages listed
+    in config.profile_stages are profiled with config.profiler.
+
+    Args:
+        name (str): Stage or function name
+        profile (Optional[bool], optional): Profile the block. Defaults to None (name in config.profile_stages).
+
+    Yields:
+        Iterator[StageMetrics]: Measurements, filled in when the block ends
+    """
+    if not config.metrics:
+        yield StageMetrics(name=name, started_at=datetime.now().isoformat())
+        return
+
+    outermost = getattr(_depth, "value", 0) == 0
+    _depth.value = getattr(_depth, "value", 0) + 1
+    if config.trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if outermost and tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    profile = name in config.profile_stages if profile is None else profile
+    profiler = _start_profiler() if profile else None
+
+    record = StageMetrics(name=name, started_at=datetime.now().isoformat())
+    io_start = _read_io_counters()
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield record
+    finally:
+        record.wall_seconds = time.perf_counter() - wall_start
+        record.cpu_seconds = time.thread_time() - cpu_start
+        record.peak_rss_bytes = _peak_rss_bytes()
+        if tracemalloc.is_tracing():
+            record.tracemalloc_peak_bytes = tracemalloc.get_traced_memory()[1]
+        io_end = _read_io_counters()
+        if io_start is not None and io_end is not None:
+            record.bytes_read = io_end[0] - io_start[0]
+            record.bytes_written = io_end[1] - io_start[1]
+
+        if profiler is not None:
+            _stop_profiler(profiler, name=name)
+        _depth.value -= 1
+        registry.add(record)
+
+
+def instrumented(name: str) -> Callable:
+    """Decorator that measures every call of a function under the given name"""
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with measure(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def export_metrics(
+    run_name: str = "pipeline",
+    metrics_dir: Path = Path(f"{config.root_dir}/{config.metrics_dir}/"),
+) -> Optional[Path]:
+    """Writes the measurements of the run as a Prometheus textfile (<run_name>.prom, for the
+    node exporter's textfile collector) and a JSON run report (<run_name>_<timestamp>.json)
+
+    Args:
+        run_name (str, optional): Name of the run, used in file names and as a metric label. Defaults to "pipeline".
+        metrics_dir (Path, optional): Output directory. Defaults to <root_dir>/<metrics_dir>.
+
+    Returns:
+        Optional[Path]: Path of the JSON run report, or None if metrics are disabled
+    """
+    if not config.metrics:
+        return None
+
+    os.makedirs(metrics_dir, exist_ok=True)
+    summary = registry.summary()
+
+    _write_atomic(Path(f"{metrics_dir}/{run_name}.prom"), format_prometheus(summary=summary, run_name=run_name))
+
+    report_path = Path(f"{metrics_dir}/{run_name}_{datetime.now().strftime('%Y%m%dT%H%M%S')}.json")
+    report = {
+        "run": run_name,
+        "exported_at": datetime.now().isoformat(),
+        "stages": summary,
+        "calls": [asdict(record) for record in registry.records()],
+    }
+    _write_atomic(report_path, json.dumps(report, indent=4))
+    logger.info(f"Metrics report saved to {report_path}")
+
+    return report_path
+
+
+def format_prometheus(summary: dict[str, dict], run_name: str) -> str:
+    """Prometheus text exposition of the stage totals
+
+    Args:
+        summary (dict[str, dict]): Totals per stage, as returned by MetricsRegistry.summary
+        run_name (str): Value of the run label
+
+    Returns:
+        str: Metrics in the Prometheus text format
+    """
+    metrics = [
+        ("calls", "counter", "Calls of the stage"),
+        ("wall_seconds", "counter", "Wall time spent in the stage"),
+        ("cpu_seconds", "counter", "CPU time of the thread running the stage"),
+        ("bytes_read", "counter", "Bytes read by the process while the stage ran"),
+        ("bytes_written", "counter", "Bytes written by the process while the stage ran"),
+        ("rows", "counter", "Rows produced by the stage"),
+        ("peak_rss_bytes", "gauge", "Peak resident set size of the process after the stage"),
+        ("tracemalloc_peak_bytes", "gauge", "Peak memory allocated by Python during the stage"),
+    ]
+    lines = []
+    for metric, metric_type, description in metrics:
+        suffix = "_total" if metric_type == "counter" else ""
+        lines.append(f"# HELP pipeline_stage_{metric}{suffix} {description}")
+        lines.append(f"# TYPE pipeline_stage_{metric}{suffix} {metric_type}")
+        for stage, totals in sorted(summary.items()):
+            lines.append(f'pipeline_stage_{metric}{suffix}{{run="{run_name}",stage="{stage}"}} {totals[metric]}')
+
+    return "\n".join(lines) + "\n"
+
+
+def _read_io_counters() -> Optional[tuple[int, int]]:
+    """(bytes read, bytes written) by the process so far, where /proc is available"""
+    try:
+        with open(PROC_IO_PATH) as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _peak_rss_bytes() -> int:
+    """Peak resident set size of the process. ru_maxrss is in kilobytes on Linux and bytes on macOS."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _start_profiler():
+    """Start a cProfile or pyinstrument profiler, depending on config.profiler"""
+    if config.profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("pyinstrument is not installed. Install it or set profiler to cprofile.")
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler, name: str) -> None:
+    """Save the profile of a stage to <root_dir>/<metrics_dir>/profiles"""
+    profile_dir = Path(f"{config.root_dir}/{config.metrics_dir}/profiles/")
+    os.makedirs(profile_dir, exist_ok=True)
+    stem = f"{name}_{datetime.now().strftime('%Y%m%dT%H%M%S%f')}_{os.getpid()}"
+
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(Path(f"{profile_dir}/{stem}.prof"))
+    else:
+        profiler.stop()
+        with open(Path(f"{profile_dir}/{stem}.html"), "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+
+
+def _write_atomic(path: Path, content: str) -> None:
+    temporary_path = Path(f"{path}.{os.getpid()}.tmp")
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temporary_path, path)
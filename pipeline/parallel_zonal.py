@@ -0,0 +1,158 @@
+import heapq
+import logging
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from affine import Affine
+from config import read_config
+from rasterstats import zonal_stats
+
+logger = logging.getLogger(__name__)
+
+config = read_config("config.json")
+
+# Chunks per worker. More chunks than workers evens out chunks whose cost was misestimated.
+CHUNKS_PER_WORKER = 4
+
+_shared_raster: Optional[np.ndarray] = None
+_shared_memory: Optional[shared_memory.SharedMemory] = None
+
+
+def parallel_zonal_statistics(
+    raster_location: Path,
+    geometry: gpd.GeoDataFrame,
+    stats_list: list[str],
+    nodata: float = -999,
+    workers: Optional[int] = config.zonal_workers,
+) -> dict[str, list]:
+    """Calculates rasterstats zonal statistics on a process pool.
+    The raster is read once into shared memory and every worker attaches to it without copying.
+    Geometries are split into chunks balanced by their estimated pixel count, and the
+    results are returned in the geometry's original row order.
+
+    Args:
+        raster_location (Path): Location of the raster
+        geometry (gpd.GeoDataFrame): Geometries used as zones
+        stats_list (list[str]): Statistics to calculate
+        nodata (float, optional): Raster value that symbolizes no data. Defaults to -999.
+        workers (Optional[int], optional): Number of worker processes. Defaults to config.zonal_workers
+            (all CPUs when not set).
+
+    Returns:
+        dict[str, list]: One value per geometry for every statistic, in the geometry's row order
+    """
+    workers = workers or os.cpu_count() or 1
+
+    with rasterio.open(raster_location, "r") as src:
+        raster = src.read(1)
+        transform = src.transform
+        if geometry.crs is not None and src.crs != geometry.crs:
+            geometry = gpd.GeoDataFrame(geometry.to_crs(src.crs))
+
+    chunks = balance_chunks(
+        pixel_counts=estimate_pixel_counts(geometry=geometry, transform=transform),
+        n_chunks=workers * CHUNKS_PER_WORKER,
+    )
+    geometries = list(geometry.geometry)
+    results: list[Optional[dict]] = [None] * len(geometries)
+
+    shared = shared_memory.SharedMemory(create=True, size=max(raster.nbytes, 1))
+    try:
+        shared_raster = np.ndarray(raster.shape, dtype=raster.dtype, buffer=shared.buf)
+        shared_raster[:] = raster
+        del raster
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_attach_shared_raster,
+            initargs=(shared.name, shared_raster.shape, shared_raster.dtype.str),
+        ) as executor:
+            futures = [
+                (
+                    positions,
+                    executor.submit(
+                        _chunk_zonal_statistics,
+                        [geometries[position] for position in positions],
+                        transform,
+                        stats_list,
+                        nodata,
+                    ),
+                )
+                for positions in chunks
+            ]
+            for positions, future in futures:
+                for position, result in zip(positions, future.result()):
+                    results[position] = result
+    finally:
+        shared.close()
+        shared.unlink()
+
+    return {stat: [result[stat] for result in results] for stat in stats_list}
+
+
+def estimate_pixel_counts(geometry: gpd.GeoDataFrame, transform: Affine) -> np.ndarray:
+    """Approximate number of raster pixels in every geometry, from its area and the pixel area
+
+    Args:
+        geometry (gpd.GeoDataFrame): Geometries in the raster's CRS
+        transform (Affine): Transform of the raster
+
+    Returns:
+        np.ndarray: Estimated pixel count per geometry (at least 1)
+    """
+    pixel_area = abs(transform.a * transform.e)
+    with warnings.catch_warnings():
+        # Areas in a geographic CRS are only compared with the pixel area in the same units
+        warnings.simplefilter("ignore", UserWarning)
+        areas = np.nan_to_num(np.asarray(geometry.geometry.area, dtype=np.float64))
+    return np.maximum(areas / pixel_area, 1)
+
+
+def balance_chunks(pixel_counts: np.ndarray, n_chunks: int) -> list[list[int]]:
+    """Splits row positions into chunks with similar total pixel counts.
+    Largest geometries are assigned first, each to the currently lightest chunk.
+
+    Args:
+        pixel_counts (np.ndarray): Estimated pixel count per row
+        n_chunks (int): Maximum number of chunks
+
+    Returns:
+        list[list[int]]: Non-empty chunks of row positions, each sorted
+    """
+    n_chunks = max(1, min(n_chunks, len(pixel_counts)))
+    heap: list[Tuple[float, int]] = [(0.0, chunk) for chunk in range(n_chunks)]
+    chunks: list[list[int]] = [[] for _ in range(n_chunks)]
+
+    for position in np.argsort(-np.asarray(pixel_counts), kind="stable"):
+        load, chunk = heapq.heappop(heap)
+        chunks[chunk].append(int(position))
+        heapq.heappush(heap, (load + float(pixel_counts[position]), chunk))
+
+    return [sorted(chunk) for chunk in chunks if len(chunk) > 0]
+
+
+def _attach_shared_raster(name: str, shape: Tuple[int, ...], dtype: str) -> None:
+    """Worker initializer: attach to the raster in shared memory"""
+    global _shared_memory, _shared_raster
+    _shared_memory = shared_memory.SharedMemory(name=name)
+    _shared_raster = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_shared_memory.buf)
+
+
+def _chunk_zonal_statistics(
+    geometries: list, transform: Affine, stats_list: list[str], nodata: float
+) -> list[dict]:
+    """Worker task: rasterstats zonal statistics of a chunk of geometries on the shared raster"""
+    return zonal_stats(
+        vectors=geometries,
+        raster=_shared_raster,
+        affine=transform,
+        nodata=nodata,
+        stats=" ".join(stats_list),
+    )
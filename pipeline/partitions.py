@@ -0,0 +1,80 @@
+import re
+from typing import Optional
+
+from sqlalchemy import Connection, Table, text
+
+# Product tables are partitioned by scenario, and every scenario partition by month:
+#   tmin                          PARTITION BY LIST (scenario)
+#   ├── tmin_access1_0_rcp45      PARTITION BY LIST (month)
+#   │   ├── tmin_access1_0_rcp45_m1
+#   │   └── ...
+#   └── tmin_default              rows of scenarios without a partition
+
+
+def get_partition_name(table_name: str, scenario: str, month: Optional[int] = None) -> str:
+    """Name of the partition of a scenario, or of a scenario's month, of a product table
+
+    Args:
+        table_name (str): Product table
+        scenario (str): Scenario value, eg. "ACCESS1-0_rcp45"
+        month (Optional[int], optional): Month number. Defaults to None (the scenario partition).
+
+    Returns:
+        str: Partition name, eg. tmin_access1_0_rcp45_m4
+    """
+    name = f"{table_name}_{re.sub('[^a-z0-9]+', '_', scenario.lower()).strip('_')}"
+    return name if month is None else f"{name}_m{month}"
+
+
+def is_partitioned(connection: Connection, table: Table) -> bool:
+    """True if the table is a partitioned Postgres table"""
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)::oid)"),
+        {"table": table.name},
+    ).scalar()
+
+
+def create_month_partitions(connection: Connection, table: Table, keys: list[tuple[str, int]]) -> None:
+    """Create the scenario and month partitions that do not exist yet. Concurrent uploads
+    wait for each other with an advisory lock on the table, so a partition is created once.
+
+    Args:
+        connection (Connection): Connection to a Postgres database
+        table (Table): Partitioned product table
+        keys (list[tuple[str, int]]): (scenario, month) of the partitions
+    """
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table))"), {"table": table.name})
+    for scenario, month in keys:
+        scenario_partition = get_partition_name(table_name=table.name, scenario=scenario)
+        connection.execute(
+            text(
+                f'CREATE TABLE IF NOT EXISTS "{scenario_partition}" PARTITION OF "{table.name}" '
+                f"FOR VALUES IN ({_quote(scenario)}) PARTITION BY LIST (month)"
+            )
+        )
+        connection.execute(
+            text(
+                f'CREATE TABLE IF NOT EXISTS "{get_partition_name(table.name, scenario, month)}" '
+                f'PARTITION OF "{scenario_partition}" FOR VALUES IN ({int(month)})'
+            )
+        )
+
+
+def truncate_month_partitions(connection: Connection, table: Table, keys: list[tuple[str, int]]) -> None:
+    """Empty the month partitions of the keys. TRUNCATE drops the partitions' files instead
+    of deleting rows one by one, and is rolled back with the transaction.
+
+    Args:
+        connection (Connection): Connection to a Postgres database
+        table (Table): Partitioned product table
+        keys (list[tuple[str, int]]): (scenario, month) of the partitions
+    """
+    partitions = ", ".join(f'"{get_partition_name(table.name, scenario, month)}"' for scenario, month in keys)
+    connection.execute(text(f"TRUNCATE {partitions}"))
+
+
+def _quote(value: str) -> str:
+    """SQL string literal. Partition bounds cannot be bound parameters."""
+    return "'" + value.replace("'", "''") + "'"
@@ -1,13 +1,18 @@
 import logging
-import os
 from enum import Enum, auto
 from pathlib import Path
+from typing import Optional
 
-from climatology import ChelsaProduct
+from climatology import ChelsaProduct, Month, get_climatology
 from config import read_config
 from crop import process_masked_raster
-from download import process_raw_raster
-from upload import _check_if_table_exists, upload_to_db
+from download import get_download_bounds, process_raw_raster
+from ensemble import get_ensemble_table_name, process_ensemble_statistics
+from ledger import ALL_MONTHS, get_ledger_key, read_ledger, track_step
+from manifest import get_step_manifest
+from rollups import ROLLUP_ENGINES
+from store import count_rows
+from upload import upload_to_db
 from yearly_table import process_yearly_table
 from zonal_stats import process_zonal_statistics
 
@@ -24,53 +29,96 @@ class RasterProcessingStep(Enum):
     UPLOAD = auto()
 
 
-def get_processing_steps(chelsa_product: ChelsaProduct) -> list[RasterProcessingStep]:
-    """Determine which processing steps are needed for a given month of the product's scenario.
-    Each pipeline run is for a specific product, month, and scenario pair.
+# Steps that run once per product, scenario and month, in order
+MONTHLY_STEPS = [
+    RasterProcessingStep.DOWNLOAD,
+    RasterProcessingStep.MASK,
+    RasterProcessingStep.ZONAL_STATISTICS,
+]
+
+
+def has_rollups() -> bool:
+    """Whether zonal statistics also write admin 1 and admin 0 rollups: only engines with
+    mergeable aggregates produce them"""
+    return len(config.admin_rollups) > 0 and config.zonal_engine in ROLLUP_ENGINES
+
+
+def get_step_outputs(chelsa_product: ChelsaProduct, step: RasterProcessingStep) -> list[Path]:
+    """Files written by a processing step of a product, scenario and month, in the order they are recorded"""
+    outputs = {
+        RasterProcessingStep.DOWNLOAD: [chelsa_product.raw_raster_path],
+        RasterProcessingStep.MASK: [chelsa_product.cropped_raster_path],
+        RasterProcessingStep.ZONAL_STATISTICS: [
+            chelsa_product.zonal_file_path,
+            *([chelsa_product.rollup_file_path] if has_rollups() else []),
+        ],
+        RasterProcessingStep.YEARLY_TABLE: [chelsa_product.yearly_aggregate_path],
+    }
+    return outputs.get(step, [])
+
+
+def plan_processing_steps(chelsa_products: list[ChelsaProduct]) -> list[list[RasterProcessingStep]]:
+    """Determine which processing steps are needed for several products, scenarios and months.
+    Steps are planned from the run ledger, read in one query for the whole batch: a step is
+    needed unless it succeeded with the fingerprint of its current manifest and its outputs
+    still exist with the checksum recorded by the ledger. Manifests chain
+    the fingerprints of upstream steps, so a change (eg. to the statistics, the geometry or
+    a step's code version) only reruns the steps downstream of it.
+    The yearly table is planned once per product's scenario, for its last month in the batch,
+    when the zonal statistics of all 12 months are up to date or planned.
 
-    TODO: Log pipeline runs on postgres database.
-    """
-
-    processing_steps = []
+    Args:
+        chelsa_products (list[ChelsaProduct]): Products to plan, each for a scenario and month
 
-    if not os.path.exists(chelsa_product.raw_raster_path):
-        processing_steps.append(RasterProcessingStep.DOWNLOAD)
+    Returns:
+        list[list[RasterProcessingStep]]: Processing steps of every product, in the same order
+    """
+    ledger = read_ledger(chelsa_products=chelsa_products)
 
-    if not os.path.exists(chelsa_product.cropped_raster_path):
-        processing_steps.append(RasterProcessingStep.MASK)
+    def is_current(chelsa_product: ChelsaProduct, step: RasterProcessingStep, month: Optional[str] = None) -> bool:
+        entry = ledger.get((*get_ledger_key(chelsa_product=chelsa_product, month=month), step.name))
+        return entry is not None and entry.is_current(
+            manifest=get_step_manifest(chelsa_product=chelsa_product, step=step.name),
+            output_paths=get_step_outputs(chelsa_product=chelsa_product, step=step),
+        )
 
-    if not os.path.exists(chelsa_product.zonal_file_path):
-        processing_steps.append(RasterProcessingStep.ZONAL_STATISTICS)
+    planned_steps = []
+    zonal_planned = set()
+    last_in_batch = {}
+    for position, chelsa_product in enumerate(chelsa_products):
+        processing_steps = [step for step in MONTHLY_STEPS if not is_current(chelsa_product, step)]
 
-    all_months_available = _check_monthly_zonal_stats_complete(
-        zonal_path=Path(chelsa_product.zonal_stats_dir)
-    )
-    if all_months_available and not os.path.exists(
-        chelsa_product.yearly_aggregate_path
-    ):
-        processing_steps.append(RasterProcessingStep.YEARLY_TABLE)
+        if RasterProcessingStep.ZONAL_STATISTICS in processing_steps:
+            zonal_planned.add(get_ledger_key(chelsa_product))
+        last_in_batch[get_ledger_key(chelsa_product)[:2]] = position
+        planned_steps.append(processing_steps)
 
-    # table_exists = _check_if_table_exists(table_name=f"{scenario}_{month}")
-    # if not table_exists:
-    processing_steps.append(RasterProcessingStep.UPLOAD)
+    for position in last_in_batch.values():
+        chelsa_product = chelsa_products[position]
+        all_months_available = True
+        for month in Month:
+            month_product = get_climatology(product=chelsa_product.product, scenario=chelsa_product.scenario, month=month)
+            if get_ledger_key(month_product) not in zonal_planned and not is_current(
+                month_product, RasterProcessingStep.ZONAL_STATISTICS
+            ):
+                all_months_available = False
+                break
 
-    return processing_steps
+        if all_months_available and not is_current(chelsa_product, RasterProcessingStep.YEARLY_TABLE, month=ALL_MONTHS):
+            planned_steps[position].append(RasterProcessingStep.YEARLY_TABLE)
 
+    for chelsa_product, processing_steps in zip(chelsa_products, planned_steps):
+        if not is_current(chelsa_product, RasterProcessingStep.UPLOAD):
+            processing_steps.append(RasterProcessingStep.UPLOAD)
 
-def _check_monthly_zonal_stats_complete(zonal_path: Path) -> bool:
-    """Return True if all 12 months for a product's scenario are available
+    return planned_steps
 
-    Args:
-        zonal_path (Path): Directory of scenario's zonal statistics
 
-    Returns:
-        bool: True if 12 files are available
+def get_processing_steps(chelsa_product: ChelsaProduct) -> list[RasterProcessingStep]:
+    """Determine which processing steps are needed for a given month of the product's scenario.
+    Each pipeline run is for a specific product, month, and scenario pair.
     """
-    available_files = [path for path in os.listdir(zonal_path) if path.endswith(".csv")]
-    if len(available_files) == 12:
-        return True
-    else:
-        return False
+    return plan_processing_steps(chelsa_products=[chelsa_product])[0]
 
 
 def execute_processing_steps(
@@ -86,52 +134,102 @@ def execute_processing_steps(
     """
     if RasterProcessingStep.DOWNLOAD in processing_steps:
         logger.info("Starting raster download")
-        process_raw_raster(
-            product=chelsa_product,
-            scenario=chelsa_product.scenario,
-            month=chelsa_product.month,
-            raw_out_path=chelsa_product.raw_raster_path,
-        )
+        bounds, bounds_crs = None, None
+        if config.windowed_download:
+            bounds, bounds_crs = get_download_bounds(geom_path=config.geom_path)
+
+        with track_step(
+            chelsa_product=chelsa_product,
+            manifest=get_step_manifest(chelsa_product=chelsa_product, step=RasterProcessingStep.DOWNLOAD.name),
+        ) as run:
+            process_raw_raster(
+                product=chelsa_product,
+                scenario=chelsa_product.scenario,
+                month=chelsa_product.month,
+                raw_out_path=chelsa_product.raw_raster_path,
+                bounds=bounds,
+                bounds_crs=bounds_crs,
+            )
+            run.output_paths = get_step_outputs(chelsa_product=chelsa_product, step=RasterProcessingStep.DOWNLOAD)
 
         logger.info("Finished raster download")
 
     if RasterProcessingStep.MASK in processing_steps:
         logger.info("Starting raster cropping")
-        process_masked_raster(
-            raw_raster_location=chelsa_product.raw_raster_path,
-            masked_out_path=chelsa_product.cropped_raster_path,
-        )
+        with track_step(
+            chelsa_product=chelsa_product,
+            manifest=get_step_manifest(chelsa_product=chelsa_product, step=RasterProcessingStep.MASK.name),
+        ) as run:
+            process_masked_raster(
+                raw_raster_location=chelsa_product.raw_raster_path,
+                masked_out_path=chelsa_product.cropped_raster_path,
+            )
+            run.output_paths = get_step_outputs(chelsa_product=chelsa_product, step=RasterProcessingStep.MASK)
         logger.info("Finished raster cropping")
 
     if RasterProcessingStep.ZONAL_STATISTICS in processing_steps:
         logger.info("Starting zonal statistics")
-        process_zonal_statistics(
-            raster_location=chelsa_product.cropped_raster_path,
-            out_path=chelsa_product.zonal_file_path,
-            chelsa_product=chelsa_product,
-            place_id=config.adm_unique_id,
+        # Coverage weighting needs the values of partially covered edge pixels, which masking removes
+        zonal_raster_path = (
+            chelsa_product.raw_raster_path
+            if config.zonal_engine == "coverage"
+            else chelsa_product.cropped_raster_path
         )
+        with track_step(
+            chelsa_product=chelsa_product,
+            manifest=get_step_manifest(chelsa_product=chelsa_product, step=RasterProcessingStep.ZONAL_STATISTICS.name),
+        ) as run:
+            process_zonal_statistics(
+                raster_location=zonal_raster_path,
+                out_path=chelsa_product.zonal_file_path,
+                chelsa_product=chelsa_product,
+                place_id=config.adm_unique_id,
+                rollup_path=chelsa_product.rollup_file_path if has_rollups() else None,
+            )
+            run.output_paths = get_step_outputs(chelsa_product=chelsa_product, step=RasterProcessingStep.ZONAL_STATISTICS)
+            run.row_count = count_rows(chelsa_product.zonal_file_path)
         logger.info("Finished zonal statistics")
 
     if RasterProcessingStep.YEARLY_TABLE in processing_steps:
         logger.info("Starting yearly table")
-        process_yearly_table(
-            product=chelsa_product,
-            zonal_dir=chelsa_product.zonal_stats_dir,
-            out_path=chelsa_product.yearly_aggregate_path,
-            sort_values=[config.adm_unique_id, "month"],
-        )
+        with track_step(
+            chelsa_product=chelsa_product,
+            manifest=get_step_manifest(chelsa_product=chelsa_product, step=RasterProcessingStep.YEARLY_TABLE.name),
+            month=ALL_MONTHS,
+        ) as run:
+            process_yearly_table(
+                product=chelsa_product,
+                zonal_dir=chelsa_product.zonal_stats_dir,
+                out_path=chelsa_product.yearly_aggregate_path,
+                sort_values=[config.adm_unique_id, "month"],
+            )
+            run.output_paths = get_step_outputs(chelsa_product=chelsa_product, step=RasterProcessingStep.YEARLY_TABLE)
+            run.row_count = count_rows(chelsa_product.yearly_aggregate_path)
         logger.info("Finished yearly ")
+        update_ensemble_statistics(chelsa_product=chelsa_product)
 
     if RasterProcessingStep.UPLOAD in processing_steps:
         logger.info("Starting DB upload")
-        upload_to_db(
-            df_path=chelsa_product.zonal_file_path,
-            table_name=chelsa_product.product.value,
-        )
+        with track_step(
+            chelsa_product=chelsa_product,
+            manifest=get_step_manifest(chelsa_product=chelsa_product, step=RasterProcessingStep.UPLOAD.name),
+        ) as run:
+            run.row_count = upload_to_db(
+                df_path=chelsa_product.zonal_file_path,
+                table_name=chelsa_product.product.value,
+            ).rows
         logger.info("Finished DB upload")
 
     if len(processing_steps) == 0:
         logger.info(
             f"All available steps already completed for {chelsa_product}_{chelsa_product.scenario.name}_{chelsa_product.month.name}"
         )
+
+
+def update_ensemble_statistics(chelsa_product: ChelsaProduct) -> None:
+    """Compute and upload the ensemble statistics of the product's RCP pathways whose yearly
+    tables changed, once the yearly table of one of its scenarios is written"""
+    logger.info("Starting ensemble statistics")
+    for ensemble_path in process_ensemble_statistics(chelsa_product=chelsa_product):
+        upload_to_db(df_path=ensemble_path, table_name=get_ensemble_table_name(chelsa_product=chelsa_product))
+    logger.info("Finished ensemble statistics")
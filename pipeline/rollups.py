@@ -0,0 +1,92 @@
+import logging
+from typing import Tuple
+
+import pandas as pd
+from climatology import ChelsaProduct
+from streaming import ZonalAccumulator
+from transforms import apply_transforms
+
+logger = logging.getLogger(__name__)
+
+# Engines that assign every pixel to a single admin 2 area, so their partial aggregates can be combined exactly
+ROLLUP_ENGINES = ["vectorized", "streaming"]
+
+# Admin levels above admin 2 along the hierarchy of vector_processing.COLUMN_MAPPING:
+# the column identifying the parent area of an admin 2 area, and the columns describing the parent
+ROLLUP_LEVELS = {
+    "adm1": ("adm1_id", ["iso2_code", "adm0_name", "adm1_name", "adm1_id"]),
+    "adm0": ("iso2_code", ["iso2_code", "adm0_name"]),
+}
+
+# Columns that only describe admin 2 areas, left out of the rolled up rows
+ADMIN2_COLUMNS = ["adm2_name", "adm2_id", "place_id", "id"]
+
+
+def calculate_rollups(
+    accumulator: ZonalAccumulator,
+    geometry: pd.DataFrame,
+    chelsa_product: ChelsaProduct,
+    stats_list: list[str],
+    levels: list[str],
+) -> pd.DataFrame:
+    """Statistics of admin 1 and admin 0 areas, combining the partial aggregates of their
+    admin 2 areas. Means are weighted by pixel counts and medians come from the merged
+    histograms, so every level matches a zonal statistic of the parent geometry itself.
+
+    Args:
+        accumulator (ZonalAccumulator): Partial aggregates of every admin 2 area, in the geometry's row order
+        geometry (pd.DataFrame): Attributes of the admin 2 areas
+        chelsa_product (ChelsaProduct): Product, scenario and month of the statistics
+        stats_list (list[str]): Statistics to calculate
+        levels (list[str]): Levels to roll up to. Options are adm1 and adm0.
+
+    Returns:
+        pd.DataFrame: One row per area of every level, with its level, pixel_count and statistics
+    """
+    rollups = []
+    for level in levels:
+        parent_column, attribute_columns = ROLLUP_LEVELS[level]
+        if parent_column not in geometry:
+            logger.warning(f"Geometry has no {parent_column} column, skipping {level} rollups")
+            continue
+
+        parents, parent_ids = pd.factorize(geometry[parent_column])
+        rolled = accumulator.rollup(parents=parents, n_parents=len(parent_ids))
+        statistics = rolled.statistics(stats_list)
+
+        attributes = geometry.drop_duplicates(subset=[parent_column]).set_index(parent_column, drop=False)
+        rollup = attributes.loc[parent_ids, [column for column in attribute_columns if column in geometry]]
+        rollup = rollup.reset_index(drop=True).assign(level=level, pixel_count=rolled.count)
+        for stat in stats_list:
+            rollup[f"{stat}_raw"] = statistics[stat]
+        rollups.append(rollup)
+
+    if not rollups:
+        return pd.DataFrame(columns=["level", "pixel_count"])
+
+    rollups = apply_transforms(chelsa_product=chelsa_product, df=pd.concat(rollups, ignore_index=True))
+    rollups["product"] = chelsa_product.product.value
+    rollups["month"] = str(chelsa_product.month.value)
+    rollups["scenario"] = chelsa_product.scenario.value
+
+    return rollups
+
+
+def split_rollups(zonal_stats: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Splits zonal statistics of several levels into the admin 2 rows and the rolled up rows
+
+    Args:
+        zonal_stats (pd.DataFrame): Zonal statistics with a level column
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: Admin 2 statistics, and admin 1 and admin 0 statistics
+    """
+    is_admin2 = zonal_stats["level"] == "adm2"
+    admin2 = zonal_stats[is_admin2].drop(columns=["level", "pixel_count"], errors="ignore")
+    rollups = zonal_stats[~is_admin2].drop(
+        columns=[column for column in ADMIN2_COLUMNS if column in zonal_stats]
+    )
+    if "pixel_count" in rollups:
+        rollups = rollups.astype({"pixel_count": "int64"})
+
+    return admin2.reset_index(drop=True), rollups.reset_index(drop=True)
@@ -0,0 +1,320 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import (FIRST_COMPLETED, Executor, Future,
+                                ProcessPoolExecutor, ThreadPoolExecutor, wait)
+from dataclasses import dataclass, field
+from typing import Callable, Literal, Optional
+
+from climatology import (ChelsaProduct, Month, Product, Scenario,
+                         get_product_matrix)
+from config import read_config
+from ledger import ALL_MONTHS, get_ledger_key
+from log import setup_logger
+from metrics import StageMetrics, export_metrics, registry
+from processing_steps import (RasterProcessingStep, execute_processing_steps,
+                              plan_processing_steps)
+
+logger = logging.getLogger(__name__)
+
+config = read_config("config.json")
+
+# Executor stage of every processing step. Downloads wait on the network, uploads on the database
+STAGE_OF_STEP = {
+    RasterProcessingStep.DOWNLOAD: "network",
+    RasterProcessingStep.MASK: "cpu",
+    RasterProcessingStep.ZONAL_STATISTICS: "cpu",
+    RasterProcessingStep.YEARLY_TABLE: "cpu",
+    RasterProcessingStep.UPLOAD: "database",
+}
+
+JobId = tuple[str, str, str, str]
+
+
+@dataclass
+class Job:
+    """One processing step of a product, scenario and month, and the jobs it waits for"""
+
+    chelsa_product: ChelsaProduct
+    step: RasterProcessingStep
+    dependencies: set[JobId] = field(default_factory=set)
+
+    @property
+    def id(self) -> JobId:
+        month = ALL_MONTHS if self.step == RasterProcessingStep.YEARLY_TABLE else None
+        return (*get_ledger_key(chelsa_product=self.chelsa_product, month=month), self.step.name)
+
+    @property
+    def stage(self) -> str:
+        return STAGE_OF_STEP[self.step]
+
+
+@dataclass
+class JobResult:
+    """Outcome of a job. Jobs whose dependencies failed are skipped, and jobs
+    that had not started when a fail_fast run stopped are cancelled."""
+
+    job: Job
+    status: Literal["succeeded", "failed", "skipped", "cancelled"]
+    duration_seconds: float = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class ScheduleReport:
+    """Results of a scheduler run"""
+
+    results: list[JobResult]
+    duration_seconds: float
+
+    @property
+    def succeeded(self) -> bool:
+        return all(result.status == "succeeded" for result in self.results)
+
+    def summary(self) -> str:
+        """Table of job counts and busy time per step and status, followed by failed jobs"""
+        lines = [f"{'step':<18}{'succeeded':>10}{'failed':>8}{'skipped':>9}{'cancelled':>11}{'busy (s)':>10}"]
+        for step in RasterProcessingStep:
+            step_results = [result for result in self.results if result.job.step == step]
+            if len(step_results) == 0:
+                continue
+            counts = {
+                status: sum(result.status == status for result in step_results)
+                for status in ["succeeded", "failed", "skipped", "cancelled"]
+            }
+            busy = sum(result.duration_seconds for result in step_results)
+            lines.append(
+                f"{step.name:<18}{counts['succeeded']:>10}{counts['failed']:>8}{counts['skipped']:>9}{counts['cancelled']:>11}{busy:>10.1f}"
+            )
+        lines.append(f"{len(self.results)} jobs in {self.duration_seconds:.1f}s")
+        for result in self.results:
+            if result.status == "failed":
+                lines.append(f"FAILED {'_'.join(result.job.id)}: {result.error}")
+        return "\n".join(lines)
+
+
+def build_job_graph(
+    chelsa_products: list[ChelsaProduct], planned_steps: list[list[RasterProcessingStep]]
+) -> dict[JobId, Job]:
+    """Dependency graph of the planned steps: DOWNLOAD -> MASK -> ZONAL_STATISTICS of every month,
+    the yearly table after the zonal statistics of all months of its product's scenario,
+    and the upload of a month after its zonal statistics. Steps that are not planned have
+    already succeeded and are not waited for.
+
+    Args:
+        chelsa_products (list[ChelsaProduct]): Products, each for a scenario and month
+        planned_steps (list[list[RasterProcessingStep]]): Steps of every product, as returned by plan_processing_steps
+
+    Returns:
+        dict[JobId, Job]: Jobs by id, in planning order
+    """
+    jobs: dict[JobId, Job] = {}
+    zonal_jobs: dict[tuple[str, str], set[JobId]] = {}
+
+    for chelsa_product, processing_steps in zip(chelsa_products, planned_steps):
+        previous: Optional[Job] = None
+        for step in processing_steps:
+            if step in [RasterProcessingStep.YEARLY_TABLE, RasterProcessingStep.UPLOAD]:
+                continue
+            job = Job(chelsa_product=chelsa_product, step=step)
+            if previous is not None:
+                job.dependencies.add(previous.id)
+            jobs[job.id] = job
+            previous = job
+
+        if previous is not None and previous.step == RasterProcessingStep.ZONAL_STATISTICS:
+            zonal_jobs.setdefault(previous.id[:2], set()).add(previous.id)
+
+        if RasterProcessingStep.UPLOAD in processing_steps:
+            job = Job(chelsa_product=chelsa_product, step=RasterProcessingStep.UPLOAD)
+            if previous is not None and previous.step == RasterProcessingStep.ZONAL_STATISTICS:
+                job.dependencies.add(previous.id)
+            jobs[job.id] = job
+
+    for chelsa_product, processing_steps in zip(chelsa_products, planned_steps):
+        if RasterProcessingStep.YEARLY_TABLE in processing_steps:
+            job = Job(chelsa_product=chelsa_product, step=RasterProcessingStep.YEARLY_TABLE)
+            job.dependencies = set(zonal_jobs.get(job.id[:2], set()))
+            jobs[job.id] = job
+
+    return jobs
+
+
+def run_job_graph(
+    jobs: dict[JobId, Job],
+    stage_workers: dict[str, int],
+    failure_policy: Literal["continue", "fail_fast"] = config.failure_policy,
+    runner: Optional[Callable[[ChelsaProduct, RasterProcessingStep], None]] = None,
+) -> ScheduleReport:
+    """Runs jobs as soon as their dependencies succeed, with one executor per stage so
+    downloads, CPU-bound steps and uploads overlap. CPU-bound steps run on processes,
+    network and database steps on threads.
+
+    Args:
+        jobs (dict[JobId, Job]): Job graph, as returned by build_job_graph
+        stage_workers (dict[str, int]): Maximum concurrent jobs of the network, cpu and database stages
+        failure_policy (Literal["continue", "fail_fast"], optional): On failure, "continue" only skips the
+            jobs that depend on the failed job, while "fail_fast" cancels every job that has not started.
+            Defaults to config.failure_policy.
+        runner (Optional[Callable[[ChelsaProduct, RasterProcessingStep], None]], optional): Function that
+            runs a step. Defaults to execute_processing_steps.
+
+    Returns:
+        ScheduleReport: One result per job
+    """
+    runner = runner or _run_step
+    start = time.perf_counter()
+    executors: dict[str, Executor] = {
+        "network": ThreadPoolExecutor(max_workers=stage_workers["network"]),
+        # Workers are spawned, not forked: a fork taken while the network and database threads
+        # hold locks (GDAL/curl handles, logging) could copy a held lock into the child
+        "cpu": ProcessPoolExecutor(
+            max_workers=stage_workers["cpu"],
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_setup_worker_logging,
+            initargs=(len(logging.getLogger().handlers) > 0,),
+        ),
+        "database": ThreadPoolExecutor(max_workers=stage_workers["database"]),
+    }
+
+    dependents: dict[JobId, list[JobId]] = {job_id: [] for job_id in jobs}
+    waiting_on = {job_id: len(job.dependencies) for job_id, job in jobs.items()}
+    for job_id, job in jobs.items():
+        for dependency in job.dependencies:
+            dependents[dependency].append(job_id)
+
+    results: dict[JobId, JobResult] = {}
+    running: dict[Future, JobId] = {}
+    stopped = False
+
+    def submit(job_id: JobId) -> None:
+        job = jobs[job_id]
+        running[executors[job.stage].submit(_timed_run, runner, job.chelsa_product, job.step)] = job_id
+
+    def skip_dependents(job_id: JobId) -> None:
+        for dependent in dependents[job_id]:
+            if dependent not in results:
+                results[dependent] = JobResult(job=jobs[dependent], status="skipped")
+                skip_dependents(dependent)
+
+    try:
+        for job_id, count in waiting_on.items():
+            if count == 0:
+                submit(job_id)
+
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id = running.pop(future)
+                if future.cancelled():
+                    results[job_id] = JobResult(job=jobs[job_id], status="cancelled")
+                    continue
+
+                error = future.exception()
+                if error is None:
+                    duration_seconds, stage_metrics = future.result()
+                    registry.merge(stage_metrics)
+                    results[job_id] = JobResult(
+                        job=jobs[job_id], status="succeeded", duration_seconds=duration_seconds
+                    )
+                    for dependent in dependents[job_id]:
+                        waiting_on[dependent] -= 1
+                        if waiting_on[dependent] == 0 and not stopped:
+                            submit(dependent)
+                    continue
+
+                logger.error(f"{'_'.join(job_id)} failed: {error!r}")
+                results[job_id] = JobResult(job=jobs[job_id], status="failed", error=repr(error))
+                skip_dependents(job_id)
+                if failure_policy == "fail_fast" and not stopped:
+                    stopped = True
+                    for pending in running:
+                        pending.cancel()
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    for job_id, job in jobs.items():
+        if job_id not in results:
+            results[job_id] = JobResult(job=job, status="cancelled")
+
+    return ScheduleReport(
+        results=[results[job_id] for job_id in jobs], duration_seconds=time.perf_counter() - start
+    )
+
+
+def run_matrix(
+    products: Optional[list[Product]] = None,
+    scenarios: Optional[list[Scenario]] = None,
+    months: Optional[list[Month]] = None,
+    download_workers: int = config.download_workers,
+    cpu_workers: Optional[int] = config.cpu_workers,
+    upload_workers: int = config.upload_workers,
+    failure_policy: Literal["continue", "fail_fast"] = config.failure_policy,
+) -> ScheduleReport:
+    """Plans and runs every processing step of a product x scenario x month matrix.
+
+    Args:
+        products (Optional[list[Product]], optional): Products to process. Defaults to all products.
+        scenarios (Optional[list[Scenario]], optional): Scenarios to process. Defaults to all scenarios.
+        months (Optional[list[Month]], optional): Months to process. Defaults to all months.
+        download_workers (int, optional): Concurrent downloads. Defaults to config.download_workers.
+        cpu_workers (Optional[int], optional): Concurrent masking, zonal statistics and yearly table
+            processes. Defaults to config.cpu_workers (all CPUs when not set).
+        upload_workers (int, optional): Concurrent uploads. Defaults to config.upload_workers.
+        failure_policy (Literal["continue", "fail_fast"], optional): See run_job_graph. Defaults to config.failure_policy.
+
+    Returns:
+        ScheduleReport: One result per job
+    """
+    chelsa_products = get_product_matrix(products=products, scenarios=scenarios, months=months)
+    jobs = build_job_graph(
+        chelsa_products=chelsa_products,
+        planned_steps=plan_processing_steps(chelsa_products=chelsa_products),
+    )
+    logger.info(f"Scheduling {len(jobs)} jobs for {len(chelsa_products)} products, scenarios and months")
+
+    report = run_job_graph(
+        jobs=jobs,
+        stage_workers={
+            "network": download_workers,
+            "cpu": cpu_workers or os.cpu_count() or 1,
+            "database": upload_workers,
+        },
+        failure_policy=failure_policy,
+    )
+    logger.info(f"Scheduler summary:\n{report.summary()}")
+    export_metrics(run_name="scheduler")
+
+    return report
+
+
+def _timed_run(
+    runner: Callable[[ChelsaProduct, RasterProcessingStep], None],
+    chelsa_product: ChelsaProduct,
+    step: RasterProcessingStep,
+) -> tuple[float, list[StageMetrics]]:
+    """Run a step in a worker and return its duration, excluding the time spent queued,
+    and the measurements taken in a worker process, which are merged into the parent's registry"""
+    start = time.perf_counter()
+    runner(chelsa_product, step)
+    duration_seconds = time.perf_counter() - start
+    return duration_seconds, registry.drain() if multiprocessing.parent_process() is not None else []
+
+
+def _setup_worker_logging(parent_logging: bool) -> None:
+    """Spawned workers do not inherit the handlers of the parent's logger"""
+    if parent_logging:
+        setup_logger()
+
+
+def _run_step(chelsa_product: ChelsaProduct, step: RasterProcessingStep) -> None:
+    """Run a single processing step"""
+    execute_processing_steps(processing_steps=[step], chelsa_product=chelsa_product)
+
+
+if __name__ == "__main__":
+    setup_logger()
+    run_matrix()
+    logging.shutdown()
@@ -1,23 +1,96 @@
 import os
+import threading
 from contextlib import contextmanager
+from typing import Optional
 
+from config import read_config
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 
 load_dotenv("docker/.env")
 
+config = read_config("config.json")
+
+_engines: dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_database_url() -> str:
+    """Database URL. DATABASE_URL takes precedence (eg. sqlite:///pipeline.db as a local stand-in),
+    otherwise the Postgres URL is built from the docker environment."""
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
 
-@contextmanager
-def get_session():
-    """Yield database session"""
     username = os.getenv("DBUSER")
     password = os.getenv("DBPASSWORD")
     host = os.getenv("LOCALHOST")
     db = os.getenv("DB")
     port = os.getenv("PORT")
 
-    engine = create_engine(f"postgresql://{username}:{password}@{host}:{port}/{db}")
-    session_maker = sessionmaker(bind=engine)
+    return f"postgresql://{username}:{password}@{host}:{port}/{db}"
+
+
+def get_engine(url: Optional[str] = None) -> Engine:
+    """Engine of a database URL, created once per process and reused by every session, so
+    connections are pooled instead of opened for every upload or query. Postgres engines use
+    config.db_pool_size, db_max_overflow, db_pool_pre_ping and db_statement_timeout_seconds.
+
+    Args:
+        url (Optional[str], optional): Database URL. Defaults to None (get_database_url).
+
+    Returns:
+        Engine: Pooled engine
+    """
+    url = url or get_database_url()
+    with _engines_lock:
+        if url not in _engines:
+            _engines[url] = _create_engine(url)
+        return _engines[url]
+
+
+def _create_engine(url: str) -> Engine:
+    if make_url(url).get_backend_name() != "postgresql":
+        # SQLite stand-ins keep SQLAlchemy's default pools
+        return create_engine(url, pool_pre_ping=config.db_pool_pre_ping)
 
-    yield session_maker
+    connect_args = {}
+    if config.db_statement_timeout_seconds is not None:
+        connect_args["options"] = f"-c statement_timeout={config.db_statement_timeout_seconds * 1000}"
+
+    return create_engine(
+        url,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_pre_ping=config.db_pool_pre_ping,
+        connect_args=connect_args,
+    )
+
+
+def dispose_engines() -> None:
+    """Close the pooled connections of every engine and forget the engines"""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def _forget_engines_after_fork() -> None:
+    """A forked process must not use the connections of its parent's pools. They are left
+    open for the parent, and the child creates its own engines."""
+    global _engines_lock
+    _engines_lock = threading.Lock()
+    for engine in _engines.values():
+        engine.dispose(close=False)
+    _engines.clear()
+
+
+os.register_at_fork(after_in_child=_forget_engines_after_fork)
+
+
+@contextmanager
+def get_session():
+    """Yield a session factory bound to the process's pooled engine"""
+    yield sessionmaker(bind=get_engine())
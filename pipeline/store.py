@@ -0,0 +1,191 @@
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Intermediate tables are Parquet datasets partitioned the Hive way, one file per partition:
+#   zonal_statistics/product=tmin/scenario=ACCESS1-0_rcp45/month=4/part-0.parquet
+#   yearly/product=tmin/scenario=ACCESS1-0_rcp45/part-0.parquet
+# Partition columns are stored in the directory names only, and restored when reading.
+PARTITION_COLUMNS = ["product", "scenario", "month"]
+
+# Columns of the zonal statistics that are not stored: the id concatenates the product,
+# scenario, month and place, which are columns already
+DERIVED_COLUMNS = ["id"]
+
+PART_FILE_NAME = "part-0.parquet"
+
+
+def get_partition_path(
+    dataset_dir: Union[str, Path], product: str, scenario: str, month: Optional[int] = None
+) -> Path:
+    """Parquet file of a product's scenario, or of a scenario's month, in a dataset
+
+    Args:
+        dataset_dir (Union[str, Path]): Root directory of the dataset
+        product (str): Product value, eg. "tmin"
+        scenario (str): Scenario value, eg. "ACCESS1-0_rcp45"
+        month (Optional[int], optional): Month number. Defaults to None (a file of all months).
+
+    Returns:
+        Path: eg. zonal_statistics/product=tmin/scenario=ACCESS1-0_rcp45/month=4/part-0.parquet
+    """
+    partition_dir = Path(dataset_dir) / f"product={product}" / f"scenario={scenario}"
+    if month is not None:
+        partition_dir = partition_dir / f"month={int(month)}"
+    return partition_dir / PART_FILE_NAME
+
+
+def write_table(df: pd.DataFrame, path: Union[str, Path]) -> None:
+    """Write a table to a partition file of a dataset, replacing the file atomically.
+    Columns encoded in the partition directories are dropped, strings such as admin names
+    are dictionary-encoded and floating point statistics are stored as float32.
+
+    Args:
+        df (pd.DataFrame): Table of the partition
+        path (Union[str, Path]): Partition file, see get_partition_path
+    """
+    path = Path(path)
+    df = df.drop(columns=[*get_partition_values(path), *DERIVED_COLUMNS], errors="ignore")
+    if "month" in df:
+        df = df.astype({"month": "int16"})
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.cast(_compact_schema(table.schema))
+
+    os.makedirs(path.parent, exist_ok=True)
+    temporary_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    pq.write_table(table, temporary_path)
+    os.replace(temporary_path, path)
+
+
+def read_table(
+    path: Union[str, Path],
+    columns: Optional[list[str]] = None,
+    decode_dictionaries: bool = False,
+    **filters,
+) -> pd.DataFrame:
+    """Read a partition file, or the partitions of a dataset matching the filters. Partition
+    columns are restored from the directory names, and partitions that do not match the
+    filters are not opened.
+
+    Args:
+        path (Union[str, Path]): Partition file, or root directory of a dataset
+        columns (Optional[list[str]], optional): Columns to read. Defaults to None (all columns).
+        decode_dictionaries (bool, optional): Read dictionary-encoded strings as strings instead of categoricals. Defaults to False.
+        **filters: Values of partition columns, eg. product="tmin", month=[1, 2]
+
+    Returns:
+        pd.DataFrame: Rows of the matching partitions, empty if there are none
+    """
+    table = read_arrow_table(path=path, columns=columns, **filters)
+    if decode_dictionaries:
+        table = table.cast(
+            pa.schema(
+                pa.field(field.name, field.type.value_type) if pa.types.is_dictionary(field.type) else field
+                for field in table.schema
+            )
+        )
+    return table.to_pandas()
+
+
+def read_arrow_table(path: Union[str, Path], columns: Optional[list[str]] = None, **filters) -> pa.Table:
+    """Arrow table of a partition file, or of the partitions of a dataset matching the filters.
+    See read_table. Months are int16, as they are stored."""
+    path = Path(path)
+    if not path.is_file():
+        return _read_dataset(dataset_dir=path, columns=columns, filters=filters)
+
+    partition_values = get_partition_values(path)
+    if any(value not in _as_list(column, filters[column]) for column, value in partition_values.items() if column in filters):
+        return pq.read_schema(path).empty_table()
+
+    file_filters = {column: value for column, value in filters.items() if column not in partition_values}
+    table = ds.dataset(str(path), format="parquet").to_table(
+        columns=[column for column in columns if column not in partition_values] if columns else None,
+        filter=_filter_expression(file_filters),
+    )
+    for column, value in partition_values.items():
+        if columns is None or column in columns:
+            table = table.append_column(column, pa.array([value] * table.num_rows, type=_partition_type(column)))
+    return table
+
+
+def list_partitions(dataset_dir: Union[str, Path], product: str, scenario: str) -> dict[int, Path]:
+    """Month partition files of a product's scenario in a dataset, by month"""
+    partitions = Path(dataset_dir).glob(f"product={product}/scenario={scenario}/month=*/{PART_FILE_NAME}")
+    return dict(sorted((get_partition_values(path)["month"], path) for path in partitions))
+
+
+def count_rows(path: Union[str, Path]) -> int:
+    """Number of rows of a partition file, read from its metadata"""
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def get_partition_values(path: Union[str, Path]) -> dict[str, Union[str, int]]:
+    """Partition columns encoded in the directories of a partition file, eg. {"product": "tmin", "month": 4}"""
+    values = {}
+    for directory in Path(path).parent.parts:
+        column, separator, value = directory.partition("=")
+        if separator and column in PARTITION_COLUMNS:
+            values[column] = int(value) if column == "month" else value
+    return values
+
+
+def _read_dataset(dataset_dir: Path, columns: Optional[list[str]], filters: dict) -> pa.Table:
+    """Read the partitions of a dataset directory that match the filters"""
+    # Product and scenario values prune directories before any file is listed,
+    # months and lists of values are pushed down as a filter
+    directories = "/".join(
+        f"{column}={filters[column]}" if isinstance(filters.get(column), str) else f"{column}=*"
+        for column in ["product", "scenario"]
+    )
+    files = sorted(dataset_dir.glob(f"{directories}/**/*.parquet"))
+    if not files:
+        return pa.table({column: [] for column in columns or []})
+
+    dataset = ds.dataset(
+        [str(file) for file in files],
+        format="parquet",
+        partitioning=ds.HivePartitioning.discover(),
+        partition_base_dir=str(dataset_dir),
+    )
+    table = dataset.to_table(columns=columns, filter=_filter_expression(filters))
+    if "month" in table.column_names:
+        month = table.schema.get_field_index("month")
+        table = table.set_column(month, "month", table.column(month).cast(pa.int16()))
+    return table
+
+
+def _filter_expression(filters: dict) -> Optional[ds.Expression]:
+    """Dataset filter keeping the rows whose columns have one of the values of the filters"""
+    expression = None
+    for column, value in filters.items():
+        condition = ds.field(column).isin(_as_list(column, value))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _as_list(column: str, value) -> list:
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    return [int(v) for v in values] if column == "month" else list(values)
+
+
+def _partition_type(column: str) -> pa.DataType:
+    return pa.int16() if column == "month" else pa.string()
+
+
+def _compact_schema(schema: pa.Schema) -> pa.Schema:
+    """Dictionary-encoded strings and float32 statistics"""
+    fields = []
+    for field in schema:
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif pa.types.is_floating(field.type):
+            field = field.with_type(pa.float32())
+        fields.append(field)
+    return pa.schema(fields)
@@ -0,0 +1,522 @@
+import logging
+import math
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from affine import Affine
+from config import read_config
+from rasterio.features import geometry_window
+from rasterio.profiles import Profile
+from rasterio.windows import Window
+from zonal_engine import (AVAILABLE_STATISTICS, get_zone_dtype, rasterize_zones,
+                          zonal_statistics)
+from zone_cache import get_zone_grid
+
+logger = logging.getLogger(__name__)
+
+config = read_config("config.json")
+
+# Bytes per pixel of the working arrays of ZonalAccumulator.update, on top of the raster and
+# zone blocks: float64 values, int64 zone ids, sort order and histogram bins, and masks
+ACCUMULATOR_WORKING_BYTES = 56
+
+
+@dataclass
+class ZonalAccumulator:
+    """Mergeable partial aggregates of every zone: pixel count, sum, min, max and a value histogram.
+    Blocks of a raster can be added one at a time, and accumulators of the same zones and
+    bins can be merged, so statistics never need all pixels in memory at once.
+    The median is read from the histogram. With integer data and bins one unit wide
+    (value range smaller than the number of bins) it is exact.
+    """
+
+    n_zones: int
+    bin_edges: np.ndarray
+    count: np.ndarray = field(init=False)
+    sum: np.ndarray = field(init=False)
+    min: np.ndarray = field(init=False)
+    max: np.ndarray = field(init=False)
+    histogram: np.ndarray = field(init=False)
+
+    def __post_init__(self):
+        self.count = np.zeros(self.n_zones, dtype=np.int64)
+        self.sum = np.zeros(self.n_zones, dtype=np.float64)
+        self.min = np.full(self.n_zones, np.nan)
+        self.max = np.full(self.n_zones, np.nan)
+        self.histogram = np.zeros((self.n_zones, len(self.bin_edges) - 1), dtype=np.int64)
+
+    @property
+    def n_bins(self) -> int:
+        return len(self.bin_edges) - 1
+
+    @staticmethod
+    def estimate_nbytes(n_zones: int, n_bins: int) -> int:
+        """Bytes held by an accumulator while a block is added: count, sum, min, max and
+        histogram of every zone, and the histogram of the block being added"""
+        return n_zones * (4 * 8 + 2 * 8 * n_bins)
+
+    def update(
+        self,
+        raster: np.ndarray,
+        zones: np.ndarray,
+        nodata: Optional[float] = None,
+        source_nodata: Optional[float] = None,
+    ) -> None:
+        """Adds the pixels of a block of the raster
+
+        Args:
+            raster (np.ndarray): Block of raster values
+            zones (np.ndarray): Zone-id grid of the same block
+            nodata (Optional[float], optional): Raster value that symbolizes no data. Defaults to None.
+            source_nodata (Optional[float], optional): Nodata value of the raster file, also left out. Defaults to None.
+        """
+        values = np.asarray(raster, dtype=np.float64).ravel()
+        if source_nodata is not None:
+            values = np.where(values == source_nodata, np.nan, values)
+
+        block = zonal_statistics(
+            raster=values.reshape(np.shape(zones)),
+            zones=zones,
+            n_zones=self.n_zones,
+            stats=["count", "sum", "min", "max"],
+            nodata=nodata,
+        )
+        self.count += block["count"]
+        self.sum += np.nan_to_num(block["sum"])
+        self.min = np.fmin(self.min, block["min"])
+        self.max = np.fmax(self.max, block["max"])
+
+        zone_ids = np.asarray(zones).ravel().astype(np.int64)
+        valid = (zone_ids > 0) & ~np.isnan(values)
+        if nodata is not None:
+            valid &= values != nodata
+
+        bins = np.clip(
+            np.searchsorted(self.bin_edges, values[valid], side="right") - 1, 0, self.n_bins - 1
+        )
+        self.histogram += np.bincount(
+            (zone_ids[valid] - 1) * self.n_bins + bins, minlength=self.n_zones * self.n_bins
+        ).reshape(self.n_zones, self.n_bins)
+
+    def merge(self, other: "ZonalAccumulator") -> None:
+        """Combines the aggregates of another accumulator of the same zones and bins
+
+        Args:
+            other (ZonalAccumulator): Accumulator to merge into this one
+        """
+        if self.n_zones != other.n_zones or not np.array_equal(self.bin_edges, other.bin_edges):
+            raise ValueError("Only accumulators with the same zones and bins can be merged.")
+
+        self.count += other.count
+        self.sum += other.sum
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        self.histogram += other.histogram
+
+    def rollup(self, parents: np.ndarray, n_parents: int) -> "ZonalAccumulator":
+        """Accumulator of parent zones, combining the aggregates of their child zones.
+        Children must not share pixels (as in a zone-id grid), so the statistics of every
+        parent are exactly those of all its pixels, not an average of its children.
+
+        Args:
+            parents (np.ndarray): Parent index (0 to n_parents - 1) of every zone, or -1 for zones without a parent
+            n_parents (int): Number of parent zones
+
+        Returns:
+            ZonalAccumulator: Partial aggregates of the parent zones, with the same bins
+        """
+        rolled = ZonalAccumulator(n_zones=n_parents, bin_edges=self.bin_edges)
+        children = np.flatnonzero(np.asarray(parents) >= 0)
+        parent_ids = np.asarray(parents)[children]
+
+        np.add.at(rolled.count, parent_ids, self.count[children])
+        np.add.at(rolled.sum, parent_ids, self.sum[children])
+        np.fmin.at(rolled.min, parent_ids, self.min[children])
+        np.fmax.at(rolled.max, parent_ids, self.max[children])
+        np.add.at(rolled.histogram, parent_ids, self.histogram[children])
+
+        return rolled
+
+    def statistics(self, stats: list[str]) -> dict[str, np.ndarray]:
+        """Final statistics of every zone
+
+        Args:
+            stats (list[str]): Statistics to calculate. Options are count, sum, min, max, mean and median.
+
+        Returns:
+            dict[str, np.ndarray]: Array of length n_zones per statistic, with NaN for zones without pixels
+        """
+        unavailable = [stat for stat in stats if stat not in AVAILABLE_STATISTICS]
+        if unavailable:
+            raise ValueError(
+                f"Statistics {unavailable} are not available. Options include {AVAILABLE_STATISTICS}"
+            )
+
+        has_pixels = self.count > 0
+        results = {}
+        if "count" in stats:
+            results["count"] = self.count.copy()
+        if "sum" in stats:
+            results["sum"] = np.where(has_pixels, self.sum, np.nan)
+        if "mean" in stats:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                results["mean"] = np.where(has_pixels, self.sum / self.count, np.nan)
+        if "min" in stats:
+            results["min"] = self.min.copy()
+        if "max" in stats:
+            results["max"] = self.max.copy()
+        if "median" in stats:
+            results["median"] = self._histogram_median()
+
+        return results
+
+    def _histogram_median(self) -> np.ndarray:
+        """Median from the histogram, as the average of the centres of the bins holding the middle ranks"""
+        cumulative = np.cumsum(self.histogram, axis=1)
+        centres = (self.bin_edges[:-1] + self.bin_edges[1:]) / 2
+        lower_rank = (self.count - 1) // 2
+        upper_rank = self.count // 2
+
+        lower_bin = (cumulative <= lower_rank[:, np.newaxis]).sum(axis=1)
+        upper_bin = (cumulative <= upper_rank[:, np.newaxis]).sum(axis=1)
+        lower_bin = np.minimum(lower_bin, self.n_bins - 1)
+        upper_bin = np.minimum(upper_bin, self.n_bins - 1)
+
+        median = (centres[lower_bin] + centres[upper_bin]) / 2
+        return np.where(self.count > 0, median, np.nan)
+
+
+def histogram_bin_edges(
+    value_range: Tuple[float, float], n_bins: int, integer: bool = True
+) -> np.ndarray:
+    """Bin edges covering a value range. Integer data gets bins centred on integers,
+    one unit wide when the range allows it, so the histogram median is exact.
+
+    Args:
+        value_range (Tuple[float, float]): Minimum and maximum values
+        n_bins (int): Maximum number of bins
+        integer (bool, optional): Whether the data are integers. Defaults to True.
+
+    Returns:
+        np.ndarray: Increasing bin edges
+    """
+    low, high = value_range
+    if integer:
+        width = max(1, math.ceil((high - low + 1) / n_bins))
+        n = math.ceil((high - low + 1) / width)
+        return low - 0.5 + width * np.arange(n + 1, dtype=np.float64)
+
+    if high == low:
+        high = low + 1
+    return np.linspace(low, high, n_bins + 1)
+
+
+def iter_row_windows(
+    height: int,
+    width: int,
+    bytes_per_pixel: int,
+    memory_budget_mb: float = config.memory_budget_mb,
+    block_height: int = 1,
+    window: Optional[Window] = None,
+) -> Iterator[Window]:
+    """Splits a raster (or a window of it) into strips of full-width rows that fit the memory budget.
+    Strip heights are multiples of the raster's block height so every internal block is read once.
+
+    Args:
+        height (int): Number of rows of the area to split
+        width (int): Number of columns of the area to split
+        bytes_per_pixel (int): Bytes held in memory per pixel while a strip is processed
+        memory_budget_mb (float, optional): Memory available for one strip. Defaults to config.memory_budget_mb.
+        block_height (int, optional): Internal block height of the raster. Defaults to 1.
+        window (Optional[Window], optional): Window of the raster being split. Defaults to None (whole raster).
+
+    Yields:
+        Iterator[Window]: Strip windows, top to bottom
+    """
+    col_off = int(window.col_off) if window is not None else 0
+    row_off = int(window.row_off) if window is not None else 0
+
+    strip_height = int(memory_budget_mb * 1024 * 1024) // max(1, width * bytes_per_pixel)
+    strip_height = max(block_height, strip_height - strip_height % block_height)
+
+    for row_start in range(0, height, strip_height):
+        yield Window(col_off, row_off + row_start, width, min(strip_height, height - row_start))
+
+
+def stream_crop_raster(
+    raster_location: Path,
+    gdf: gpd.GeoDataFrame,
+    out_path: Path,
+    geom_path: Optional[Path] = None,
+    memory_budget_mb: float = config.memory_budget_mb,
+) -> Profile:
+    """Masks raster with a geodataframe strip by strip, writing each masked strip as it is produced.
+    Produces the same raster as crop_raster_with_geometry without holding it in memory.
+
+    Args:
+        raster_location (Path): Location of raster file
+        gdf (gpd.GeoDataFrame): Geodataframe that will be used to mask raster
+        out_path (Path): The location where the masked raster will be saved
+        geom_path (Optional[Path], optional): Path of the geometry file. If provided, zones are read
+            from the memory-mapped zone grid cache. Defaults to None (rasterized per strip).
+        memory_budget_mb (float, optional): Memory available for one strip. Defaults to config.memory_budget_mb.
+
+    Returns:
+        Profile: Profile of the masked raster
+    """
+    with rasterio.open(raster_location, "r") as src:
+        if src.crs != gdf.crs:
+            gdf = gpd.GeoDataFrame(gdf.to_crs(src.crs))
+
+        window = geometry_window(src, gdf.geometry)
+        cropped_transform = src.window_transform(window)
+        shape = (int(window.height), int(window.width))
+        nodata = src.nodata if src.nodata is not None else 0
+
+        profile: Profile = src.profile.copy()
+        profile.update(
+            {
+                "width": shape[1],
+                "height": shape[0],
+                "transform": cropped_transform,
+                "tiled": True,
+                "blockxsize": 256,
+                "blockysize": 256,
+            }
+        )
+
+        zone_grid = _get_zone_grid(gdf, cropped_transform, shape, src.crs, geom_path, memory_budget_mb)
+        strips = iter_row_windows(
+            height=shape[0],
+            width=shape[1],
+            bytes_per_pixel=src.count * (np.dtype(src.dtypes[0]).itemsize + 1) + 4,
+            memory_budget_mb=memory_budget_mb,
+            block_height=256,
+        )
+
+        with rasterio.open(out_path, "w", **profile) as dest:
+            for strip in strips:
+                source_strip = Window(
+                    window.col_off + strip.col_off, window.row_off + strip.row_off, strip.width, strip.height
+                )
+                zones = _strip_zones(zone_grid, gdf, cropped_transform, strip)
+                raster = src.read(window=source_strip, masked=True)
+                raster.mask = raster.mask | (zones == 0)
+                dest.write(raster.filled(nodata), window=strip)
+
+    return profile
+
+
+def stream_zonal_statistics(
+    raster_location: Path,
+    geometry: gpd.GeoDataFrame,
+    stats_list: list[str],
+    nodata: float = -999,
+    geom_path: Optional[Path] = None,
+    memory_budget_mb: float = config.memory_budget_mb,
+    n_bins: int = config.histogram_bins,
+    value_range: Optional[Tuple[float, float]] = None,
+) -> dict[str, np.ndarray]:
+    """Calculates zonal statistics strip by strip, feeding a ZonalAccumulator, so peak memory
+    is bounded by the memory budget whatever the raster size.
+
+    Args:
+        raster_location (Path): Location of the raster
+        geometry (gpd.GeoDataFrame): Geometries used as zones
+        stats_list (list[str]): Statistics to calculate
+        nodata (float, optional): Raster value that symbolizes no data. Defaults to -999.
+        geom_path (Optional[Path], optional): Path of the geometry file. If provided, zones are read
+            from the memory-mapped zone grid cache. Defaults to None (rasterized per strip).
+        memory_budget_mb (float, optional): Memory available for one strip. Defaults to config.memory_budget_mb.
+        n_bins (int, optional): Maximum number of histogram bins used for the median. Defaults to config.histogram_bins.
+        value_range (Optional[Tuple[float, float]], optional): Range of the histogram. Defaults to None
+            (found with an extra pass over the raster when the median is requested).
+
+    Returns:
+        dict[str, np.ndarray]: One value per geometry for every statistic, in the geometry's row order
+    """
+    accumulator = accumulate_zonal_statistics(
+        raster_location=raster_location,
+        geometry=geometry,
+        nodata=nodata,
+        geom_path=geom_path,
+        memory_budget_mb=memory_budget_mb,
+        n_bins=n_bins if "median" in stats_list else 1,
+        value_range=value_range,
+    )
+    return accumulator.statistics(stats_list)
+
+
+def accumulate_zonal_statistics(
+    raster_location: Path,
+    geometry: gpd.GeoDataFrame,
+    nodata: float = -999,
+    geom_path: Optional[Path] = None,
+    memory_budget_mb: float = config.memory_budget_mb,
+    n_bins: int = config.histogram_bins,
+    value_range: Optional[Tuple[float, float]] = None,
+) -> ZonalAccumulator:
+    """Streams a raster strip by strip into a ZonalAccumulator. See stream_zonal_statistics.
+    The accumulator is counted against the memory budget: histogram bins are capped so it takes
+    at most half of the budget, and strips share what it leaves.
+
+    Returns:
+        ZonalAccumulator: Partial aggregates of every geometry
+    """
+    budget_bytes = memory_budget_mb * 1024 * 1024
+    n_bins = fit_histogram_bins(n_zones=len(geometry), n_bins=n_bins, budget_bytes=budget_bytes / 2)
+    strip_budget_bytes = budget_bytes - ZonalAccumulator.estimate_nbytes(n_zones=len(geometry), n_bins=n_bins)
+
+    with rasterio.open(raster_location, "r") as src:
+        if src.crs != geometry.crs:
+            geometry = gpd.GeoDataFrame(geometry.to_crs(src.crs))
+
+        integer = np.issubdtype(np.dtype(src.dtypes[0]), np.integer)
+        zone_grid = _get_zone_grid(
+            geometry, src.transform, src.shape, src.crs, geom_path, strip_budget_bytes / (1024 * 1024)
+        )
+        strips = list(
+            iter_row_windows(
+                height=src.height,
+                width=src.width,
+                bytes_per_pixel=np.dtype(src.dtypes[0]).itemsize
+                + get_zone_dtype(len(geometry)).itemsize
+                + ACCUMULATOR_WORKING_BYTES,
+                memory_budget_mb=strip_budget_bytes / (1024 * 1024),
+                block_height=src.block_shapes[0][0],
+            )
+        )
+
+        if value_range is None:
+            value_range = (0, 0) if n_bins == 1 else _value_range(src, strips, nodata)
+
+        accumulator = ZonalAccumulator(
+            n_zones=len(geometry),
+            bin_edges=histogram_bin_edges(value_range=value_range, n_bins=n_bins, integer=integer),
+        )
+        for strip in strips:
+            zones = _strip_zones(zone_grid, geometry, src.transform, strip)
+            accumulator.update(raster=src.read(1, window=strip), zones=zones, nodata=nodata, source_nodata=src.nodata)
+
+    return accumulator
+
+
+def accumulate_block(
+    raster: np.ndarray,
+    zones: np.ndarray,
+    n_zones: int,
+    n_bins: int = config.histogram_bins,
+    nodata: Optional[float] = None,
+    source_nodata: Optional[float] = None,
+) -> ZonalAccumulator:
+    """Partial aggregates of every zone of a raster held in memory. As in accumulate_zonal_statistics,
+    the histogram spans the raster's valid values with up to n_bins bins.
+
+    Args:
+        raster (np.ndarray): Single band raster values
+        zones (np.ndarray): Zone-id grid with the raster's shape
+        n_zones (int): Number of zones
+        n_bins (int, optional): Maximum number of histogram bins. Defaults to config.histogram_bins.
+        nodata (Optional[float], optional): Raster value that symbolizes no data. Defaults to None.
+        source_nodata (Optional[float], optional): Nodata value of the raster file, also left out. Defaults to None.
+
+    Returns:
+        ZonalAccumulator: Partial aggregates of every zone
+    """
+    value_range = (0, 0)
+    if n_bins > 1:
+        valid = ~np.isnan(raster)
+        for value in [nodata, source_nodata]:
+            if value is not None:
+                valid &= raster != value
+        if valid.any():
+            value_range = (raster[valid].min(), raster[valid].max())
+
+    accumulator = ZonalAccumulator(
+        n_zones=n_zones,
+        bin_edges=histogram_bin_edges(
+            value_range=value_range, n_bins=n_bins, integer=np.issubdtype(raster.dtype, np.integer)
+        ),
+    )
+    accumulator.update(raster=raster, zones=zones, nodata=nodata, source_nodata=source_nodata)
+    return accumulator
+
+
+def fit_histogram_bins(n_zones: int, n_bins: int, budget_bytes: float) -> int:
+    """Largest number of histogram bins, up to n_bins, whose accumulator fits in budget_bytes
+
+    Args:
+        n_zones (int): Number of zones
+        n_bins (int): Requested number of bins
+        budget_bytes (float): Memory available to the accumulator
+
+    Returns:
+        int: Number of bins, at least 1
+    """
+    fitting_bins = int((budget_bytes / max(1, n_zones) - 4 * 8) // (2 * 8))
+    if fitting_bins >= n_bins:
+        return n_bins
+
+    fitting_bins = max(1, fitting_bins)
+    logger.warning(
+        f"Histograms of {n_zones} zones with {n_bins} bins exceed the memory budget, using {fitting_bins} bins. "
+        "Medians are approximate unless the value range fits in the bins."
+    )
+    return fitting_bins
+
+
+def _value_range(src: rasterio.DatasetReader, strips: list[Window], nodata: float) -> Tuple[float, float]:
+    """Minimum and maximum valid values of the raster, found strip by strip. Pixels of nodata
+    and of the file's nodata value are left out, as in ZonalAccumulator.update."""
+    low, high = np.inf, -np.inf
+    for strip in strips:
+        values = src.read(1, window=strip).astype(np.float64)
+        valid = ~np.isnan(values) & (values != nodata)
+        if src.nodata is not None:
+            valid &= values != src.nodata
+        if valid.any():
+            low = min(low, values[valid].min())
+            high = max(high, values[valid].max())
+
+    return (0, 0) if low > high else (low, high)
+
+
+def _get_zone_grid(
+    geometry: gpd.GeoDataFrame,
+    transform: Affine,
+    shape: Tuple[int, int],
+    crs,
+    geom_path: Optional[Path],
+    memory_budget_mb: float,
+) -> Optional[np.ndarray]:
+    """Memory-mapped zone grid from the cache, built within the memory budget on a cache miss,
+    or None when zones are rasterized per strip"""
+    if geom_path is None:
+        return None
+    return get_zone_grid(
+        geom_path=geom_path,
+        transform=transform,
+        shape=shape,
+        crs=crs,
+        geometry=geometry,
+        memory_budget_mb=memory_budget_mb,
+    )
+
+
+def _strip_zones(
+    zone_grid: Optional[np.ndarray], geometry: gpd.GeoDataFrame, transform: Affine, strip: Window
+) -> np.ndarray:
+    """Zone ids of a strip, sliced from the zone grid or rasterized on the strip's grid"""
+    rows = slice(int(strip.row_off), int(strip.row_off + strip.height))
+    cols = slice(int(strip.col_off), int(strip.col_off + strip.width))
+    if zone_grid is not None:
+        return np.asarray(zone_grid[rows, cols])
+
+    strip_transform = transform * Affine.translation(strip.col_off, strip.row_off)
+    return rasterize_zones(
+        geometry=geometry, transform=strip_transform, shape=(int(strip.height), int(strip.width))
+    )
@@ -1,5 +1,6 @@
-from base_table import BaseTable
-from sqlalchemy import MetaData
+from base_table import BaseTable, EnsembleBaseTable
+from sqlalchemy import (Column, DateTime, Float, Integer, MetaData, String,
+                        Text, UniqueConstraint)
 from sqlalchemy.orm import declarative_base
 
 metadata = MetaData()
@@ -26,6 +27,80 @@ class BioTable(Base, BaseTable):
     __tablename__ = "bio"
 
 
+class TemperatureEnsembleTable(Base, EnsembleBaseTable):
+    __tablename__ = "temp_ensemble"
+
+
+class MinimumTemperatureEnsembleTable(Base, EnsembleBaseTable):
+    __tablename__ = "tmin_ensemble"
+
+
+class MaximumTemperatureEnsembleTable(Base, EnsembleBaseTable):
+    __tablename__ = "tmax_ensemble"
+
+
+class PrecipitationEnsembleTable(Base, EnsembleBaseTable):
+    __tablename__ = "prec_ensemble"
+
+
+class BioEnsembleTable(Base, EnsembleBaseTable):
+    __tablename__ = "bio_ensemble"
+
+
+class RunLedgerTable(Base):
+    """Latest run of every processing step of a product, scenario and month"""
+
+    __tablename__ = "run_ledger"
+
+    product = Column(String, primary_key=True)
+    scenario = Column(String, primary_key=True)
+    month = Column(String, primary_key=True)
+    step = Column(String, primary_key=True)
+    status = Column(String, nullable=False)
+    input_fingerprint = Column(String(64))
+    output_checksum = Column(String(64))
+    output_stats = Column(Text)
+    row_count = Column(Integer)
+    duration_seconds = Column(Float)
+    attempts = Column(Integer, nullable=False, default=1)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+    error = Column(Text)
+
+
+class JobQueueTable(Base):
+    """Processing steps shared by the workers of a distributed run"""
+
+    __tablename__ = "job_queue"
+    __table_args__ = (UniqueConstraint("product", "scenario", "month", "step"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    product = Column(String, nullable=False)
+    scenario = Column(String, nullable=False)
+    month = Column(String, nullable=False)
+    step = Column(String, nullable=False)
+    step_order = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, index=True)
+    worker_id = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    lease_expires_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    error = Column(Text)
+
+
+class UploadHashTable(Base):
+    """Content hash of the rows last uploaded to a product table for a scenario and month"""
+
+    __tablename__ = "upload_hash"
+
+    table_name = Column(String, primary_key=True)
+    scenario = Column(String, primary_key=True)
+    month = Column(String, primary_key=True)
+    content_hash = Column(String(64), nullable=False)
+    row_count = Column(Integer, nullable=False)
+    uploaded_at = Column(DateTime, nullable=False)
+
+
 def get_table(table_name: str):
     factories = {
         "temp": TemperatureTable,
@@ -33,6 +108,11 @@ def get_table(table_name: str):
         "prec": PrecipitationTable,
         "tmax": MaximumTemperatureTable,
         "tmin": MinimumTemperatureTable,
+        "temp_ensemble": TemperatureEnsembleTable,
+        "bio_ensemble": BioEnsembleTable,
+        "prec_ensemble": PrecipitationEnsembleTable,
+        "tmax_ensemble": MaximumTemperatureEnsembleTable,
+        "tmin_ensemble": MinimumTemperatureEnsembleTable,
     }
 
     return factories[table_name]
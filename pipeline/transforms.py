@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import pandas as pd
+from climatology import ChelsaProduct, Month, Product
+
+
+@dataclass(frozen=True)
+class Transform:
+    """Conversion of the raw values of a raster to physical units: value = raw * scale + offset"""
+
+    unit: str
+    scale: float = 1.0
+    offset: float = 0.0
+
+
+# CHELSA V1.2 climatologies store temperatures in C/10 and precipitation in mm/month
+# https://chelsa-climate.org/wp-admin/download-page/CHELSA_tech_specification.pdf (pg.36)
+CELSIUS = Transform(unit="celsius", scale=0.1)
+MILLIMETRES = Transform(unit="mm", scale=1.0)
+
+# Bioclimatic variables are downloaded as the months of the bio product: month 1 is bio1
+BIO_TRANSFORMS = {
+    1: CELSIUS,  # Annual mean temperature
+    2: CELSIUS,  # Mean diurnal range
+    3: Transform(unit="percent"),  # Isothermality
+    4: Transform(unit="celsius", scale=0.01),  # Temperature seasonality, standard deviation * 100
+    5: CELSIUS,  # Max temperature of the warmest month
+    6: CELSIUS,  # Min temperature of the coldest month
+    7: CELSIUS,  # Temperature annual range
+    8: CELSIUS,  # Mean temperature of the wettest quarter
+    9: CELSIUS,  # Mean temperature of the driest quarter
+    10: CELSIUS,  # Mean temperature of the warmest quarter
+    11: CELSIUS,  # Mean temperature of the coldest quarter
+    12: MILLIMETRES,  # Annual precipitation
+}
+
+# Statistics in the units of the raster values. Sums are scaled but not offset, and counts are not converted.
+VALUE_STATISTICS = ["min", "max", "mean", "median"]
+SCALED_STATISTICS = ["sum"]
+
+# Transform of every product, or of every month of a product
+TRANSFORMS: dict[Product, Union[Transform, dict[int, Transform]]] = {
+    Product.TEMP: CELSIUS,
+    Product.TMIN: CELSIUS,
+    Product.TMAX: CELSIUS,
+    Product.PREC: MILLIMETRES,
+    Product.BIO: BIO_TRANSFORMS,
+}
+
+
+def get_transform(product: Product, month: Month) -> Optional[Transform]:
+    """Transform of a product's month, or None if its values have no conversion"""
+    transform = TRANSFORMS.get(product)
+    if isinstance(transform, dict):
+        return transform.get(month.value)
+    return transform
+
+
+def apply_transforms(chelsa_product: ChelsaProduct, df: pd.DataFrame) -> pd.DataFrame:
+    """Adds the values of every raw statistic in physical units, eg. mean_value from mean_raw,
+    and their unit. Conversions are whole-column operations. Pixel counts have no unit and
+    are left as they are.
+
+    Args:
+        chelsa_product (ChelsaProduct): Product, scenario and month of the statistics
+        df (pd.DataFrame): Zonal statistics with {stat}_raw columns
+
+    Returns:
+        pd.DataFrame: Zonal statistics with {stat}_value and unit columns
+    """
+    transform = get_transform(product=chelsa_product.product, month=chelsa_product.month)
+    if transform is None:
+        return df
+
+    for stat in VALUE_STATISTICS + SCALED_STATISTICS:
+        if f"{stat}_raw" not in df:
+            continue
+        offset = transform.offset if stat in VALUE_STATISTICS else 0.0
+        df[f"{stat}_value"] = df[f"{stat}_raw"] * transform.scale + offset
+    df["unit"] = transform.unit
+
+    return df
@@ -1,13 +1,24 @@
+import hashlib
+import io
 import logging
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Tuple
 
 import pandas as pd
+from config import read_config
 from dotenv import load_dotenv
+from metrics import measure
+from partitions import (create_month_partitions, is_partitioned,
+                        truncate_month_partitions)
 from session import get_session
+from sqlalchemy import (Connection, Enum, Float, Integer, String, Table, and_,
+                        delete, insert, or_, select, tuple_)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.engine.reflection import Inspector
-from tables import get_table
+from store import DERIVED_COLUMNS, read_table
+from tables import UploadHashTable, get_table
 
 load_dotenv("docker/.env")
 
@@ -15,6 +26,16 @@ table_names = Literal["temp", "tmin", "tmax", "prec"]
 
 logger = logging.getLogger(__name__)
 
+config = read_config("config.json")
+
+# Columns that do not count as a change of a row
+UNHASHED_COLUMNS = ["uploaded_at"]
+
+# Primary key of the product tables
+PRIMARY_KEY_COLUMNS = ["adm2_id", "scenario", "month"]
+
+_upload_hash_created = False
+
 
 def _check_if_table_exists(table_name: Literal[table_names]) -> bool:
     with get_session() as Session:
@@ -26,17 +47,296 @@ def _check_if_table_exists(table_name: Literal[table_names]) -> bool:
                 return False
 
 
-def upload_to_db(df_path: Path, table_name: Literal[table_names]) -> None:
-    chelsa_table = get_table(table_name=table_name)
-    df = pd.read_csv(df_path, encoding="unicode_escape")
+@dataclass
+class UploadResult:
+    """Rows of a month of zonal statistics inserted into, updated in, or rejected by a product table"""
+
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: int = 0
+
+    @property
+    def rows(self) -> int:
+        """Rows written to the table"""
+        return self.inserted + self.updated
+
+
+def upload_to_db(
+    df_path: Path,
+    table_name: Literal[table_names],
+    mode: Literal["merge", "replace"] = config.upload_mode,
+) -> UploadResult:
+    """Insert or update a partition of the zonal statistics dataset in a product's table. Postgres tables are
+    loaded with COPY into a temporary staging table, then merged in a single statement; a local
+    SQLite stand-in is upserted in one batch. Only new rows and rows whose values changed are
+    written, and nothing is written when the content hash of the partition's rows matches the hash
+    stored by the last upload of its scenario and month. Rows that do not fit the table are
+    rejected and saved next to the partition as <file>.rejected.csv, instead of failing the upload.
+
+    In "replace" mode, the rows of the partition's scenarios and months are replaced by its rows
+    instead of merged. Month partitions of partitioned Postgres tables are truncated and loaded
+    with COPY.
+
+    Args:
+        df_path (Path): Partition file of the zonal statistics dataset
+        table_name (Literal[table_names]): Product table
+        mode (Literal["merge", "replace"], optional): Merge or replace the months. Defaults to config.upload_mode.
+
+    Returns:
+        UploadResult: Number of inserted, updated, unchanged and rejected rows
+    """
+    chelsa_table = get_table(table_name=table_name).__table__
+    df = read_table(path=df_path, decode_dictionaries=True)
+    df["uploaded_at"] = datetime.now()
+
+    with measure("upload_to_db") as stage:
+        df, rejected = _split_rejected_rows(df=df, table=chelsa_table)
+        if len(rejected) > 0:
+            rejected_path = Path(f"{df_path}.rejected.csv")
+            rejected.to_csv(rejected_path, index=False)
+            logger.warning(f"{len(rejected)} rows of {df_path} rejected, saved to {rejected_path}")
+
+        create_upload_hash_table()
+        upload_key = get_upload_key(df=df, table_name=table_name)
+        content_hash = hash_rows(df=df)
+
+        with get_session() as Session:
+            with Session() as session:
+                stored_hash = session.get(UploadHashTable, upload_key)
+                if stored_hash is not None and stored_hash.content_hash == content_hash:
+                    logger.info(f"Rows of {df_path} are already in {table_name}, skipping upload")
+                    return UploadResult(unchanged=len(df), rejected=len(rejected))
+
+                try:
+                    connection = session.connection()
+                    month_keys = sorted({(str(scenario), int(month)) for scenario, month in zip(df["scenario"], df["month"])})
+                    if is_partitioned(connection=connection, table=chelsa_table):
+                        create_month_partitions(connection=connection, table=chelsa_table, keys=month_keys)
+
+                    if mode == "replace":
+                        inserted, updated = _replace_months(
+                            connection=connection, df=df, table=chelsa_table, keys=month_keys
+                        )
+                    elif connection.dialect.name == "postgresql":
+                        inserted, updated = _copy_merge(connection=connection, df=df, table=chelsa_table)
+                    else:
+                        inserted, updated = _batch_upsert(connection=connection, df=df, table=chelsa_table)
+                    session.merge(
+                        UploadHashTable(
+                            table_name=upload_key[0],
+                            scenario=upload_key[1],
+                            month=upload_key[2],
+                            content_hash=content_hash,
+                            row_count=len(df),
+                            uploaded_at=datetime.now(),
+                        )
+                    )
+                    session.commit()
+                except:
+                    session.rollback()
+                    logger.exception(f"Unable to upload {df_path} to {table_name}.")
+                    raise
+
+        result = UploadResult(
+            inserted=inserted, updated=updated, unchanged=len(df) - inserted - updated, rejected=len(rejected)
+        )
+        stage.rows = result.rows
+
+    logger.info(f"Uploaded {df_path} to {table_name}: {result}")
+    return result
+
+
+def _split_rejected_rows(df: pd.DataFrame, table: Table) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Splits the rows that fit the table from the rows that do not: rows missing a required
+    value, with non-numeric statistics or months, with unknown products or scenarios, or with
+    strings longer than their column. Columns that are not in the table are dropped, and later
+    rows replace earlier rows with the same admin area, scenario and month.
+
+    Args:
+        df (pd.DataFrame): Rows to upload
+        table (Table): Product table
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: Valid rows with the table's columns, and rejected rows
+    """
+    extra_columns = [column for column in df.columns if column not in table.columns and column not in DERIVED_COLUMNS]
+    if extra_columns:
+        logger.warning(f"Columns {extra_columns} are not in table {table.name} and are not uploaded")
+
+    columns = [column for column in table.columns if column.name in df.columns]
+    valid = pd.Series(True, index=df.index)
+    rows = pd.DataFrame(index=df.index)
+    for column in columns:
+        values = df[column.name]
+        if isinstance(column.type, Float):
+            rows[column.name] = pd.to_numeric(values, errors="coerce")
+            valid &= rows[column.name].notna() | values.isna()
+        elif isinstance(column.type, Integer):
+            numbers = pd.to_numeric(values, errors="coerce")
+            integers = numbers.notna() & (numbers % 1 == 0)
+            rows[column.name] = numbers.where(integers).astype("Int64")
+            valid &= integers | values.isna()
+        elif isinstance(column.type, Enum):
+            rows[column.name] = values.astype("string")
+            valid &= rows[column.name].isin(column.type.enums) | values.isna()
+        elif isinstance(column.type, String):
+            rows[column.name] = values.astype("string")
+            if column.type.length is not None:
+                valid &= rows[column.name].str.len().fillna(0) <= column.type.length
+        else:
+            rows[column.name] = values
+
+        if not column.nullable:
+            valid &= rows[column.name].notna()
+
+    rows = rows[valid].drop_duplicates(subset=[key.name for key in table.primary_key], keep="last")
+    return rows, df[~valid]
+
+
+def get_upload_key(df: pd.DataFrame, table_name: str) -> tuple[str, str, str]:
+    """(table, scenario, month) key of the content hash of an upload. Uploads of several
+    scenarios or months are keyed by all of them."""
+    return (
+        table_name,
+        "|".join(sorted(df["scenario"].dropna().astype(str).unique())),
+        "|".join(sorted(df["month"].dropna().astype(str).unique())),
+    )
+
+
+def hash_rows(df: pd.DataFrame) -> str:
+    """SHA-256 of the rows of an upload, independent of their order and of uploaded_at"""
+    rows = df.drop(columns=[column for column in UNHASHED_COLUMNS if column in df])
+    rows = rows.sort_values(by=[column for column in PRIMARY_KEY_COLUMNS if column in rows])
+    return hashlib.sha256(rows.to_csv(index=False).encode()).hexdigest()
+
+
+def create_upload_hash_table() -> None:
+    """Create the upload hash table if it does not exist (once per process).
+    Postgres databases get the table from the Alembic migration; this covers local SQLite databases."""
+    global _upload_hash_created
+    if _upload_hash_created:
+        return
 
     with get_session() as Session:
         with Session() as session:
-            try:
-                for _, row in df.iterrows():
-                    record = chelsa_table(**row, uploaded_at=datetime.now())
-                    session.add(record)
-                session.commit()
-            except:
-                session.rollback()
-                logger.exception(f"Unable to add record to database.")
+            UploadHashTable.__table__.create(bind=session.connection(), checkfirst=True)
+            session.commit()
+    _upload_hash_created = True
+
+
+def _get_compared_columns(df: pd.DataFrame, table: Table) -> list[str]:
+    """Columns whose changes cause an existing row to be updated"""
+    return [
+        column for column in df.columns if column not in table.primary_key.columns and column not in UNHASHED_COLUMNS
+    ]
+
+
+def _copy_merge(connection: Connection, df: pd.DataFrame, table: Table) -> Tuple[int, int]:
+    """Streams the rows into a temporary staging table with COPY, then merges them into the
+    table with INSERT ... ON CONFLICT, updating only the rows whose values changed. Temporary
+    tables are not written to the WAL and are private to the connection, so concurrent uploads
+    do not share a staging table.
+
+    Returns:
+        Tuple[int, int]: Number of inserted and updated rows
+    """
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    keys = ", ".join(f'"{key.name}"' for key in table.primary_key)
+    updates = ", ".join(
+        f'"{column}" = EXCLUDED."{column}"' for column in df.columns if column not in table.primary_key.columns
+    )
+    compared_columns = _get_compared_columns(df=df, table=table)
+    current = ", ".join(f'"{table.name}"."{column}"' for column in compared_columns)
+    excluded = ", ".join(f'EXCLUDED."{column}"' for column in compared_columns)
+    staging_table = f"{table.name}_staging"
+
+    with connection.connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE IF NOT EXISTS "{staging_table}" (LIKE "{table.name}") ON COMMIT DELETE ROWS'
+        )
+        _copy_rows(cursor=cursor, df=df, table_name=staging_table)
+        # xmax is 0 for new row versions that were inserted rather than updated
+        cursor.execute(
+            f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{staging_table}" '
+            f"ON CONFLICT ({keys}) DO UPDATE SET {updates} "
+            f"WHERE ROW({current}) IS DISTINCT FROM ROW({excluded}) "
+            "RETURNING (xmax = 0)"
+        )
+        inserted = [row[0] for row in cursor.fetchall()]
+
+    return sum(inserted), len(inserted) - sum(inserted)
+
+
+def _replace_months(
+    connection: Connection, df: pd.DataFrame, table: Table, keys: list[tuple[str, int]]
+) -> Tuple[int, int]:
+    """Replaces the rows of the scenarios and months of the keys with the rows of df.
+    Partitioned Postgres tables have their month partitions truncated and loaded with COPY;
+    other tables have the months' rows deleted.
+
+    Returns:
+        Tuple[int, int]: Number of inserted and updated rows
+    """
+    if is_partitioned(connection=connection, table=table):
+        truncate_month_partitions(connection=connection, table=table, keys=keys)
+    else:
+        connection.execute(
+            delete(table).where(
+                or_(*[and_(table.c.scenario == scenario, table.c.month == month) for scenario, month in keys])
+            )
+        )
+
+    if connection.dialect.name == "postgresql":
+        with connection.connection.cursor() as cursor:
+            _copy_rows(cursor=cursor, df=df, table_name=table.name)
+    elif len(df) > 0:
+        connection.execute(insert(table), df.astype(object).where(df.notna(), None).to_dict(orient="records"))
+
+    return len(df), 0
+
+
+def _copy_rows(cursor, df: pd.DataFrame, table_name: str) -> None:
+    """Streams the rows into a Postgres table with COPY FROM STDIN"""
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def _batch_upsert(connection: Connection, df: pd.DataFrame, table: Table) -> Tuple[int, int]:
+    """Upserts the rows into a SQLite table in one executemany, updating only the rows whose values changed
+
+    Returns:
+        Tuple[int, int]: Number of inserted and updated rows
+    """
+    if len(df) == 0:
+        return 0, 0
+
+    key_columns = list(table.primary_key.columns)
+    records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+    keys = [tuple(record[column.name] for column in key_columns) for record in records]
+    existing = set()
+    for start in range(0, len(keys), 500):
+        existing.update(
+            tuple(row)
+            for row in connection.execute(
+                select(*key_columns).where(tuple_(*key_columns).in_(keys[start : start + 500]))
+            )
+        )
+
+    statement = sqlite_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[column.name for column in key_columns],
+        set_={column: statement.excluded[column] for column in df.columns if column not in table.primary_key.columns},
+        where=or_(
+            *[
+                table.c[column].is_distinct_from(statement.excluded[column])
+                for column in _get_compared_columns(df=df, table=table)
+            ]
+        ),
+    )
+    written = {tuple(row) for row in connection.execute(statement.returning(*key_columns), records)}
+
+    return len(written - existing), len(written & existing)
@@ -1,12 +1,28 @@
+import hashlib
+import json
 import logging
+import os
 from pathlib import Path
 from typing import Optional
 
 import geopandas as gpd
 import pandas as pd
+from config import read_config
+from rasterio.crs import CRS
 
 logger = logging.getLogger(__name__)
 
+config = read_config("config.json")
+
+# Files that make up a shapefile. Other geometry formats are a single file.
+SHAPEFILE_SIDECARS = [".shp", ".shx", ".dbf", ".prj", ".cpg"]
+
+_file_fingerprints: dict[tuple, str] = {}
+_loaded_geometries: dict[str, gpd.GeoDataFrame] = {}
+
+# Columns of the source geometry that get_geometry drops by default
+COLUMNS_TO_DROP = ['OBJECTID_1', 'Shape_Leng', 'Shape_Area', 'validOn', 'validTo', 'last_modif', 'source', 'date']
+
 #TODO: add column mapping to config
 COLUMN_MAPPING = {
     'admin0pcod': 'iso2_code',
@@ -20,7 +36,7 @@ COLUMN_MAPPING = {
 def get_geometry(geom_path: Path,
                  column_mapping: dict,
                  lower_case: bool = True,
-                 cols_to_drop: Optional[list[str]] = ['OBJECTID_1', 'Shape_Leng', 'Shape_Area', 'validOn', 'validTo', 'last_modif', 'source', 'date'],
+                 cols_to_drop: Optional[list[str]] = COLUMNS_TO_DROP,
                   ) -> gpd.GeoDataFrame:
     """Reads geometry, drops unnecessary columns, 
     transforms to lower case (optional), and renames columns
@@ -43,6 +59,88 @@ def get_geometry(geom_path: Path,
     return mapped_geoms
 
 
+def load_geometry(geom_path: Path,
+                  column_mapping: dict = COLUMN_MAPPING,
+                  target_crs: Optional[CRS] = None,
+                  lower_case: bool = True,
+                  cols_to_drop: Optional[list[str]] = COLUMNS_TO_DROP,
+                  cache_dir: Path = Path(f"{config.root_dir}/{config.cache_dir}/geometry/"),
+                  ) -> gpd.GeoDataFrame:
+    """Returns the cleaned geometry (see get_geometry), reprojected to target_crs if provided.
+    The result is stored as GeoParquet, keyed by the geometry file contents, every option
+    of get_geometry and the target CRS, and memoized in the process, so batches parse the
+    source file once.
+
+    Args:
+        geom_path (Path): Path to the geometry file
+        column_mapping (dict, optional): Column mapping passed to get_geometry. Defaults to COLUMN_MAPPING.
+        target_crs (Optional[CRS], optional): CRS to reproject to. Defaults to None (keep the source CRS).
+        lower_case (bool, optional): Passed to get_geometry. Defaults to True.
+        cols_to_drop (Optional[list[str]], optional): Passed to get_geometry. Defaults to COLUMNS_TO_DROP.
+        cache_dir (Path, optional): Directory of cached geometries. Defaults to <root_dir>/<cache_dir>/geometry.
+
+    Returns:
+        gpd.GeoDataFrame: Copy of the cleaned geometry, safe to modify
+    """
+    crs_key = CRS.from_user_input(target_crs).to_wkt() if target_crs is not None else ""
+    options_key = json.dumps(
+        {"column_mapping": column_mapping, "lower_case": lower_case, "cols_to_drop": cols_to_drop}, sort_keys=True
+    )
+    key = hashlib.sha256(
+        f"{fingerprint_geometry_file(geom_path)}:{options_key}:{crs_key}".encode()
+    ).hexdigest()[:32]
+
+    if key not in _loaded_geometries:
+        cache_path = Path(f"{cache_dir}/{key}.parquet")
+        if os.path.exists(cache_path):
+            geometry = gpd.read_parquet(cache_path)
+        else:
+            logger.info(f"Parsing geometry {geom_path}")
+            geometry = get_geometry(
+                geom_path=geom_path, column_mapping=column_mapping, lower_case=lower_case, cols_to_drop=cols_to_drop
+            )
+            if target_crs is not None and geometry.crs != CRS.from_user_input(target_crs):
+                geometry = gpd.GeoDataFrame(geometry.to_crs(target_crs))
+
+            os.makedirs(cache_dir, exist_ok=True)
+            temporary_path = Path(f"{cache_dir}/{key}.{os.getpid()}.tmp.parquet")
+            geometry.to_parquet(temporary_path, index=True)
+            os.replace(temporary_path, cache_path)
+
+        _loaded_geometries[key] = geometry
+
+    return _loaded_geometries[key].copy()
+
+
+def fingerprint_geometry_file(geom_path: Path) -> str:
+    """Hash of the contents of a geometry file, including shapefile sidecar files.
+    Hashes are memoized per file size and modification time.
+
+    Args:
+        geom_path (Path): Path to the geometry file
+
+    Returns:
+        str: Hex digest of the geometry file contents
+    """
+    geom_path = Path(geom_path)
+    if geom_path.suffix == ".shp":
+        files = [geom_path.with_suffix(suffix) for suffix in SHAPEFILE_SIDECARS]
+        files = [file for file in files if os.path.exists(file)]
+    else:
+        files = [geom_path]
+
+    memo_key = tuple((str(file), os.stat(file).st_size, os.stat(file).st_mtime_ns) for file in files)
+    if memo_key not in _file_fingerprints:
+        digest = hashlib.sha256()
+        for file in files:
+            with open(file, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        _file_fingerprints[memo_key] = digest.hexdigest()
+
+    return _file_fingerprints[memo_key]
+
+
 def _rename_geometry(geom: gpd.GeoDataFrame, column_mapping: dict) -> gpd.GeoDataFrame:
     """Rename geometries based on column mapping to align with database standards.
 
@@ -0,0 +1,380 @@
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from climatology import (ChelsaProduct, Month, Product, Scenario,
+                         get_climatology, get_product_matrix)
+from config import read_config
+from log import setup_logger
+from metrics import export_metrics
+from processing_steps import (RasterProcessingStep, execute_processing_steps,
+                              plan_processing_steps)
+from session import get_session
+from sqlalchemy import DateTime, and_, func, or_, select, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.functions import FunctionElement
+from tables import JobQueueTable
+
+logger = logging.getLogger(__name__)
+
+config = read_config("config.json")
+
+# Seconds an idle worker waits before looking for ready jobs again
+POLL_SECONDS = 5
+
+_queue_created = False
+
+
+class server_time(FunctionElement):
+    """Time of the database server, offset by a number of seconds. Leases are written and
+    compared with the server's clock, so clock skew between worker hosts cannot expire the
+    lease of a job that is still running."""
+
+    type = DateTime()
+    name = "server_time"
+    inherit_cache = True
+
+
+@compiles(server_time)
+def _compile_server_time(element: server_time, compiler, **kw) -> str:
+    (seconds,) = element.clauses
+    return f"now() + {compiler.process(seconds, **kw)} * interval '1 second'"
+
+
+@compiles(server_time, "sqlite")
+def _compile_server_time_sqlite(element: server_time, compiler, **kw) -> str:
+    (seconds,) = element.clauses
+    return f"datetime('now', {compiler.process(seconds, **kw)} || ' seconds')"
+
+
+@dataclass
+class QueuedJob:
+    """A processing step claimed from the queue"""
+
+    id: int
+    chelsa_product: ChelsaProduct
+    step: RasterProcessingStep
+
+
+def enqueue_matrix(
+    products: Optional[list[Product]] = None,
+    scenarios: Optional[list[Scenario]] = None,
+    months: Optional[list[Month]] = None,
+) -> int:
+    """Plans a product x scenario x month matrix and adds its processing steps to the queue.
+    Steps already in the queue are set back to pending, unless a worker is running them.
+
+    Args:
+        products (Optional[list[Product]], optional): Products to process. Defaults to all products.
+        scenarios (Optional[list[Scenario]], optional): Scenarios to process. Defaults to all scenarios.
+        months (Optional[list[Month]], optional): Months to process. Defaults to all months.
+
+    Returns:
+        int: Number of queued steps
+    """
+    create_queue_table()
+    chelsa_products = get_product_matrix(products=products, scenarios=scenarios, months=months)
+    planned_steps = plan_processing_steps(chelsa_products=chelsa_products)
+    jobs = {
+        (chelsa_product.product.value, chelsa_product.scenario.value, str(chelsa_product.month.value), step.name): step
+        for chelsa_product, processing_steps in zip(chelsa_products, planned_steps)
+        for step in processing_steps
+    }
+
+    with get_session() as Session:
+        with Session() as session:
+            existing = {
+                (row.product, row.scenario, row.month, row.step): row
+                for row in session.scalars(
+                    select(JobQueueTable).where(
+                        JobQueueTable.product.in_({key[0] for key in jobs}),
+                        JobQueueTable.scenario.in_({key[1] for key in jobs}),
+                    )
+                )
+            }
+            for (product, scenario, month, step_name), step in jobs.items():
+                row = existing.get((product, scenario, month, step_name))
+                if row is None:
+                    session.add(
+                        JobQueueTable(
+                            product=product,
+                            scenario=scenario,
+                            month=month,
+                            step=step_name,
+                            step_order=step.value,
+                            status="pending",
+                            attempts=0,
+                        )
+                    )
+                elif row.status != "running":
+                    row.status = "pending"
+                    row.attempts = 0
+                    row.worker_id = None
+                    row.error = None
+            session.commit()
+
+    logger.info(f"Queued {len(jobs)} steps for {len(chelsa_products)} products, scenarios and months")
+    return len(jobs)
+
+
+def claim_job(worker_id: str, lease_seconds: int = config.queue_lease_seconds) -> Optional[QueuedJob]:
+    """Claims the oldest ready job. A job is ready when the earlier steps of its month (and, for
+    the yearly table, the monthly steps of every month) have succeeded. Candidate rows are
+    locked with FOR UPDATE SKIP LOCKED on Postgres, and the claim is a conditional update, so
+    a job is never claimed by two workers (on SQLite, which ignores row locks, too).
+
+    Args:
+        worker_id (str): Identifier of the claiming worker
+        lease_seconds (int, optional): Seconds the claim lasts without a heartbeat. Defaults to config.queue_lease_seconds.
+
+    Returns:
+        Optional[QueuedJob]: Claimed job, or None if no job is ready
+    """
+    blocking = aliased(JobQueueTable)
+    not_ready = (
+        select(blocking.id)
+        .where(
+            blocking.product == JobQueueTable.product,
+            blocking.scenario == JobQueueTable.scenario,
+            blocking.step_order < JobQueueTable.step_order,
+            blocking.step != RasterProcessingStep.YEARLY_TABLE.name,
+            blocking.status != "succeeded",
+            or_(blocking.month == JobQueueTable.month, JobQueueTable.step == RasterProcessingStep.YEARLY_TABLE.name),
+        )
+        .exists()
+    )
+    candidates = (
+        select(JobQueueTable.id)
+        .where(JobQueueTable.status == "pending", ~not_ready)
+        .order_by(JobQueueTable.id)
+        .limit(1)
+        .with_for_update(skip_locked=True, of=JobQueueTable)
+    )
+
+    with get_session() as Session:
+        with Session() as session:
+            # Another worker may claim the candidate between the select and the update
+            for _ in range(3):
+                job_id = session.scalar(candidates)
+                if job_id is None:
+                    session.rollback()
+                    return None
+
+                claimed = session.execute(
+                    update(JobQueueTable)
+                    .where(JobQueueTable.id == job_id, JobQueueTable.status == "pending")
+                    .values(
+                        status="running",
+                        worker_id=worker_id,
+                        attempts=JobQueueTable.attempts + 1,
+                        heartbeat_at=server_time(0),
+                        lease_expires_at=server_time(lease_seconds),
+                    )
+                )
+                session.commit()
+                if claimed.rowcount == 1:
+                    row = session.get(JobQueueTable, job_id)
+                    return QueuedJob(
+                        id=job_id,
+                        chelsa_product=get_climatology(
+                            product=Product(row.product), scenario=Scenario(row.scenario), month=Month(int(row.month))
+                        ),
+                        step=RasterProcessingStep[row.step],
+                    )
+
+    return None
+
+
+def extend_lease(job_id: int, worker_id: str, lease_seconds: int = config.queue_lease_seconds) -> bool:
+    """Heartbeat: extend the lease of a running job
+
+    Returns:
+        bool: False if the worker no longer holds the job, eg. because its lease expired and the job was requeued
+    """
+    with get_session() as Session:
+        with Session() as session:
+            extended = session.execute(
+                update(JobQueueTable)
+                .where(JobQueueTable.id == job_id, JobQueueTable.worker_id == worker_id, JobQueueTable.status == "running")
+                .values(heartbeat_at=server_time(0), lease_expires_at=server_time(lease_seconds))
+            )
+            session.commit()
+            return extended.rowcount == 1
+
+
+def finish_job(job_id: int, worker_id: str, error: Optional[str] = None, max_attempts: int = config.queue_max_attempts) -> None:
+    """Mark a job as succeeded, or failed. A failed job is retried until it has been attempted max_attempts times.
+
+    Args:
+        job_id (int): Claimed job
+        worker_id (str): Worker that ran the job
+        error (Optional[str], optional): Error of a failed job. Defaults to None.
+        max_attempts (int, optional): Attempts before a job is failed for good. Defaults to config.queue_max_attempts.
+    """
+    with get_session() as Session:
+        with Session() as session:
+            row = session.get(JobQueueTable, job_id, with_for_update=True)
+            if row is None or row.worker_id != worker_id or row.status != "running":
+                logger.warning(f"Worker {worker_id} lost the lease of job {job_id} before it finished")
+                session.rollback()
+                return
+
+            if error is None:
+                row.status = "succeeded"
+            else:
+                row.status = "pending" if row.attempts < max_attempts else "failed"
+                row.error = error
+            row.worker_id = None
+            row.lease_expires_at = None
+            session.commit()
+
+
+def requeue_expired_jobs(max_attempts: int = config.queue_max_attempts) -> int:
+    """Set running jobs whose lease expired (their worker crashed or hung) back to pending,
+    or to failed once they have been attempted max_attempts times. Expiry is decided by the
+    database server's clock, like the leases themselves.
+
+    Returns:
+        int: Number of requeued or failed jobs
+    """
+    expired = and_(JobQueueTable.status == "running", JobQueueTable.lease_expires_at < server_time(0))
+    with get_session() as Session:
+        with Session() as session:
+            requeued = session.execute(
+                update(JobQueueTable)
+                .where(expired, JobQueueTable.attempts < max_attempts)
+                .values(status="pending", worker_id=None, lease_expires_at=None, error="Lease expired")
+            )
+            failed = session.execute(
+                update(JobQueueTable)
+                .where(expired, JobQueueTable.attempts >= max_attempts)
+                .values(status="failed", worker_id=None, lease_expires_at=None, error="Lease expired")
+            )
+            session.commit()
+            return requeued.rowcount + failed.rowcount
+
+
+def queue_status() -> dict[str, int]:
+    """Number of queued jobs per status"""
+    with get_session() as Session:
+        with Session() as session:
+            rows = session.execute(
+                select(JobQueueTable.status, func.count()).group_by(JobQueueTable.status)
+            ).all()
+    return {status: count for status, count in rows}
+
+
+def run_worker(
+    worker_id: Optional[str] = None,
+    lease_seconds: int = config.queue_lease_seconds,
+    max_attempts: int = config.queue_max_attempts,
+    poll_seconds: float = POLL_SECONDS,
+    runner: Optional[Callable[[ChelsaProduct, RasterProcessingStep], None]] = None,
+) -> int:
+    """Claims and runs jobs until no job is ready and none is running on any worker.
+    A heartbeat thread extends the lease of the running job, so only jobs of crashed
+    or hung workers are requeued.
+
+    Args:
+        worker_id (Optional[str], optional): Identifier of the worker. Defaults to <hostname>-<pid>-<random>.
+        lease_seconds (int, optional): Seconds a claim lasts without a heartbeat. Defaults to config.queue_lease_seconds.
+        max_attempts (int, optional): Attempts before a job is failed for good. Defaults to config.queue_max_attempts.
+        poll_seconds (float, optional): Seconds to wait when no job is ready. Defaults to POLL_SECONDS.
+        runner (Optional[Callable[[ChelsaProduct, RasterProcessingStep], None]], optional): Function that
+            runs a step. Defaults to execute_processing_steps.
+
+    Returns:
+        int: Number of jobs run by this worker
+    """
+    create_queue_table()
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    runner = runner or _run_step
+    jobs_run = 0
+
+    while True:
+        requeue_expired_jobs(max_attempts=max_attempts)
+        job = claim_job(worker_id=worker_id, lease_seconds=lease_seconds)
+        if job is None:
+            if queue_status().get("running", 0) == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        logger.info(f"Worker {worker_id} running {job.step.name} for {job.chelsa_product.product.name}_{job.chelsa_product.scenario.name}_{job.chelsa_product.month.name}")
+        heartbeat = _Heartbeat(job_id=job.id, worker_id=worker_id, lease_seconds=lease_seconds)
+        heartbeat.start()
+        error = None
+        try:
+            runner(job.chelsa_product, job.step)
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            error = repr(e)
+        finally:
+            heartbeat.stop()
+
+        finish_job(job_id=job.id, worker_id=worker_id, error=error, max_attempts=max_attempts)
+        jobs_run += 1
+
+    logger.info(f"Worker {worker_id} finished after {jobs_run} jobs: {queue_status()}")
+    export_metrics(run_name=f"worker_{worker_id}")
+    return jobs_run
+
+
+def create_queue_table() -> None:
+    """Create the job queue table if it does not exist (once per process).
+    Postgres databases get the table from the Alembic migration; this covers local SQLite databases."""
+    global _queue_created
+    if _queue_created:
+        return
+
+    with get_session() as Session:
+        with Session() as session:
+            JobQueueTable.__table__.create(bind=session.connection(), checkfirst=True)
+            session.commit()
+    _queue_created = True
+
+
+class _Heartbeat(threading.Thread):
+    """Extends the lease of a job every third of the lease while the job runs"""
+
+    def __init__(self, job_id: int, worker_id: str, lease_seconds: int):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.lease_seconds / 3):
+            if not extend_lease(job_id=self.job_id, worker_id=self.worker_id, lease_seconds=self.lease_seconds):
+                logger.warning(f"Worker {self.worker_id} lost the lease of job {self.job_id}")
+                return
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+def _run_step(chelsa_product: ChelsaProduct, step: RasterProcessingStep) -> None:
+    """Run a single processing step"""
+    execute_processing_steps(processing_steps=[step], chelsa_product=chelsa_product)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed processing of the product x scenario x month matrix")
+    parser.add_argument("command", choices=["enqueue", "work"], help="Queue the matrix, or run a worker")
+    arguments = parser.parse_args()
+
+    setup_logger()
+    if arguments.command == "enqueue":
+        enqueue_matrix()
+    else:
+        run_worker()
+    logging.shutdown()
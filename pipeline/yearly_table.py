@@ -1,7 +1,10 @@
+import os
+import time
 from pathlib import Path
 
 from climatology import ChelsaProduct
 from functions import yearly_table_generator
+from store import write_table
 
 
 def process_yearly_table(product: ChelsaProduct,
@@ -9,8 +12,12 @@ def process_yearly_table(product: ChelsaProduct,
                          out_path: Path,
                          sort_values: list[str]):
     
+    # Months written while the table is built are newer than the table, and read again next time
+    started_at = time.time_ns()
     yearly_table = yearly_table_generator(product=product,
                                           zonal_dir=zonal_dir,
-                                          sort_values=sort_values)
+                                          sort_values=sort_values,
+                                          yearly_path=out_path)
     
-    yearly_table.to_csv(out_path, encoding='utf-8', index=False)
\ No newline at end of file
+    write_table(df=yearly_table, path=out_path)
+    os.utime(out_path, ns=(started_at, started_at))
\ No newline at end of file
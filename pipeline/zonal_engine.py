@@ -0,0 +1,176 @@
+from typing import Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+from affine import Affine
+from rasterio import features
+
+AVAILABLE_STATISTICS = ["count", "sum", "min", "max", "mean", "median"]
+
+
+def get_zone_dtype(n_zones: int) -> np.dtype:
+    """Smallest unsigned integer type of a zone-id grid of n_zones zones"""
+    return np.dtype(np.uint16 if n_zones < np.iinfo(np.uint16).max else np.uint32)
+
+
+def rasterize_zones(
+    geometry: gpd.GeoDataFrame, transform: Affine, shape: Tuple[int, int]
+) -> np.ndarray:
+    """Burns every geometry into one integer zone-id grid aligned to a raster.
+    The zone id of a geometry is its position in the geodataframe plus one, and 0 marks
+    pixels outside all geometries. A pixel belongs to a geometry if its centre is inside it,
+    as in rasterstats. Where geometries overlap, the later geometry wins.
+
+    Args:
+        geometry (gpd.GeoDataFrame): Geometries that define the zones, in the raster's CRS
+        transform (Affine): Transform of the raster the grid is aligned to
+        shape (Tuple[int, int]): (height, width) of the raster
+
+    Returns:
+        np.ndarray: Zone-id grid with the raster's shape
+    """
+    dtype = get_zone_dtype(len(geometry))
+    shapes = [
+        (geom, zone_id)
+        for zone_id, geom in enumerate(geometry.geometry, start=1)
+        if geom is not None and not geom.is_empty
+    ]
+    if len(shapes) == 0:
+        return np.zeros(shape, dtype=dtype)
+
+    return features.rasterize(
+        shapes, out_shape=shape, transform=transform, fill=0, dtype=dtype
+    )
+
+
+def zonal_statistics(
+    raster: np.ndarray,
+    zones: np.ndarray,
+    n_zones: int,
+    stats: list[str],
+    nodata: Optional[float] = None,
+) -> dict[str, np.ndarray]:
+    """Computes statistics for every zone of a single band raster at once.
+    See zonal_statistics_cube.
+
+    Args:
+        raster (np.ndarray): Single band raster values
+        zones (np.ndarray): Zone-id grid with the raster's shape, as returned by rasterize_zones
+        n_zones (int): Number of zones (number of geometries)
+        stats (list[str]): Statistics to calculate. Options are count, sum, min, max, mean and median.
+        nodata (Optional[float], optional): Raster value that symbolizes no data. Defaults to None.
+
+    Returns:
+        dict[str, np.ndarray]: Array of length n_zones per statistic. Zones without valid pixels
+        have a count of 0 and NaN for the other statistics.
+    """
+    raster = np.asarray(raster)
+    if raster.ndim == 3:
+        raster = raster[0]
+
+    results = zonal_statistics_cube(
+        cube=raster[np.newaxis], zones=zones, n_zones=n_zones, stats=stats, nodata=nodata
+    )
+    return {stat: values[0] for stat, values in results.items()}
+
+
+def zonal_statistics_cube(
+    cube: np.ndarray,
+    zones: np.ndarray,
+    n_zones: int,
+    stats: list[str],
+    nodata: Optional[float] = None,
+) -> dict[str, np.ndarray]:
+    """Computes statistics for every zone and every band of a (band, y, x) cube at once.
+    In-zone pixels are sorted by zone a single time and the order is shared by all bands.
+    Counts, sums, minimums and maximums are segment reductions (reduceat) over all bands
+    together. The median sorts each band by (zone, value) and reads each zone's middle values.
+
+    Args:
+        cube (np.ndarray): Raster values with shape (band, y, x)
+        zones (np.ndarray): Zone-id grid with shape (y, x), as returned by rasterize_zones
+        n_zones (int): Number of zones (number of geometries)
+        stats (list[str]): Statistics to calculate. Options are count, sum, min, max, mean and median.
+        nodata (Optional[float], optional): Raster value that symbolizes no data. Defaults to None.
+
+    Returns:
+        dict[str, np.ndarray]: Array of shape (band, n_zones) per statistic. Zones without valid
+        pixels have a count of 0 and NaN for the other statistics.
+    """
+    unavailable = [stat for stat in stats if stat not in AVAILABLE_STATISTICS]
+    if unavailable:
+        raise ValueError(
+            f"Statistics {unavailable} are not available. Options include {AVAILABLE_STATISTICS}"
+        )
+
+    cube = np.asarray(cube)
+    zones = np.asarray(zones)
+    if cube.ndim != 3 or cube.shape[1:] != zones.shape:
+        raise ValueError("Cube must have shape (band, y, x) matching the zone grid.")
+
+    n_bands = cube.shape[0]
+    zone_ids = zones.ravel()
+    in_zone = np.flatnonzero(zone_ids > 0)
+    order = in_zone[np.argsort(zone_ids[in_zone], kind="stable")]
+    sorted_zones = zone_ids[order].astype(np.intp)
+
+    values = cube.reshape(n_bands, -1)[:, order].astype(np.float64)
+    invalid = np.isnan(values)
+    if nodata is not None:
+        invalid |= values == nodata
+    values[invalid] = np.nan
+
+    # Zones with at least one pixel, and where their segment starts in the sorted pixels
+    present = np.bincount(sorted_zones, minlength=n_zones + 1)[1:] > 0
+    zone_starts = np.searchsorted(sorted_zones, np.arange(1, n_zones + 1))
+    segment_starts = zone_starts[present]
+
+    count = np.zeros((n_bands, n_zones), dtype=np.int64)
+    if len(segment_starts) > 0:
+        count[:, present] = np.add.reduceat(~invalid, segment_starts, axis=1, dtype=np.int64)
+    has_pixels = count > 0
+    results = {}
+
+    def reduce_segments(ufunc: np.ufunc, band_values: np.ndarray) -> np.ndarray:
+        out = np.full((n_bands, n_zones), np.nan)
+        if len(segment_starts) > 0:
+            out[:, present] = ufunc.reduceat(band_values, segment_starts, axis=1)
+        return np.where(has_pixels, out, np.nan)
+
+    if "count" in stats:
+        results["count"] = count
+
+    if "sum" in stats or "mean" in stats:
+        total = reduce_segments(np.add, np.where(invalid, 0, values))
+        if "sum" in stats:
+            results["sum"] = total
+        if "mean" in stats:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                results["mean"] = total / count
+
+    if "min" in stats:
+        results["min"] = reduce_segments(np.fmin, values)
+
+    if "max" in stats:
+        results["max"] = reduce_segments(np.fmax, values)
+
+    if "median" in stats:
+        median = np.full((n_bands, n_zones), np.nan)
+        for band in range(n_bands):
+            # NaN sorts after every value, so valid values come first within each zone
+            sorted_values = values[band][np.lexsort((values[band], sorted_zones))]
+            lower = _take_segments(sorted_values, zone_starts + (count[band] - 1) // 2, has_pixels[band])
+            upper = _take_segments(sorted_values, zone_starts + count[band] // 2, has_pixels[band])
+            median[band] = (lower + upper) / 2
+        results["median"] = median
+
+    return results
+
+
+def _take_segments(
+    sorted_values: np.ndarray, positions: np.ndarray, has_pixels: np.ndarray
+) -> np.ndarray:
+    """Read values at the given positions, with NaN for zones without pixels"""
+    out = np.full(len(positions), np.nan)
+    out[has_pixels] = sorted_values[positions[has_pixels]]
+    return out
@@ -1,9 +1,12 @@
 from pathlib import Path
+from typing import Optional
 
 from climatology import ChelsaProduct
 from config import read_config
-from functions import calculate_zonal_statistics
-from vector_processing import COLUMN_MAPPING, get_geometry
+from functions import calculate_zonal_statistics, get_raster_crs
+from rollups import split_rollups
+from store import write_table
+from vector_processing import load_geometry
 
 config = read_config("config.json")
 
@@ -14,22 +17,31 @@ def process_zonal_statistics(
     chelsa_product: ChelsaProduct,
     place_id: str,
     geom_path: Path = config.geom_path,
+    rollup_path: Optional[Path] = None,
 ) -> None:
-    """Processes zonal statistics for a CHELSA product
+    """Processes zonal statistics for a CHELSA product. With config.admin_rollups, the statistics
+    of admin 1 and admin 0 areas are rolled up from the same pass over the raster.
 
     Args:
         raster_location (Path): Location of raster that will be used for zonal statistics
-        out_path (Path): Location where tabular zonal statistics will be saved
+        out_path (Path): Partition file of the zonal statistics dataset
         chelsa_product (ChelsaProduct): Used to insert product identifiers to zonal statistics
         place_id (str): Column that contains a unique ID per geometry
         geom_path (Path, optional): Path to geometry used for zonal statistics. Defaults to config.geom_path.
+        rollup_path (Optional[Path], optional): Partition file of the rollup dataset. Defaults to None (no rollups).
     """
-    geometry = get_geometry(geom_path=geom_path, column_mapping=COLUMN_MAPPING)
+    geometry = load_geometry(geom_path=geom_path, target_crs=get_raster_crs(raster_location))
     zonal_stats = calculate_zonal_statistics(
         raster_location=raster_location,
         geometry=geometry,
         chelsa_product=chelsa_product,
         place_id=place_id,
+        geom_path=geom_path if config.zone_cache else None,
+        rollup_levels=config.admin_rollups if rollup_path is not None else None,
     )
 
-    zonal_stats.to_csv(out_path, encoding="utf-8", index=False)
+    if "level" in zonal_stats:
+        zonal_stats, rollups = split_rollups(zonal_stats=zonal_stats)
+        write_table(df=rollups, path=rollup_path)
+
+    write_table(df=zonal_stats, path=out_path)
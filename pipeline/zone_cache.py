@@ -0,0 +1,92 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+from affine import Affine
+from config import read_config
+from rasterio.crs import CRS
+from vector_processing import fingerprint_geometry_file, load_geometry
+from zonal_engine import get_zone_dtype, rasterize_zones
+
+logger = logging.getLogger(__name__)
+
+config = read_config("config.json")
+
+
+def get_zone_grid(
+    geom_path: Path,
+    transform: Affine,
+    shape: Tuple[int, int],
+    crs: CRS,
+    geometry: Optional[gpd.GeoDataFrame] = None,
+    cache_dir: Path = Path(f"{config.root_dir}/{config.cache_dir}/zones/"),
+    memory_budget_mb: float = config.memory_budget_mb,
+) -> np.ndarray:
+    """Returns the zone-id grid of a geometry file for a raster grid.
+    The grid is computed once per geometry file and raster grid, saved as a .npy file,
+    and memory-mapped on later calls, so every product, scenario and month on the same
+    grid shares one rasterization. A missing grid is rasterized strip by strip into the
+    memory-mapped file, so building it never holds the whole grid in memory either.
+
+    Args:
+        geom_path (Path): Path to the geometry file. Its contents are part of the cache key.
+        transform (Affine): Transform of the raster grid
+        shape (Tuple[int, int]): (height, width) of the raster grid
+        crs (CRS): CRS of the raster grid
+        geometry (Optional[gpd.GeoDataFrame], optional): Already loaded geometry, used on a cache miss. Defaults to None (read from geom_path).
+        cache_dir (Path, optional): Directory of cached grids. Defaults to <root_dir>/<cache_dir>/zones.
+        memory_budget_mb (float, optional): Memory available for one strip of a missing grid. Defaults to config.memory_budget_mb.
+
+    Returns:
+        np.ndarray: Read-only zone-id grid, where zone i + 1 is row i of the geometry and 0 is background
+    """
+    key = hashlib.sha256(
+        f"{fingerprint_geometry_file(geom_path)}:{fingerprint_grid(transform, shape, crs)}".encode()
+    ).hexdigest()[:32]
+    cache_path = Path(f"{cache_dir}/{key}.npy")
+
+    if not os.path.exists(cache_path):
+        logger.info(f"Rasterizing zones for {geom_path} on a {shape[0]}x{shape[1]} grid")
+        if geometry is None:
+            geometry = load_geometry(geom_path=geom_path, target_crs=crs)
+        if geometry.crs is not None and CRS.from_user_input(geometry.crs) != CRS.from_user_input(crs):
+            geometry = geometry.to_crs(crs)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_path = Path(f"{cache_dir}/{key}.{os.getpid()}.tmp.npy")
+        dtype = get_zone_dtype(len(geometry))
+        zones = np.lib.format.open_memmap(temporary_path, mode="w+", dtype=dtype, shape=shape)
+
+        strip_height = max(1, int(memory_budget_mb * 1024 * 1024) // max(1, shape[1] * dtype.itemsize))
+        for row_start in range(0, shape[0], strip_height):
+            rows = min(strip_height, shape[0] - row_start)
+            zones[row_start : row_start + rows] = rasterize_zones(
+                geometry=geometry,
+                transform=transform * Affine.translation(0, row_start),
+                shape=(rows, shape[1]),
+            )
+
+        zones.flush()
+        del zones
+        os.replace(temporary_path, cache_path)
+
+    return np.load(cache_path, mmap_mode="r")
+
+
+def fingerprint_grid(transform: Affine, shape: Tuple[int, int], crs: CRS) -> str:
+    """String that uniquely identifies a raster grid
+
+    Args:
+        transform (Affine): Transform of the raster grid
+        shape (Tuple[int, int]): (height, width) of the raster grid
+        crs (CRS): CRS of the raster grid
+
+    Returns:
+        str: Grid fingerprint
+    """
+    coefficients = ",".join(f"{value:.12g}" for value in tuple(transform)[:6])
+    return f"{coefficients}|{shape[0]}x{shape[1]}|{CRS.from_user_input(crs).to_wkt()}"
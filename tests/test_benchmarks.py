@@ -0,0 +1,59 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import rasterio
+
+sys.path.insert(0, "pipeline")
+from benchmarks.run_benchmarks import (BenchmarkResult, find_regressions,
+                                       run_benchmarks)
+from benchmarks.synthetic import (CHELSA_NODATA, Scale, get_raster_bounds,
+                                  make_voronoi_zones, write_synthetic_raster)
+
+
+class TestSyntheticInputs:
+    def test_raster_is_deterministic(self, tmp_path):
+        first = write_synthetic_raster(tmp_path / "first.tif", width=120, height=90, seed=3)
+        second = write_synthetic_raster(tmp_path / "second.tif", width=120, height=90, seed=3)
+
+        with rasterio.open(first) as a, rasterio.open(second) as b:
+            assert a.dtypes[0] == "int16"
+            assert a.nodata == CHELSA_NODATA
+            raster = a.read(1)
+            assert np.array_equal(raster, b.read(1))
+        assert (raster == CHELSA_NODATA).any()
+
+    def test_zones_tile_the_bounds(self):
+        bounds = get_raster_bounds(width=120, height=90)
+        zones = make_voronoi_zones(n_zones=50, bounds=bounds, seed=3)
+
+        assert len(zones) == 50
+        assert zones["adm2_id"].is_unique
+        assert zones.unary_union.area == pytest.approx((bounds[2] - bounds[0]) * (bounds[3] - bounds[1]))
+        assert zones.geom_equals(make_voronoi_zones(n_zones=50, bounds=bounds, seed=3)).all()
+
+
+class TestBenchmarks:
+    def test_run_benchmarks(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("DATABASE_URL", "sqlite://")
+        results = run_benchmarks(
+            scale_name="tiny", scale=Scale(n_zones=20, width=240, height=180), work_dir=tmp_path, repeats=1
+        )
+
+        assert [result.stage for result in results][-2:] == ["yearly_table_generator", "upload_to_db"]
+        assert os.environ["DATABASE_URL"] == "sqlite://"
+        assert all(result.seconds > 0 for result in results)
+
+    def test_find_regressions(self):
+        results = [
+            BenchmarkResult(stage="slower", scale="small", seconds=2.0, repeats=3),
+            BenchmarkResult(stage="noise", scale="small", seconds=0.02, repeats=3),
+            BenchmarkResult(stage="new", scale="small", seconds=1.0, repeats=3),
+        ]
+        baselines = {"small/slower": 1.0, "small/noise": 0.01}
+
+        regressions = find_regressions(results=results, baselines=baselines, threshold=0.25)
+
+        assert len(regressions) == 1
+        assert regressions[0].startswith("small/slower")
@@ -0,0 +1,61 @@
+import sys
+import threading
+from dataclasses import dataclass
+from functools import partial
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, "pipeline")
+from bulk_download import _download_full_raster, _get_http_session
+from tests.test_download import RangeRequestHandler
+
+
+@dataclass
+class StubProduct:
+    url: str
+    raw_raster_path: Path
+    scenario: str = "scenario"
+    month: int = 1
+
+    def get_url(self, scenario, month):
+        return self.url
+
+
+@pytest.fixture(scope="module")
+def served_file(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("served")
+    content = bytes(range(256)) * 4096
+    (directory / "raster.tif").write_bytes(content)
+
+    handler = partial(RangeRequestHandler, directory=str(directory))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_port}/raster.tif", content
+
+    server.shutdown()
+
+
+class TestBulkDownload:
+    def test_full_download(self, served_file, tmp_path):
+        url, content = served_file
+        product = StubProduct(url=url, raw_raster_path=tmp_path / "raw.tif")
+
+        bytes_downloaded = _download_full_raster(chelsa_product=product, session=_get_http_session(pool_size=1))
+
+        assert bytes_downloaded == len(content)
+        assert product.raw_raster_path.read_bytes() == content
+        assert not (tmp_path / "raw.tif.part").exists()
+
+    def test_partial_download_is_resumed(self, served_file, tmp_path):
+        url, content = served_file
+        product = StubProduct(url=url, raw_raster_path=tmp_path / "raw.tif")
+        (tmp_path / "raw.tif.part").write_bytes(content[:1000])
+
+        bytes_downloaded = _download_full_raster(chelsa_product=product, session=_get_http_session(pool_size=1))
+
+        assert bytes_downloaded == len(content) - 1000
+        assert product.raw_raster_path.read_bytes() == content
@@ -0,0 +1,77 @@
+import sys
+
+import numpy as np
+import pytest
+from rasterio.transform import from_origin
+from shapely.geometry import Point, box
+
+import geopandas as gpd
+
+sys.path.insert(0, "pipeline")
+from coverage import compute_coverage_weights, weighted_zonal_statistics
+from zonal_engine import rasterize_zones, zonal_statistics
+
+TRANSFORM = from_origin(0, 10, 1, 1)
+
+
+@pytest.fixture(scope="module")
+def raster():
+    return np.arange(100, dtype=np.float64).reshape(10, 10)
+
+
+class TestCoverage:
+    def test_aligned_polygon_has_full_coverage(self):
+        geometry = gpd.GeoDataFrame(geometry=[box(2, 2, 5, 6)])
+        weights = compute_coverage_weights(geometry=geometry, transform=TRANSFORM, shape=(10, 10), supersample=4)
+
+        assert weights.shape == (1, 100)
+        assert weights.nnz == 12
+        np.testing.assert_allclose(weights.data, 1)
+
+    def test_partial_pixels_are_weighted(self):
+        geometry = gpd.GeoDataFrame(geometry=[box(2.5, 2, 4.5, 3)])
+        weights = compute_coverage_weights(geometry=geometry, transform=TRANSFORM, shape=(10, 10), supersample=4)
+
+        assert weights.sum() == pytest.approx(2)
+        np.testing.assert_allclose(sorted(weights.data), [0.5, 0.5, 1])
+
+    def test_strips_match_single_pass(self, monkeypatch):
+        geometry = gpd.GeoDataFrame(geometry=[Point(4, 4).buffer(3), box(7.3, 0.2, 9.9, 9.1)])
+        weights = compute_coverage_weights(geometry=geometry, transform=TRANSFORM, shape=(10, 10), supersample=5)
+        monkeypatch.setattr("coverage.MAX_SUBPIXELS_PER_STRIP", 10)
+        strip_weights = compute_coverage_weights(geometry=geometry, transform=TRANSFORM, shape=(10, 10), supersample=5)
+
+        assert (weights != strip_weights).nnz == 0
+
+    def test_weighted_mean_matches_aligned_zones(self, raster):
+        geometry = gpd.GeoDataFrame(geometry=[box(0, 0, 4, 4), box(4, 4, 10, 10)])
+        weights = compute_coverage_weights(geometry=geometry, transform=TRANSFORM, shape=(10, 10), supersample=4)
+        zones = rasterize_zones(geometry=geometry, transform=TRANSFORM, shape=(10, 10))
+
+        weighted = weighted_zonal_statistics(raster=raster, weights=weights, stats=["mean", "min", "max", "median", "count"])
+        unweighted = zonal_statistics(raster=raster, zones=zones, n_zones=2, stats=["mean", "min", "max", "median", "count"])
+
+        for stat in ["mean", "min", "max", "count"]:
+            np.testing.assert_allclose(weighted[stat], unweighted[stat])
+
+    def test_small_polygon_gets_value(self, raster):
+        geometry = gpd.GeoDataFrame(geometry=[box(3.6, 5.6, 3.9, 5.9)])
+        weights = compute_coverage_weights(geometry=geometry, transform=TRANSFORM, shape=(10, 10), supersample=10)
+        zones = rasterize_zones(geometry=geometry, transform=TRANSFORM, shape=(10, 10))
+
+        weighted = weighted_zonal_statistics(raster=raster, weights=weights, stats=["mean"])
+
+        assert zones.max() == 0
+        assert weighted["mean"][0] == raster[4, 3]
+
+    def test_nodata_is_excluded(self, raster):
+        geometry = gpd.GeoDataFrame(geometry=[box(2.5, 2, 4.5, 3)])
+        weights = compute_coverage_weights(geometry=geometry, transform=TRANSFORM, shape=(10, 10), supersample=4)
+        raster = raster.copy()
+        raster[7, 2] = -999
+
+        weighted = weighted_zonal_statistics(raster=raster, weights=weights, stats=["mean", "count", "median"], nodata=-999)
+
+        assert weighted["count"][0] == pytest.approx(1.5)
+        assert weighted["mean"][0] == pytest.approx((raster[7, 3] + 0.5 * raster[7, 4]) / 1.5)
+        assert weighted["median"][0] == raster[7, 3]
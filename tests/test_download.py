@@ -0,0 +1,128 @@
+import os
+import re
+import sys
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+sys.path.insert(0, "pipeline")
+from functions import read_raster, read_raster_window
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler that honours single HTTP Range requests and counts bytes sent"""
+
+    bytes_sent = 0
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        range_header = self.headers.get("Range")
+        if not os.path.isfile(path) or range_header is None:
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        start, end = re.match(r"bytes=(\d+)-(\d*)", range_header).groups()
+        start = int(start)
+        end = min(int(end) if end else size - 1, size - 1)
+
+        self.send_response(206)
+        self.send_header("Content-Type", "image/tiff")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        with open(path, "rb") as file:
+            file.seek(start)
+            content = file.read(end - start + 1)
+        RangeRequestHandler.bytes_sent += len(content)
+        self.wfile.write(content)
+        return None
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def synthetic_global_raster(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("chelsa")
+    location = directory / "synthetic_global.tif"
+    rng = np.random.default_rng(seed=0)
+    raster = rng.integers(-300, 400, size=(1, 2048, 4096), dtype=np.int16)
+    profile = {
+        "driver": "GTiff",
+        "dtype": "int16",
+        "count": 1,
+        "width": 4096,
+        "height": 2048,
+        "crs": "EPSG:4326",
+        "transform": from_origin(-180, 90, 360 / 4096, 180 / 2048),
+        "nodata": -32768,
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+    }
+    with rasterio.open(location, "w", **profile) as dest:
+        dest.write(raster)
+
+    return location, raster
+
+
+@pytest.fixture(scope="module")
+def raster_url(synthetic_global_raster):
+    location, _ = synthetic_global_raster
+    handler = partial(RangeRequestHandler, directory=str(location.parent))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_port}/{location.name}"
+
+    server.shutdown()
+
+
+class TestWindowedDownload:
+    def test_window_matches_full_raster(self, synthetic_global_raster, raster_url):
+        _, full_raster = synthetic_global_raster
+        raster, profile = read_raster_window(location=raster_url, bounds=(-20, 0, 20, 30), pad=0)
+
+        transform = profile["transform"]
+        col_off = round((transform.c + 180) / transform.a)
+        row_off = round((90 - transform.f) / -transform.e)
+
+        assert raster.shape == (1, profile["height"], profile["width"])
+        np.testing.assert_array_equal(
+            raster,
+            full_raster[:, row_off: row_off + profile["height"], col_off: col_off + profile["width"]],
+        )
+
+    def test_window_transfers_fraction_of_file(self, synthetic_global_raster, raster_url):
+        location, _ = synthetic_global_raster
+        RangeRequestHandler.bytes_sent = 0
+        read_raster_window(location=raster_url, bounds=(40, -30, 80, 0))
+
+        assert 0 < RangeRequestHandler.bytes_sent < os.path.getsize(location) / 10
+
+    def test_window_reprojects_bounds(self, raster_url):
+        raster, profile = read_raster_window(
+            location=raster_url,
+            bounds=(-2226389.8, 0, 2226389.8, 3503549.8),
+            bounds_crs="EPSG:3857",
+            pad=0,
+        )
+        assert profile["transform"].c == pytest.approx(-20, abs=360 / 4096)
+        assert raster.shape[2] == pytest.approx(40 / (360 / 4096), abs=2)
+
+    def test_bounds_outside_raster(self, raster_url):
+        with pytest.raises(ValueError):
+            read_raster_window(location=raster_url, bounds=(200, 100, 210, 110))
+
+    def test_full_read_from_url(self, synthetic_global_raster, raster_url):
+        _, full_raster = synthetic_global_raster
+        raster, _ = read_raster(location=raster_url)
+        np.testing.assert_array_equal(raster, full_raster)
@@ -0,0 +1,100 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, "pipeline")
+from climatology import Month, Product, Scenario, get_climatology
+from ensemble import calculate_ensemble_statistics, get_rcp, process_ensemble_statistics
+from session import get_session
+from store import get_partition_path, read_table, write_table
+import upload
+from tables import get_table
+from upload import upload_to_db
+
+
+def yearly_table(scenario, values):
+    return pd.DataFrame(
+        {
+            "iso2_code": ["GH", "GH"],
+            "adm2_id": ["GH1", "GH2"],
+            "product": "tmin",
+            "scenario": scenario.value,
+            "month": [1, 1],
+            "mean_value": values,
+            "unit": "celsius",
+        }
+    )
+
+
+@pytest.fixture
+def chelsa_product(tmp_path):
+    chelsa_product = get_climatology(product=Product.TMIN, scenario=Scenario.ACCESS1_0_rcp45, month=Month.JANUARY)
+    chelsa_product.yearly_aggregate_dir = tmp_path / "yearly"
+    chelsa_product.ensemble_dir = tmp_path / "ensemble"
+    return chelsa_product
+
+
+def write_yearly_table(chelsa_product, scenario, values):
+    write_table(
+        df=yearly_table(scenario, values),
+        path=get_partition_path(chelsa_product.yearly_aggregate_dir, "tmin", scenario.value),
+    )
+
+
+class TestEnsemble:
+    def test_rcp(self):
+        assert get_rcp(Scenario.BNU_ESM_rcp26) == "rcp26"
+
+    def test_statistics_are_grouped_by_rcp(self):
+        yearly_tables = pd.concat(
+            [
+                yearly_table(Scenario.ACCESS1_0_rcp45, [10.0, np.nan]),
+                yearly_table(Scenario.BNU_ESM_rcp45, [20.0, 5.0]),
+                yearly_table(Scenario.ACCESS1_0_rcp85, [30.0, 7.0]),
+            ]
+        )
+        ensembles = calculate_ensemble_statistics(yearly_tables=yearly_tables).set_index(["scenario", "adm2_id"])
+
+        rcp45 = ensembles.loc[("rcp45", "GH1")]
+        assert (rcp45["n_models"], rcp45["ensemble_mean"], rcp45["ensemble_std"]) == (2, 15.0, 5.0)
+        assert (rcp45["ensemble_p10"], rcp45["ensemble_median"]) == pytest.approx((11.0, 15.0))
+        # Missing model values are ignored
+        assert (ensembles.loc[("rcp45", "GH2"), "n_models"], ensembles.loc[("rcp45", "GH2"), "ensemble_mean"]) == (1, 5.0)
+        assert ensembles.loc[("rcp85", "GH1"), "ensemble_max"] == 30.0
+        assert (ensembles["unit"] == "celsius").all() and (ensembles["product"] == "tmin").all()
+
+    def test_only_changed_pathways_are_updated(self, chelsa_product):
+        write_yearly_table(chelsa_product, Scenario.ACCESS1_0_rcp45, [10.0, 12.0])
+        write_yearly_table(chelsa_product, Scenario.ACCESS1_0_rcp85, [30.0, 32.0])
+        assert [path.parent.name for path in process_ensemble_statistics(chelsa_product)] == [
+            "scenario=rcp45",
+            "scenario=rcp85",
+        ]
+        assert process_ensemble_statistics(chelsa_product) == []
+
+        # A yearly table whose build started before the ensemble was saved is backdated to that start
+        write_yearly_table(chelsa_product, Scenario.BNU_ESM_rcp45, [20.0, 14.0])
+        yearly_path = get_partition_path(chelsa_product.yearly_aggregate_dir, "tmin", Scenario.BNU_ESM_rcp45.value)
+        os.utime(yearly_path, ns=(0, 0))
+        (ensemble_path,) = process_ensemble_statistics(chelsa_product)
+
+        ensemble = read_table(ensemble_path)
+        assert ensemble["scenario"].unique().tolist() == ["rcp45"]
+        assert ensemble["n_models"].tolist() == [2, 2]
+        assert ensemble["ensemble_mean"].tolist() == [15.0, 13.0]
+
+    def test_ensemble_is_uploaded(self, chelsa_product, tmp_path, monkeypatch):
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/ensemble.db")
+        monkeypatch.setattr(upload, "_upload_hash_created", False)
+        with get_session() as Session:
+            with Session() as session:
+                get_table(table_name="tmin_ensemble").__table__.create(bind=session.connection())
+                session.commit()
+        write_yearly_table(chelsa_product, Scenario.ACCESS1_0_rcp45, [10.0, 12.0])
+        (ensemble_path,) = process_ensemble_statistics(chelsa_product)
+
+        result = upload_to_db(df_path=ensemble_path, table_name="tmin_ensemble")
+        assert (result.inserted, result.rejected) == (2, 0)
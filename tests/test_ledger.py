@@ -0,0 +1,154 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, "pipeline")
+import config
+import ledger
+import manifest
+from climatology import Month, Product, Scenario, get_climatology
+from ledger import (ALL_MONTHS, StepStatus, read_ledger, record_completed_step,
+                    track_step)
+from manifest import get_step_manifest, read_manifest
+from processing_steps import (RasterProcessingStep, get_step_outputs,
+                              plan_processing_steps)
+
+
+@pytest.fixture(autouse=True)
+def sqlite_ledger(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/ledger.db")
+    monkeypatch.setattr(ledger, "_ledger_created", False)
+
+    geom_path = tmp_path / "boundaries.geojson"
+    geom_path.write_text('{"type": "FeatureCollection", "features": []}')
+    monkeypatch.setattr(manifest.config, "geom_path", geom_path)
+    # Artefacts of the products are written under tmp_path
+    settings = config.read_config("config.json").copy(update={"root_dir": tmp_path})
+    monkeypatch.setattr(config, "read_config", lambda config_file: settings)
+
+
+@pytest.fixture
+def months():
+    return [get_climatology(product=Product.TMIN, scenario=Scenario.ACCESS1_0_rcp45, month=month) for month in Month]
+
+
+def succeed(chelsa_product, step, month=None):
+    output_paths = get_step_outputs(chelsa_product=chelsa_product, step=step)
+    for output_path in output_paths:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(f"{step.name} output")
+
+    record_completed_step(
+        chelsa_product=chelsa_product,
+        manifest=get_step_manifest(chelsa_product=chelsa_product, step=step.name),
+        output_paths=output_paths,
+        month=month,
+    )
+
+
+class TestRunLedger:
+    def test_empty_ledger_plans_every_monthly_step(self, months):
+        assert plan_processing_steps(chelsa_products=months[:1]) == [
+            [
+                RasterProcessingStep.DOWNLOAD,
+                RasterProcessingStep.MASK,
+                RasterProcessingStep.ZONAL_STATISTICS,
+                RasterProcessingStep.UPLOAD,
+            ]
+        ]
+
+    def test_succeeded_steps_are_skipped(self, months):
+        for step in [RasterProcessingStep.DOWNLOAD, RasterProcessingStep.MASK]:
+            succeed(months[0], step)
+        succeed(months[1], RasterProcessingStep.MASK)
+
+        planned = plan_processing_steps(chelsa_products=months[:2])
+
+        assert planned[0] == [RasterProcessingStep.ZONAL_STATISTICS, RasterProcessingStep.UPLOAD]
+        assert planned[1] == [
+            RasterProcessingStep.DOWNLOAD,
+            RasterProcessingStep.ZONAL_STATISTICS,
+            RasterProcessingStep.UPLOAD,
+        ]
+
+    def test_changed_settings_only_rerun_downstream_steps(self, months, monkeypatch):
+        for step in RasterProcessingStep:
+            succeed(months[0], step)
+        assert plan_processing_steps(chelsa_products=months[:1]) == [[]]
+
+        monkeypatch.setattr(manifest.config, "zonal_stats_aggregates", "min mean max median")
+        assert plan_processing_steps(chelsa_products=months[:1]) == [
+            [RasterProcessingStep.ZONAL_STATISTICS, RasterProcessingStep.UPLOAD]
+        ]
+
+        monkeypatch.setitem(manifest.STEP_VERSIONS, "MASK", 2)
+        assert plan_processing_steps(chelsa_products=months[:1]) == [
+            [RasterProcessingStep.MASK, RasterProcessingStep.ZONAL_STATISTICS, RasterProcessingStep.UPLOAD]
+        ]
+
+    def test_missing_or_changed_outputs_are_rebuilt(self, months):
+        for step in RasterProcessingStep:
+            succeed(months[0], step)
+        assert plan_processing_steps(chelsa_products=months[:1]) == [[]]
+
+        # Deleted, eg. by hand or never written on this host by a worker of another host
+        months[0].cropped_raster_path.unlink()
+        assert plan_processing_steps(chelsa_products=months[:1]) == [[RasterProcessingStep.MASK]]
+
+        succeed(months[0], RasterProcessingStep.MASK)
+        months[0].raw_raster_path.write_text("truncated")
+        assert plan_processing_steps(chelsa_products=months[:1]) == [[RasterProcessingStep.DOWNLOAD]]
+
+    def test_unchanged_outputs_are_not_read(self, months, monkeypatch):
+        for step in RasterProcessingStep:
+            succeed(months[0], step)
+        checksummed = []
+        file_checksum = ledger.file_checksum
+        monkeypatch.setattr(ledger, "file_checksum", lambda path: checksummed.append(path) or file_checksum(path))
+        monkeypatch.setattr(ledger, "_file_checksums", {})
+
+        assert plan_processing_steps(chelsa_products=months[:1]) == [[]]
+        assert checksummed == []
+
+        # Rewritten with the same contents: only this output is read, and it is still current
+        months[0].raw_raster_path.write_text(f"{RasterProcessingStep.DOWNLOAD.name} output")
+        os.utime(months[0].raw_raster_path, ns=(0, 0))
+        assert plan_processing_steps(chelsa_products=months[:1]) == [[]]
+        assert checksummed == [months[0].raw_raster_path]
+
+    def test_yearly_table_planned_once_for_last_month(self, months):
+        for chelsa_product in months[:-1]:
+            for step in RasterProcessingStep:
+                if step != RasterProcessingStep.YEARLY_TABLE:
+                    succeed(chelsa_product, step)
+
+        planned = plan_processing_steps(chelsa_products=months)
+
+        assert all(steps == [] for steps in planned[:-1])
+        assert RasterProcessingStep.YEARLY_TABLE in planned[-1]
+
+        for step in RasterProcessingStep:
+            succeed(months[-1], step)
+        succeed(months[-1], RasterProcessingStep.YEARLY_TABLE, month=ALL_MONTHS)
+        assert plan_processing_steps(chelsa_products=months) == [[] for _ in months]
+
+    def test_track_step(self, months, tmp_path):
+        output_path = tmp_path / "output.csv"
+        output_path.write_text("id\na\nb\n")
+
+        mask_manifest = get_step_manifest(chelsa_product=months[0], step="MASK")
+
+        with pytest.raises(RuntimeError):
+            with track_step(chelsa_product=months[0], manifest=mask_manifest):
+                raise RuntimeError("failed")
+        entry = read_ledger(chelsa_products=months[:1])[(Product.TMIN.value, Scenario.ACCESS1_0_rcp45.value, "1", "MASK")]
+        assert entry.status == StepStatus.FAILED
+
+        with track_step(chelsa_product=months[0], manifest=mask_manifest) as run:
+            run.output_paths = [output_path]
+            run.row_count = 2
+
+        entry = read_ledger(chelsa_products=months[:1])[(Product.TMIN.value, Scenario.ACCESS1_0_rcp45.value, "1", "MASK")]
+        assert entry.is_current(mask_manifest)
+        assert read_manifest(output_path)["fingerprint"] == mask_manifest.fingerprint
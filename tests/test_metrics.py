@@ -0,0 +1,92 @@
+import json
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, "pipeline")
+import metrics
+from metrics import (MetricsRegistry, export_metrics, format_prometheus,
+                     instrumented, measure)
+
+
+@pytest.fixture(autouse=True)
+def empty_registry(monkeypatch):
+    monkeypatch.setattr(metrics, "registry", MetricsRegistry())
+    monkeypatch.setattr(metrics.config, "metrics", True)
+    monkeypatch.setattr(metrics.config, "trace_memory", False)
+    monkeypatch.setattr(metrics.config, "profile_stages", [])
+
+
+class TestMetrics:
+    def test_measure_records_stage(self, tmp_path):
+        with measure("write") as stage:
+            (tmp_path / "file.bin").write_bytes(b"0" * 4096)
+            time.sleep(0.01)
+            stage.rows = 3
+
+        [record] = metrics.registry.records()
+        assert record.name == "write"
+        assert record.wall_seconds >= 0.01
+        assert record.rows == 3
+        assert record.peak_rss_bytes > 0
+        if record.bytes_written is not None:
+            assert record.bytes_written >= 4096
+
+    def test_summary_totals_calls(self):
+        @instrumented("square")
+        def square(x):
+            return x * x
+
+        assert [square(x) for x in range(3)] == [0, 1, 4]
+        with pytest.raises(ValueError):
+            with measure("failing"):
+                raise ValueError
+
+        summary = metrics.registry.summary()
+        assert summary["square"]["calls"] == 3
+        assert summary["failing"]["calls"] == 1
+
+    def test_trace_memory(self, monkeypatch):
+        monkeypatch.setattr(metrics.config, "trace_memory", True)
+        with measure("allocate"):
+            with measure("inner"):
+                buffer = bytearray(8 * 1024 * 1024)
+            del buffer
+
+        records = {record.name: record for record in metrics.registry.records()}
+        assert records["allocate"].tracemalloc_peak_bytes >= 8 * 1024 * 1024
+        assert records["inner"].tracemalloc_peak_bytes >= 8 * 1024 * 1024
+
+    def test_disabled(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(metrics.config, "metrics", False)
+        with measure("ignored"):
+            pass
+
+        assert metrics.registry.records() == []
+        assert export_metrics(metrics_dir=tmp_path) is None
+
+    def test_export(self, tmp_path):
+        with measure("ZONAL_STATISTICS") as stage:
+            stage.rows = 10
+
+        report_path = export_metrics(run_name="test", metrics_dir=tmp_path)
+
+        report = json.loads(report_path.read_text())
+        assert report["stages"]["ZONAL_STATISTICS"]["rows"] == 10
+        assert len(report["calls"]) == 1
+
+        textfile = (tmp_path / "test.prom").read_text()
+        assert "# TYPE pipeline_stage_rows_total counter" in textfile
+        assert 'pipeline_stage_rows_total{run="test",stage="ZONAL_STATISTICS"} 10' in textfile
+        assert 'pipeline_stage_peak_rss_bytes{run="test",stage="ZONAL_STATISTICS"}' in textfile
+
+    def test_format_prometheus(self):
+        summary = {"UPLOAD": {"calls": 2, "wall_seconds": 1.5, "cpu_seconds": 0.5, "bytes_read": 0,
+                              "bytes_written": 0, "rows": 20, "peak_rss_bytes": 1024,
+                              "tracemalloc_peak_bytes": 0}}
+        lines = format_prometheus(summary=summary, run_name="run").splitlines()
+
+        assert 'pipeline_stage_calls_total{run="run",stage="UPLOAD"} 2' in lines
+        assert 'pipeline_stage_wall_seconds_total{run="run",stage="UPLOAD"} 1.5' in lines
+        assert len(lines) == 8 * 3
@@ -0,0 +1,43 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, "pipeline")
+from functions import calculate_zonal_statistics
+from parallel_zonal import balance_chunks
+from tests.test_zonal_engine import chelsa_product, synthetic_geometry, synthetic_raster
+
+
+class TestParallelZonal:
+    def test_balance_chunks(self):
+        pixel_counts = np.array([100, 1, 1, 1, 50, 50, 1, 1])
+        chunks = balance_chunks(pixel_counts=pixel_counts, n_chunks=2)
+        loads = [pixel_counts[chunk].sum() for chunk in chunks]
+
+        assert sorted(position for chunk in chunks for position in chunk) == list(range(8))
+        assert max(loads) - min(loads) <= 2
+
+    def test_more_chunks_than_rows(self):
+        assert len(balance_chunks(pixel_counts=np.array([1, 2]), n_chunks=8)) == 2
+
+    def test_parity_with_rasterstats(self, synthetic_raster, synthetic_geometry, chelsa_product):
+        stats = "count min mean max median"
+        rasterstats_results = calculate_zonal_statistics(
+            raster_location=synthetic_raster,
+            geometry=synthetic_geometry.copy(),
+            chelsa_product=chelsa_product,
+            place_id="adm2_id",
+            provided_stats=stats,
+            engine="rasterstats",
+        )
+        parallel_results = calculate_zonal_statistics(
+            raster_location=synthetic_raster,
+            geometry=synthetic_geometry.copy(),
+            chelsa_product=chelsa_product,
+            place_id="adm2_id",
+            provided_stats=stats,
+            engine="parallel",
+        )
+
+        pd.testing.assert_frame_equal(rasterstats_results, parallel_results)
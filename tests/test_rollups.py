@@ -0,0 +1,144 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+
+sys.path.insert(0, "pipeline")
+import functions
+from cube import _accumulate_band
+from functions import calculate_zonal_statistics
+from rollups import calculate_rollups, split_rollups
+from streaming import (ZonalAccumulator, accumulate_zonal_statistics,
+                       histogram_bin_edges)
+from tests.test_zonal_engine import TRANSFORM, chelsa_product, synthetic_geometry, synthetic_raster
+from zonal_engine import rasterize_zones
+
+STATS = ["count", "sum", "min", "max", "mean", "median"]
+
+
+@pytest.fixture(scope="module")
+def admin_geometry(synthetic_geometry):
+    # Uneven admin 1 areas, so the mean of their admin 2 means is not the mean of their pixels
+    return synthetic_geometry.assign(
+        adm0_name=synthetic_geometry["iso2_code"].map({"AA": "Aland", "BB": "Bland"}),
+        adm1_id=["AA1"] * 3 + ["AA2"] * 12 + ["BB1"] * (len(synthetic_geometry) - 15),
+    )
+
+
+class TestRollups:
+    def test_rollup_matches_parent_zones(self):
+        rng = np.random.default_rng(seed=5)
+        raster = rng.integers(-20, 20, size=(30, 30))
+        zones = rng.integers(0, 7, size=(30, 30))
+        parents = np.array([0, 0, 1, 1, 1, -1])
+        bin_edges = histogram_bin_edges((-20, 20), n_bins=64)
+
+        children = ZonalAccumulator(n_zones=6, bin_edges=bin_edges)
+        children.update(raster=raster, zones=zones)
+        expected = ZonalAccumulator(n_zones=2, bin_edges=bin_edges)
+        expected.update(raster=raster, zones=np.where(zones > 0, parents[zones - 1] + 1, 0))
+
+        rolled = children.rollup(parents=parents, n_parents=2)
+        for stat, values in expected.statistics(STATS).items():
+            np.testing.assert_allclose(rolled.statistics(STATS)[stat], values)
+
+    def test_rollups_are_pixel_statistics(self, synthetic_raster, admin_geometry, chelsa_product):
+        results = calculate_zonal_statistics(
+            raster_location=synthetic_raster,
+            geometry=admin_geometry.copy(),
+            chelsa_product=chelsa_product,
+            place_id="adm2_id",
+            provided_stats="mean median min max",
+            engine="vectorized",
+            rollup_levels=["adm1", "adm0"],
+        )
+        assert results["level"].value_counts().to_dict() == {"adm2": len(admin_geometry), "adm1": 3, "adm0": 2}
+
+        with rasterio.open(synthetic_raster) as src:
+            raster = src.read(1)
+        zones = rasterize_zones(geometry=admin_geometry, transform=TRANSFORM, shape=raster.shape)
+        adm1 = results[results["level"] == "adm1"].set_index("adm1_id")
+        for adm1_id in ["AA1", "AA2", "BB1"]:
+            zone_ids = np.flatnonzero(admin_geometry["adm1_id"] == adm1_id) + 1
+            values = raster[np.isin(zones, zone_ids) & (raster != -999)]
+
+            assert adm1.loc[adm1_id, "pixel_count"] == len(values)
+            assert adm1.loc[adm1_id, "mean_raw"] == pytest.approx(values.mean())
+            assert adm1.loc[adm1_id, "median_raw"] == np.median(values)
+            assert adm1.loc[adm1_id, "max_value"] == pytest.approx(values.max() * 0.1)
+
+        admin2 = results[results["level"] == "adm2"]
+        adm0 = results[results["level"] == "adm0"].set_index("iso2_code")
+        assert adm0.loc["AA", "mean_raw"] != pytest.approx(admin2.loc[admin2["iso2_code"] == "AA", "mean_raw"].mean())
+        assert adm0.loc["AA", "adm0_name"] == "Aland"
+
+    def test_admin2_statistics_unchanged(self, synthetic_raster, admin_geometry, chelsa_product):
+        arguments = dict(
+            raster_location=synthetic_raster,
+            chelsa_product=chelsa_product,
+            place_id="adm2_id",
+            provided_stats="mean median min max",
+            engine="vectorized",
+        )
+        expected = calculate_zonal_statistics(geometry=admin_geometry.copy(), **arguments)
+        admin2, rollups = split_rollups(
+            calculate_zonal_statistics(geometry=admin_geometry.copy(), rollup_levels=["adm1", "adm0"], **arguments)
+        )
+
+        pd.testing.assert_frame_equal(pd.DataFrame(admin2), pd.DataFrame(expected), check_dtype=False)
+        assert "adm2_id" not in rollups and set(rollups["level"]) == {"adm1", "adm0"}
+        assert rollups["pixel_count"].dtype == "int64"
+
+    def test_admin2_statistics_come_from_the_engine(self, synthetic_raster, admin_geometry, chelsa_product, monkeypatch):
+        # Too few bins for exact histogram medians
+        monkeypatch.setattr(functions.config, "histogram_bins", 4)
+        arguments = dict(
+            raster_location=synthetic_raster,
+            chelsa_product=chelsa_product,
+            place_id="adm2_id",
+            provided_stats="median",
+            engine="vectorized",
+        )
+        expected = calculate_zonal_statistics(geometry=admin_geometry.copy(), **arguments)
+        admin2, rollups = split_rollups(
+            calculate_zonal_statistics(geometry=admin_geometry.copy(), rollup_levels=["adm0"], **arguments)
+        )
+
+        pd.testing.assert_series_equal(admin2["median_raw"], expected["median_raw"], check_dtype=False)
+        assert len(rollups) == 2
+
+    def test_engines_without_aggregates_skip_rollups(self, synthetic_raster, admin_geometry, chelsa_product):
+        results = calculate_zonal_statistics(
+            raster_location=synthetic_raster,
+            geometry=admin_geometry.copy(),
+            chelsa_product=chelsa_product,
+            place_id="adm2_id",
+            provided_stats="mean",
+            engine="rasterstats",
+            rollup_levels=["adm0"],
+        )
+
+        assert "level" not in results
+        assert len(results) == len(admin_geometry)
+
+    def test_cube_rollups_match_monthly_rollups(self, synthetic_raster, admin_geometry, chelsa_product):
+        with rasterio.open(synthetic_raster) as src:
+            raster = src.read(1)
+        zones = rasterize_zones(geometry=admin_geometry, transform=TRANSFORM, shape=raster.shape)
+        attributes = pd.DataFrame(admin_geometry.drop(columns=["geometry"]))
+        arguments = dict(geometry=attributes, chelsa_product=chelsa_product, stats_list=STATS, levels=["adm1", "adm0"])
+
+        cube_rollups = calculate_rollups(
+            accumulator=_accumulate_band(
+                band=raster, zones=zones, n_zones=len(admin_geometry), stats_list=STATS, nodata=-999, source_nodata=-999
+            ),
+            **arguments,
+        )
+        monthly_rollups = calculate_rollups(
+            accumulator=accumulate_zonal_statistics(raster_location=synthetic_raster, geometry=admin_geometry),
+            **arguments,
+        )
+
+        pd.testing.assert_frame_equal(cube_rollups, monthly_rollups)
@@ -0,0 +1,87 @@
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, "pipeline")
+from climatology import Month, Product, Scenario, get_climatology
+from processing_steps import RasterProcessingStep
+from scheduler import build_job_graph, run_job_graph
+
+MONTHLY = [
+    RasterProcessingStep.DOWNLOAD,
+    RasterProcessingStep.MASK,
+    RasterProcessingStep.ZONAL_STATISTICS,
+]
+STAGE_WORKERS = {"network": 2, "cpu": 2, "database": 1}
+
+
+def succeed(chelsa_product, step):
+    time.sleep(0.01)
+
+
+def fail_march_masks(chelsa_product, step):
+    if step == RasterProcessingStep.MASK and chelsa_product.month == Month.MARCH:
+        raise RuntimeError("mask failed")
+
+
+@pytest.fixture
+def months():
+    return [get_climatology(product=Product.TMIN, scenario=Scenario.ACCESS1_0_rcp45, month=month) for month in Month]
+
+
+@pytest.fixture
+def jobs(months):
+    planned_steps = [MONTHLY + [RasterProcessingStep.UPLOAD] for _ in months]
+    planned_steps[-1].insert(3, RasterProcessingStep.YEARLY_TABLE)
+    return build_job_graph(chelsa_products=months, planned_steps=planned_steps)
+
+
+class TestScheduler:
+    def test_job_graph(self, jobs):
+        assert len(jobs) == 12 * 4 + 1
+
+        yearly = next(job for job in jobs.values() if job.step == RasterProcessingStep.YEARLY_TABLE)
+        assert len(yearly.dependencies) == 12
+        assert all(dependency[3] == "ZONAL_STATISTICS" for dependency in yearly.dependencies)
+
+        upload = next(job for job in jobs.values() if job.step == RasterProcessingStep.UPLOAD)
+        assert upload.dependencies == {(*upload.id[:3], "ZONAL_STATISTICS")}
+
+    def test_already_succeeded_steps_are_not_waited_for(self, months):
+        jobs = build_job_graph(
+            chelsa_products=months[:1],
+            planned_steps=[[RasterProcessingStep.ZONAL_STATISTICS, RasterProcessingStep.UPLOAD]],
+        )
+        zonal, upload = jobs.values()
+        assert zonal.dependencies == set()
+        assert upload.dependencies == {zonal.id}
+
+    def test_run_all(self, jobs):
+        report = run_job_graph(jobs=jobs, stage_workers=STAGE_WORKERS, runner=succeed)
+
+        assert report.succeeded
+        assert "UPLOAD                    12" in report.summary()
+
+    def test_continue_skips_dependents(self, jobs):
+        report = run_job_graph(
+            jobs=jobs, stage_workers=STAGE_WORKERS, failure_policy="continue", runner=fail_march_masks
+        )
+        statuses = {result.job.id: result.status for result in report.results}
+        march = ("tmin", "ACCESS1-0_rcp45", "3")
+
+        assert statuses[(*march, "MASK")] == "failed"
+        assert statuses[(*march, "ZONAL_STATISTICS")] == "skipped"
+        assert statuses[(*march, "UPLOAD")] == "skipped"
+        assert statuses[("tmin", "ACCESS1-0_rcp45", "all", "YEARLY_TABLE")] == "skipped"
+        assert statuses[("tmin", "ACCESS1-0_rcp45", "4", "UPLOAD")] == "succeeded"
+
+    def test_fail_fast_cancels_remaining_jobs(self, jobs):
+        report = run_job_graph(
+            jobs=jobs, stage_workers=STAGE_WORKERS, failure_policy="fail_fast", runner=fail_march_masks
+        )
+        statuses = [result.status for result in report.results]
+
+        assert statuses.count("failed") == 1
+        assert "cancelled" in statuses
+        assert "FAILED tmin_ACCESS1-0_rcp45_3_MASK" in report.summary()
@@ -0,0 +1,39 @@
+import multiprocessing
+import sys
+
+sys.path.insert(0, "pipeline")
+import session
+from session import get_engine, get_session
+from sqlalchemy import text
+
+
+def engine_id_in_child(queue, parent_engine_id):
+    queue.put(id(get_engine()) != parent_engine_id)
+
+
+class TestSession:
+    def test_engine_is_reused(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/first.db")
+        engine = get_engine()
+        with get_session() as Session:
+            with Session() as db_session:
+                assert db_session.execute(text("SELECT 1")).scalar() == 1
+                assert db_session.get_bind() is engine
+        assert get_engine() is engine
+
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/second.db")
+        assert get_engine() is not engine
+
+    def test_forked_process_creates_its_own_engine(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/fork.db")
+        parent_engine = get_engine()
+
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        child = context.Process(target=engine_id_in_child, args=(queue, id(parent_engine)))
+        child.start()
+        child.join(timeout=30)
+
+        assert queue.get(timeout=5)
+        assert get_engine() is parent_engine
+        assert session._engines[f"sqlite:///{tmp_path}/fork.db"] is parent_engine
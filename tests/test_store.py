@@ -0,0 +1,71 @@
+import sys
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+sys.path.insert(0, "pipeline")
+from store import count_rows, get_partition_path, read_table, write_table
+
+
+def write_month(dataset_dir, product, scenario, month):
+    write_table(
+        df=pd.DataFrame(
+            {
+                "adm0_name": ["Ghana", "Ghana", "Togo"],
+                "adm2_id": ["GH1", "GH2", "TG1"],
+                "mean_raw": [1.5, 2.5, 3.5],
+                "product": product,
+                "scenario": scenario,
+                "month": str(month),
+                "id": ["a", "b", "c"],
+            }
+        ),
+        path=get_partition_path(dataset_dir=dataset_dir, product=product, scenario=scenario, month=month),
+    )
+
+
+class TestStore:
+    def test_partition_path(self, tmp_path):
+        assert get_partition_path(tmp_path, "tmin", "ACCESS1-0_rcp45", 4) == (
+            tmp_path / "product=tmin" / "scenario=ACCESS1-0_rcp45" / "month=4" / "part-0.parquet"
+        )
+        assert get_partition_path(tmp_path, "tmin", "ACCESS1-0_rcp45").parent.name == "scenario=ACCESS1-0_rcp45"
+
+    def test_compact_schema(self, tmp_path):
+        write_month(tmp_path, "tmin", "ACCESS1-0_rcp45", 4)
+        path = get_partition_path(tmp_path, "tmin", "ACCESS1-0_rcp45", 4)
+        schema = pq.read_schema(path)
+
+        # Partition columns are in the directory names, and the id is derived from other columns
+        assert schema.names == ["adm0_name", "adm2_id", "mean_raw"]
+        assert str(schema.field("adm0_name").type) == "dictionary<values=string, indices=int32, ordered=0>"
+        assert str(schema.field("mean_raw").type) == "float"
+        assert count_rows(path) == 3
+
+    def test_read_partition_file_restores_partition_columns(self, tmp_path):
+        write_month(tmp_path, "tmin", "ACCESS1-0_rcp45", 4)
+        df = read_table(get_partition_path(tmp_path, "tmin", "ACCESS1-0_rcp45", 4), decode_dictionaries=True)
+
+        assert df[["product", "scenario", "month"]].drop_duplicates().values.tolist() == [["tmin", "ACCESS1-0_rcp45", 4]]
+        assert df["adm2_id"].tolist() == ["GH1", "GH2", "TG1"]
+
+    def test_read_dataset_with_filters(self, tmp_path):
+        for product in ["tmin", "prec"]:
+            for month in [1, 2, 3]:
+                write_month(tmp_path, product, "ACCESS1-0_rcp45", month)
+
+        df = read_table(tmp_path, columns=["adm2_id", "month"], product="tmin", month=[2, 3])
+
+        assert len(df) == 6
+        assert sorted(df["month"].unique()) == [2, 3]
+        assert read_table(tmp_path, product="bio").empty
+
+    def test_yearly_table_round_trip(self, tmp_path):
+        for month in [1, 2]:
+            write_month(tmp_path / "zonal", "tmin", "ACCESS1-0_rcp45", month)
+        yearly_path = get_partition_path(tmp_path / "yearly", "tmin", "ACCESS1-0_rcp45")
+        write_table(df=read_table(tmp_path / "zonal", product="tmin"), path=yearly_path)
+
+        yearly = read_table(tmp_path / "yearly", month=2)
+        assert len(yearly) == 3
+        assert (yearly["product"] == "tmin").all()
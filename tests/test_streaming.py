@@ -0,0 +1,112 @@
+import sys
+
+import numpy as np
+import pytest
+import rasterio
+
+sys.path.insert(0, "pipeline")
+from functions import crop_raster_with_geometry
+from streaming import (ZonalAccumulator, accumulate_zonal_statistics,
+                       fit_histogram_bins, histogram_bin_edges, iter_row_windows,
+                       stream_crop_raster, stream_zonal_statistics)
+from tests.test_zonal_engine import TRANSFORM, synthetic_geometry, synthetic_raster
+from zonal_engine import rasterize_zones, zonal_statistics
+
+STATS = ["count", "sum", "min", "max", "mean", "median"]
+
+
+class TestStreaming:
+    def test_row_windows_cover_raster(self):
+        windows = list(iter_row_windows(height=1000, width=100, bytes_per_pixel=8, memory_budget_mb=0.1, block_height=16))
+
+        assert sum(window.height for window in windows) == 1000
+        assert all(window.height % 16 == 0 for window in windows[:-1])
+        assert len(windows) > 1
+
+    def test_streamed_statistics_match_in_memory(self, synthetic_raster, synthetic_geometry):
+        streamed = stream_zonal_statistics(
+            raster_location=synthetic_raster,
+            geometry=synthetic_geometry,
+            stats_list=STATS,
+            # Exact medians need one bin per value: the accumulator takes about a third of the budget
+            memory_budget_mb=1,
+        )
+
+        with rasterio.open(synthetic_raster) as src:
+            raster = src.read(1)
+        zones = rasterize_zones(geometry=synthetic_geometry, transform=TRANSFORM, shape=raster.shape)
+        expected = zonal_statistics(raster=raster, zones=zones, n_zones=len(synthetic_geometry), stats=STATS, nodata=-999)
+
+        for stat in STATS:
+            np.testing.assert_allclose(streamed[stat], expected[stat])
+
+    def test_histogram_bins_fit_memory_budget(self, synthetic_raster, synthetic_geometry):
+        assert fit_histogram_bins(n_zones=100, n_bins=2048, budget_bytes=1024 * 1024 * 1024) == 2048
+        n_bins = fit_histogram_bins(n_zones=5000, n_bins=2048, budget_bytes=64 * 1024 * 1024)
+        assert ZonalAccumulator.estimate_nbytes(n_zones=5000, n_bins=n_bins) <= 64 * 1024 * 1024 < (
+            ZonalAccumulator.estimate_nbytes(n_zones=5000, n_bins=n_bins + 1)
+        )
+
+        accumulator = accumulate_zonal_statistics(
+            raster_location=synthetic_raster, geometry=synthetic_geometry, memory_budget_mb=0.1, n_bins=2048
+        )
+        expected = stream_zonal_statistics(
+            raster_location=synthetic_raster, geometry=synthetic_geometry, stats_list=["mean"], memory_budget_mb=0.1
+        )
+        assert ZonalAccumulator.estimate_nbytes(n_zones=len(synthetic_geometry), n_bins=accumulator.n_bins) <= 0.05 * 1024 * 1024
+        np.testing.assert_allclose(accumulator.statistics(["mean"])["mean"], expected["mean"])
+
+    def test_file_nodata_is_left_out(self, synthetic_geometry, tmp_path):
+        rng = np.random.default_rng(seed=7)
+        raster = rng.integers(-300, 400, size=(1, 300, 400), dtype=np.int16)
+        raster[0, rng.random((300, 400)) < 0.05] = -32768
+        location = tmp_path / "nodata.tif"
+        profile = dict(driver="GTiff", dtype="int16", count=1, width=400, height=300, crs="EPSG:4326", transform=TRANSFORM)
+        with rasterio.open(location, "w", nodata=-32768, **profile) as dest:
+            dest.write(raster)
+
+        streamed = stream_zonal_statistics(
+            raster_location=location, geometry=synthetic_geometry, stats_list=STATS, memory_budget_mb=1
+        )
+        zones = rasterize_zones(geometry=synthetic_geometry, transform=TRANSFORM, shape=raster.shape[1:])
+        expected = zonal_statistics(raster=raster, zones=zones, n_zones=len(synthetic_geometry), stats=STATS, nodata=-32768)
+
+        for stat in STATS:
+            np.testing.assert_allclose(streamed[stat], expected[stat])
+
+    def test_coarse_histogram_median_is_close(self):
+        rng = np.random.default_rng(seed=3)
+        raster = rng.integers(0, 10000, size=(50, 50))
+        zones = np.ones((50, 50), dtype=np.uint16)
+        accumulator = ZonalAccumulator(n_zones=1, bin_edges=histogram_bin_edges((0, 9999), n_bins=100))
+        accumulator.update(raster=raster, zones=zones)
+
+        assert accumulator.statistics(["median"])["median"][0] == pytest.approx(np.median(raster), abs=100)
+
+    def test_merged_accumulators_match_single(self):
+        rng = np.random.default_rng(seed=4)
+        raster = rng.integers(-20, 20, size=(30, 30))
+        zones = rng.integers(0, 4, size=(30, 30))
+        bin_edges = histogram_bin_edges((-20, 20), n_bins=64)
+
+        whole = ZonalAccumulator(n_zones=3, bin_edges=bin_edges)
+        whole.update(raster=raster, zones=zones)
+        top = ZonalAccumulator(n_zones=3, bin_edges=bin_edges)
+        top.update(raster=raster[:10], zones=zones[:10])
+        bottom = ZonalAccumulator(n_zones=3, bin_edges=bin_edges)
+        bottom.update(raster=raster[10:], zones=zones[10:])
+        top.merge(bottom)
+
+        for stat, values in whole.statistics(STATS).items():
+            np.testing.assert_allclose(top.statistics(STATS)[stat], values)
+
+    def test_streamed_crop_matches_in_memory(self, synthetic_raster, synthetic_geometry, tmp_path):
+        subset = synthetic_geometry.iloc[[3, 8, 9, 28]]
+        raster, profile = crop_raster_with_geometry(raster_location=synthetic_raster, gdf=subset)
+
+        stream_crop_raster(
+            raster_location=synthetic_raster, gdf=subset, out_path=tmp_path / "masked.tif", memory_budget_mb=0.01
+        )
+        with rasterio.open(tmp_path / "masked.tif") as src:
+            np.testing.assert_array_equal(src.read(), raster)
+            assert src.transform == profile["transform"]
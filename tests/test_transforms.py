@@ -0,0 +1,47 @@
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, "pipeline")
+from climatology import Month, Product, Scenario, get_climatology
+from transforms import TRANSFORMS, Transform, apply_transforms, get_transform
+
+
+def zonal_statistics():
+    return pd.DataFrame({"adm2_id": ["GH1", "GH2"], "mean_raw": [253.0, -12.0], "max_raw": [301.0, None]})
+
+
+class TestTransforms:
+    @pytest.mark.parametrize("product", [Product.TEMP, Product.TMIN, Product.TMAX])
+    def test_temperatures_are_converted_to_celsius(self, product):
+        chelsa_product = get_climatology(product=product, scenario=Scenario.ACCESS1_0_rcp45, month=Month.APRIL)
+        df = apply_transforms(chelsa_product=chelsa_product, df=zonal_statistics())
+
+        assert df["mean_value"].tolist() == pytest.approx([25.3, -1.2])
+        assert df["max_value"].iloc[0] == pytest.approx(30.1)
+        assert df["max_value"].isna().iloc[1]
+        assert (df["unit"] == "celsius").all()
+
+    def test_precipitation_is_in_millimetres(self):
+        chelsa_product = get_climatology(product=Product.PREC, scenario=Scenario.ACCESS1_0_rcp45, month=Month.APRIL)
+        df = apply_transforms(chelsa_product=chelsa_product, df=zonal_statistics())
+
+        assert df["mean_value"].tolist() == [253.0, -12.0]
+        assert (df["unit"] == "mm").all()
+
+    def test_counts_are_not_converted(self, monkeypatch):
+        monkeypatch.setitem(TRANSFORMS, Product.TMIN, Transform(unit="kelvin", scale=0.1, offset=-273.15))
+        chelsa_product = get_climatology(product=Product.TMIN, scenario=Scenario.ACCESS1_0_rcp45, month=Month.APRIL)
+        df = apply_transforms(
+            chelsa_product=chelsa_product, df=zonal_statistics().assign(count_raw=[12, 0], sum_raw=[3036.0, -24.0])
+        )
+
+        assert "count_value" not in df
+        assert df["sum_value"].tolist() == pytest.approx([303.6, -2.4])
+        assert df["mean_value"].tolist() == pytest.approx([25.3 - 273.15, -1.2 - 273.15])
+
+    def test_bioclimatic_variables_have_their_own_units(self):
+        assert get_transform(product=Product.BIO, month=Month.JANUARY).unit == "celsius"
+        assert get_transform(product=Product.BIO, month=Month.APRIL).scale == 0.01
+        assert get_transform(product=Product.BIO, month=Month.DECEMBER).unit == "mm"
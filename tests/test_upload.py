@@ -0,0 +1,130 @@
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, "pipeline")
+from partitions import get_partition_name
+from session import get_session
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+from store import get_partition_path, read_table, write_table
+import upload
+from tables import get_table
+from upload import upload_to_db
+
+
+@pytest.fixture(autouse=True)
+def sqlite_database(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/upload.db")
+    monkeypatch.setattr(upload, "_upload_hash_created", False)
+    with get_session() as Session:
+        with Session() as session:
+            get_table(table_name="prec").__table__.create(bind=session.connection())
+            session.commit()
+
+
+def write_zonal_statistics(path, mean_raw):
+    write_table(
+        df=pd.DataFrame(
+            {
+                "iso2_code": ["AA", "AA", "BB", "CCC"],
+                "adm2_id": ["AA1", "AA2", None, "CC1"],
+                "mean_raw": mean_raw,
+                "product": "prec",
+                "scenario": "ACCESS1-0_rcp45",
+                "month": "1",
+                "id": ["prec_1_AA1", "prec_1_AA2", "prec_1_BB1", "prec_1_CC1"],
+            }
+        ),
+        path=path,
+    )
+
+
+@pytest.fixture
+def df_path(tmp_path):
+    return get_partition_path(dataset_dir=tmp_path, product="prec", scenario="ACCESS1-0_rcp45", month=1)
+
+
+def read_prec_table():
+    table = get_table(table_name="prec").__table__
+    with get_session() as Session:
+        with Session() as session:
+            return dict(session.execute(select(table.c.adm2_id, table.c.mean_raw)).all())
+
+
+class TestUpload:
+    def test_invalid_rows_are_rejected(self, df_path):
+        write_zonal_statistics(df_path, mean_raw=[10.0, 20.0, 30.0, 40.0])
+
+        result = upload_to_db(df_path=df_path, table_name="prec")
+
+        assert (result.inserted, result.updated, result.rejected) == (2, 0, 2)
+        assert read_prec_table() == {"AA1": 10.0, "AA2": 20.0}
+        assert len(pd.read_csv(f"{df_path}.rejected.csv")) == 2
+
+    def test_unknown_scenario_is_rejected(self, tmp_path):
+        df_path = get_partition_path(dataset_dir=tmp_path, product="prec", scenario="unknown", month=1)
+        write_zonal_statistics(df_path, mean_raw=[10.0, 20.0, 30.0, 40.0])
+
+        result = upload_to_db(df_path=df_path, table_name="prec")
+
+        assert (result.inserted, result.rejected) == (0, 4)
+        assert read_prec_table() == {}
+
+    def test_reupload_updates_rows(self, df_path):
+        write_zonal_statistics(df_path, mean_raw=[10.0, 20.0, 30.0, 40.0])
+        assert upload_to_db(df_path=df_path, table_name="prec").inserted == 2
+
+        write_zonal_statistics(df_path, mean_raw=[11.0, None, 30.0, 40.0])
+        result = upload_to_db(df_path=df_path, table_name="prec")
+
+        assert (result.inserted, result.updated, result.rows) == (0, 2, 2)
+        assert read_prec_table() == {"AA1": 11.0, "AA2": None}
+
+    def test_only_changed_rows_are_written(self, df_path):
+        write_zonal_statistics(df_path, mean_raw=[10.0, 20.0, 30.0, 40.0])
+        upload_to_db(df_path=df_path, table_name="prec")
+
+        result = upload_to_db(df_path=df_path, table_name="prec")
+        assert (result.inserted, result.updated, result.unchanged) == (0, 0, 2)
+
+        write_zonal_statistics(df_path, mean_raw=[10.0, 25.0, 30.0, 40.0])
+        result = upload_to_db(df_path=df_path, table_name="prec")
+        assert (result.inserted, result.updated, result.unchanged) == (0, 1, 1)
+        assert read_prec_table() == {"AA1": 10.0, "AA2": 25.0}
+
+    def test_unchanged_month_is_skipped(self, df_path, monkeypatch):
+        write_zonal_statistics(df_path, mean_raw=[10.0, 20.0, 30.0, 40.0])
+        upload_to_db(df_path=df_path, table_name="prec")
+
+        def fail(*args, **kwargs):
+            raise AssertionError("rows written")
+
+        monkeypatch.setattr(upload, "_batch_upsert", fail)
+        result = upload_to_db(df_path=df_path, table_name="prec")
+        assert (result.rows, result.unchanged) == (0, 2)
+
+    def test_replace_mode_replaces_month(self, df_path):
+        write_zonal_statistics(df_path, mean_raw=[10.0, 20.0, 30.0, 40.0])
+        upload_to_db(df_path=df_path, table_name="prec")
+
+        write_table(df=read_table(path=df_path).iloc[[0]].assign(mean_raw=15.0), path=df_path)
+        result = upload_to_db(df_path=df_path, table_name="prec", mode="replace")
+
+        assert (result.inserted, result.updated) == (1, 0)
+        assert read_prec_table() == {"AA1": 15.0}
+
+
+class TestPartitions:
+    def test_partition_names(self):
+        assert get_partition_name("tmin", "ACCESS1-0_rcp45") == "tmin_access1_0_rcp45"
+        assert get_partition_name("tmin", "BNU-ESM_rcp26", "12") == "tmin_bnu_esm_rcp26_m12"
+
+    def test_product_tables_are_partitioned_on_postgres(self):
+        table = get_table(table_name="tmin").__table__
+        ddl = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+
+        assert "PARTITION BY LIST (scenario)" in ddl
+        assert "PRIMARY KEY (adm2_id, scenario, month)" in ddl
@@ -0,0 +1,70 @@
+import sys
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+sys.path.insert(0, "pipeline")
+import vector_processing
+from vector_processing import COLUMN_MAPPING, get_geometry, load_geometry
+
+DROPPED_COLUMNS = ['OBJECTID_1', 'Shape_Leng', 'Shape_Area', 'validOn', 'validTo', 'last_modif', 'source', 'date']
+
+
+@pytest.fixture
+def geom_path(tmp_path):
+    geometries = [box(col, row, col + 1, row + 1) for row in range(3) for col in range(4)]
+    raw_geometry = gpd.GeoDataFrame(
+        {
+            "ADMIN0PCOD": ["AA"] * len(geometries),
+            "ADMIN2PCOD": [f"ADM{i}" for i in range(len(geometries))],
+            **{column: [0] * len(geometries) for column in DROPPED_COLUMNS},
+        },
+        geometry=geometries,
+        crs="EPSG:4326",
+    )
+    path = tmp_path / "boundaries.geojson"
+    raw_geometry.to_file(path, driver="GeoJSON")
+    return path
+
+
+class TestLoadGeometry:
+    def test_matches_get_geometry(self, geom_path, tmp_path):
+        geometry = load_geometry(geom_path=geom_path, cache_dir=tmp_path / "cache")
+        expected = get_geometry(geom_path=geom_path, column_mapping=COLUMN_MAPPING)
+
+        assert list(geometry.columns) == list(expected.columns)
+        assert geometry.crs == expected.crs
+        assert geometry.geom_equals(expected.geometry).all()
+
+    def test_reprojects_and_reads_from_cache(self, geom_path, tmp_path, monkeypatch):
+        cache_dir = tmp_path / "cache"
+        geometry = load_geometry(geom_path=geom_path, target_crs="EPSG:3857", cache_dir=cache_dir)
+        assert geometry.crs == "EPSG:3857"
+        assert len(list(cache_dir.glob("*.parquet"))) == 1
+
+        # A new process only has the GeoParquet file, and must not parse the source again
+        monkeypatch.setattr(vector_processing, "_loaded_geometries", {})
+        monkeypatch.setattr(vector_processing, "get_geometry", None)
+        cached = load_geometry(geom_path=geom_path, target_crs="EPSG:3857", cache_dir=cache_dir)
+
+        assert cached.crs == "EPSG:3857"
+        assert cached.geom_equals(geometry.geometry).all()
+        assert list(cached["adm2_id"]) == list(geometry["adm2_id"])
+
+    def test_options_are_part_of_the_cache_key(self, geom_path, tmp_path, monkeypatch):
+        monkeypatch.setattr(vector_processing, "_loaded_geometries", {})
+        cache_dir = tmp_path / "cache"
+        geometry = load_geometry(geom_path=geom_path, cache_dir=cache_dir)
+        upper_case = load_geometry(geom_path=geom_path, lower_case=False, cache_dir=cache_dir)
+        kept_columns = load_geometry(geom_path=geom_path, cols_to_drop=DROPPED_COLUMNS[:2], cache_dir=cache_dir)
+
+        assert "ADMIN0PCOD" in upper_case and "ADMIN0PCOD" not in geometry
+        assert "source" in kept_columns and "source" not in geometry
+        assert len(list(cache_dir.glob("*.parquet"))) == 3
+
+    def test_returns_copies(self, geom_path, tmp_path):
+        geometry = load_geometry(geom_path=geom_path, cache_dir=tmp_path / "cache")
+        geometry["adm2_id"] = "changed"
+
+        assert "changed" not in set(load_geometry(geom_path=geom_path, cache_dir=tmp_path / "cache")["adm2_id"])
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, "pipeline")
+import ledger
+import manifest
+import metrics
+import work_queue
+from climatology import Month, Product, Scenario
+from session import get_session
+from sqlalchemy import select
+from tables import JobQueueTable
+from work_queue import (claim_job, enqueue_matrix, finish_job, queue_status,
+                        requeue_expired_jobs, run_worker, server_time)
+
+RUN_LOG = "WORK_QUEUE_RUN_LOG"
+
+
+def log_run(chelsa_product, step):
+    time.sleep(0.05)
+    with open(os.environ[RUN_LOG], "a") as f:
+        f.write(f"{chelsa_product.month.value} {step.name}\n")
+
+
+def start_worker(worker_id):
+    run_worker(worker_id=worker_id, poll_seconds=0.05, runner=log_run)
+
+
+@pytest.fixture(autouse=True)
+def sqlite_queue(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/queue.db")
+    monkeypatch.setenv(RUN_LOG, str(tmp_path / "runs.log"))
+    monkeypatch.setattr(ledger, "_ledger_created", False)
+    monkeypatch.setattr(work_queue, "_queue_created", False)
+
+    geom_path = tmp_path / "boundaries.geojson"
+    geom_path.write_text('{"type": "FeatureCollection", "features": []}')
+    monkeypatch.setattr(manifest.config, "geom_path", geom_path)
+    monkeypatch.setattr(metrics.config, "metrics", False)
+
+
+def enqueue_two_months():
+    return enqueue_matrix(
+        products=[Product.TMIN], scenarios=[Scenario.ACCESS1_0_rcp45], months=[Month.JANUARY, Month.FEBRUARY]
+    )
+
+
+class TestWorkQueue:
+    def test_workers_share_queue(self, tmp_path):
+        assert enqueue_two_months() == 8
+
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=start_worker, args=(f"worker-{i}",)) for i in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=60)
+            assert worker.exitcode == 0
+
+        runs = (tmp_path / "runs.log").read_text().splitlines()
+        assert sorted(runs) == sorted(set(runs))
+        assert len(runs) == 8
+        for month in ["1", "2"]:
+            steps = [run.split()[1] for run in runs if run.split()[0] == month]
+            assert steps == ["DOWNLOAD", "MASK", "ZONAL_STATISTICS", "UPLOAD"]
+        assert queue_status() == {"succeeded": 8}
+
+    def test_steps_wait_for_earlier_steps(self):
+        enqueue_two_months()
+
+        claimed = [claim_job(worker_id="worker"), claim_job(worker_id="worker"), claim_job(worker_id="worker")]
+
+        assert [job.step.name for job in claimed[:2]] == ["DOWNLOAD", "DOWNLOAD"]
+        assert claimed[2] is None
+
+    def test_expired_lease_is_requeued(self):
+        enqueue_two_months()
+        crashed = claim_job(worker_id="crashed", lease_seconds=-1)
+
+        assert requeue_expired_jobs() == 1
+        job = claim_job(worker_id="healthy")
+        assert job.id == crashed.id
+
+        # The crashed worker no longer holds the job
+        finish_job(job_id=crashed.id, worker_id="crashed")
+        assert queue_status()["running"] == 1
+        finish_job(job_id=job.id, worker_id="healthy")
+        assert queue_status()["succeeded"] == 1
+
+    def test_leases_use_database_server_clock(self):
+        enqueue_two_months()
+        job = claim_job(worker_id="worker", lease_seconds=60)
+
+        with get_session() as Session:
+            with Session() as session:
+                lease_expires_at, server_now = session.execute(
+                    select(JobQueueTable.lease_expires_at, server_time(0)).where(JobQueueTable.id == job.id)
+                ).one()
+
+        assert 55 <= (lease_expires_at - server_now).total_seconds() <= 60
+        assert requeue_expired_jobs() == 0
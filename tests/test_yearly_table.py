@@ -0,0 +1,70 @@
+import sys
+import time
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, "pipeline")
+import functions
+from climatology import Month, Product, Scenario, get_climatology
+from store import get_partition_path, read_table, write_table
+from yearly_table import process_yearly_table
+
+SCENARIO = Scenario.ACCESS1_0_rcp45
+
+
+@pytest.fixture
+def chelsa_product():
+    return get_climatology(product=Product.PREC, scenario=SCENARIO, month=Month.DECEMBER)
+
+
+def write_month(zonal_dir, month, mean_raw):
+    write_table(
+        df=pd.DataFrame(
+            {
+                "adm2_id": ["GH2", "GH1"],
+                "mean_raw": [mean_raw, mean_raw + 1],
+                "product": "prec",
+                "scenario": SCENARIO.value,
+                "month": str(month),
+            }
+        ),
+        path=get_partition_path(dataset_dir=zonal_dir, product="prec", scenario=SCENARIO.value, month=month),
+    )
+
+
+class TestYearlyTable:
+    def test_yearly_table_is_sorted_once(self, tmp_path, chelsa_product):
+        for month in [3, 1, 2]:
+            write_month(tmp_path, month=month, mean_raw=month * 10.0)
+
+        yearly_table = functions.yearly_table_generator(
+            product=chelsa_product, zonal_dir=tmp_path, sort_values=["adm2_id", "month"]
+        )
+
+        assert yearly_table["adm2_id"].tolist() == ["GH1"] * 3 + ["GH2"] * 3
+        assert yearly_table["month"].tolist() == [1, 2, 3] * 2
+
+    def test_only_new_months_are_read(self, tmp_path, chelsa_product, monkeypatch):
+        zonal_dir, yearly_path = tmp_path / "zonal", get_partition_path(tmp_path / "yearly", "prec", SCENARIO.value)
+        for month in [1, 2]:
+            write_month(zonal_dir, month=month, mean_raw=month * 10.0)
+        process_yearly_table(product=chelsa_product, zonal_dir=zonal_dir, out_path=yearly_path, sort_values=["adm2_id", "month"])
+
+        time.sleep(0.01)
+        write_month(zonal_dir, month=3, mean_raw=30.0)
+        read_paths = []
+        read_arrow_table = functions.read_arrow_table
+        monkeypatch.setattr(
+            functions, "read_arrow_table", lambda path, **kwargs: read_paths.append(path) or read_arrow_table(path, **kwargs)
+        )
+        process_yearly_table(product=chelsa_product, zonal_dir=zonal_dir, out_path=yearly_path, sort_values=["adm2_id", "month"])
+
+        assert read_paths == [get_partition_path(zonal_dir, "prec", SCENARIO.value, 3), yearly_path]
+        yearly_table = read_table(yearly_path)
+        assert len(yearly_table) == 6
+        assert yearly_table.loc[yearly_table["month"] == 2, "mean_raw"].tolist() == [21.0, 20.0]
+
+    def test_missing_zonal_statistics(self, tmp_path, chelsa_product):
+        with pytest.raises(FileNotFoundError):
+            functions.yearly_table_generator(product=chelsa_product, zonal_dir=tmp_path, sort_values=["adm2_id"])
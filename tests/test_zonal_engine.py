@@ -0,0 +1,138 @@
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import Point, box
+
+sys.path.insert(0, "pipeline")
+from climatology import Month, Product, Scenario, get_climatology
+from functions import calculate_zonal_statistics
+from zonal_engine import rasterize_zones, zonal_statistics, zonal_statistics_cube
+
+TRANSFORM = from_origin(-10, 20, 0.05, 0.05)
+
+
+@pytest.fixture(scope="module")
+def synthetic_raster(tmp_path_factory):
+    location = tmp_path_factory.mktemp("zonal") / "cropped.tif"
+    rng = np.random.default_rng(seed=1)
+    raster = rng.integers(-300, 400, size=(1, 300, 400), dtype=np.int16)
+    raster[0, rng.random((300, 400)) < 0.05] = -999
+
+    profile = {
+        "driver": "GTiff",
+        "dtype": "int16",
+        "count": 1,
+        "width": 400,
+        "height": 300,
+        "crs": "EPSG:4326",
+        "transform": TRANSFORM,
+        "nodata": -999,
+    }
+    with rasterio.open(location, "w", **profile) as dest:
+        dest.write(raster)
+
+    return location
+
+
+@pytest.fixture(scope="module")
+def synthetic_geometry():
+    boxes = [
+        box(-10 + col * 2.5, 20 - (row + 1) * 3, -10 + (col + 1) * 2.5, 20 - row * 3)
+        for row in range(4)
+        for col in range(7)
+    ]
+    circles = [Point(9, 17).buffer(0.4), Point(9.5, 7).buffer(0.02)]
+    geometries = boxes + circles
+
+    return gpd.GeoDataFrame(
+        {
+            "iso2_code": ["AA"] * 15 + ["BB"] * (len(geometries) - 15),
+            "adm2_id": [f"ADM{i}" for i in range(len(geometries))],
+        },
+        geometry=geometries,
+        crs="EPSG:4326",
+    )
+
+
+@pytest.fixture(scope="module")
+def chelsa_product():
+    return get_climatology(product=Product.TMIN, scenario=Scenario.ACCESS1_0_rcp45, month=Month.APRIL)
+
+
+class TestZonalEngine:
+    def test_rasterize_zones(self, synthetic_geometry):
+        zones = rasterize_zones(geometry=synthetic_geometry, transform=TRANSFORM, shape=(300, 400))
+
+        assert zones.shape == (300, 400)
+        assert zones.max() == len(synthetic_geometry) - 1
+        assert zones[0, 0] == 1
+
+    def test_zonal_statistics(self):
+        raster = np.array([[1, 2, 3], [4, -999, 6], [7, 8, 9]])
+        zones = np.array([[1, 1, 2], [1, 1, 2], [0, 0, 2]])
+
+        results = zonal_statistics(
+            raster=raster, zones=zones, n_zones=3, stats=["count", "min", "max", "mean", "median"], nodata=-999
+        )
+
+        np.testing.assert_array_equal(results["count"], [3, 3, 0])
+        np.testing.assert_array_equal(results["min"], [1, 3, np.nan])
+        np.testing.assert_array_equal(results["max"], [4, 9, np.nan])
+        np.testing.assert_allclose(results["mean"], [7 / 3, 6, np.nan])
+        np.testing.assert_array_equal(results["median"], [2, 6, np.nan])
+
+    def test_cube_matches_per_zone_reference(self):
+        rng = np.random.default_rng(seed=2)
+        cube = rng.integers(-50, 50, size=(12, 40, 50)).astype(np.int16)
+        cube[rng.random(cube.shape) < 0.1] = -999
+        zones = rng.integers(0, 6, size=(40, 50))
+
+        results = zonal_statistics_cube(
+            cube=cube, zones=zones, n_zones=6, stats=["count", "min", "max", "mean", "median"], nodata=-999
+        )
+
+        for band in range(12):
+            for zone in range(1, 7):
+                values = cube[band][(zones == zone) & (cube[band] != -999)]
+                if len(values) == 0:
+                    assert results["count"][band, zone - 1] == 0
+                    assert np.isnan(results["mean"][band, zone - 1])
+                    continue
+                assert results["count"][band, zone - 1] == len(values)
+                assert results["min"][band, zone - 1] == values.min()
+                assert results["max"][band, zone - 1] == values.max()
+                assert results["mean"][band, zone - 1] == pytest.approx(values.mean())
+                assert results["median"][band, zone - 1] == np.median(values)
+
+    def test_unavailable_statistic(self):
+        with pytest.raises(ValueError):
+            zonal_statistics(raster=np.zeros((2, 2)), zones=np.ones((2, 2)), n_zones=1, stats=["mode"])
+
+    def test_parity_with_rasterstats(self, synthetic_raster, synthetic_geometry, chelsa_product):
+        stats = "count min mean max median"
+        rasterstats_results = calculate_zonal_statistics(
+            raster_location=synthetic_raster,
+            geometry=synthetic_geometry.copy(),
+            chelsa_product=chelsa_product,
+            place_id="adm2_id",
+            provided_stats=stats,
+            engine="rasterstats",
+        )
+        vectorized_results = calculate_zonal_statistics(
+            raster_location=synthetic_raster,
+            geometry=synthetic_geometry.copy(),
+            chelsa_product=chelsa_product,
+            place_id="adm2_id",
+            provided_stats=stats,
+            engine="vectorized",
+        )
+
+        pd.testing.assert_frame_equal(
+            rasterstats_results.astype({f"{stat}_raw": float for stat in stats.split(" ")}),
+            vectorized_results.astype({f"{stat}_raw": float for stat in stats.split(" ")}),
+        )
@@ -0,0 +1,107 @@
+import sys
+import tracemalloc
+from functools import partial
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, "pipeline")
+import functions
+from functions import crop_raster_with_geometry, crop_raster_with_zone_grid
+from tests.test_zonal_engine import TRANSFORM, synthetic_geometry, synthetic_raster
+from vector_processing import fingerprint_geometry_file
+from zone_cache import get_zone_grid
+from zonal_engine import rasterize_zones
+
+
+@pytest.fixture
+def geom_path(synthetic_geometry, tmp_path):
+    path = tmp_path / "zones.geojson"
+    synthetic_geometry.to_file(path, driver="GeoJSON")
+    return path
+
+
+class TestZoneCache:
+    def test_zone_grid_is_cached(self, synthetic_geometry, geom_path, tmp_path):
+        cache_dir = tmp_path / "cache"
+        zones = get_zone_grid(
+            geom_path=geom_path,
+            transform=TRANSFORM,
+            shape=(300, 400),
+            crs="EPSG:4326",
+            geometry=synthetic_geometry,
+            cache_dir=cache_dir,
+        )
+        cached_zones = get_zone_grid(
+            geom_path=geom_path,
+            transform=TRANSFORM,
+            shape=(300, 400),
+            crs="EPSG:4326",
+            geometry=None,
+            cache_dir=cache_dir,
+        )
+
+        assert len(list(cache_dir.glob("*.npy"))) == 1
+        assert isinstance(cached_zones, np.memmap)
+        np.testing.assert_array_equal(
+            cached_zones, rasterize_zones(geometry=synthetic_geometry, transform=TRANSFORM, shape=(300, 400))
+        )
+        np.testing.assert_array_equal(zones, cached_zones)
+
+    def test_cold_cache_fits_memory_budget(self, synthetic_geometry, geom_path, tmp_path):
+        transform = TRANSFORM * TRANSFORM.scale(0.25)
+        arguments = dict(
+            geom_path=geom_path, crs="EPSG:4326", geometry=synthetic_geometry, cache_dir=tmp_path / "cache"
+        )
+        # A small grid first, so one-off allocations of the first rasterization are not traced
+        get_zone_grid(transform=transform, shape=(10, 10), **arguments)
+
+        shape = (1200, 1600)
+        # Tracing may already be on, eg. with config.trace_memory
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        zones = get_zone_grid(transform=transform, shape=shape, memory_budget_mb=0.1, **arguments)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # The whole grid is 3.7 MB
+        assert peak - before < 0.5 * 1024 * 1024
+        np.testing.assert_array_equal(
+            zones, rasterize_zones(geometry=synthetic_geometry, transform=transform, shape=shape)
+        )
+
+    def test_new_grid_gets_new_entry(self, synthetic_geometry, geom_path, tmp_path):
+        cache_dir = tmp_path / "cache"
+        for shape in [(300, 400), (200, 400)]:
+            get_zone_grid(
+                geom_path=geom_path,
+                transform=TRANSFORM,
+                shape=shape,
+                crs="EPSG:4326",
+                geometry=synthetic_geometry,
+                cache_dir=cache_dir,
+            )
+
+        assert len(list(cache_dir.glob("*.npy"))) == 2
+
+    def test_fingerprint_changes_with_contents(self, synthetic_geometry, geom_path):
+        fingerprint = fingerprint_geometry_file(geom_path)
+        synthetic_geometry.iloc[:-1].to_file(geom_path, driver="GeoJSON")
+
+        assert fingerprint_geometry_file(geom_path) != fingerprint
+
+    def test_crop_matches_geometry_mask(self, synthetic_raster, synthetic_geometry, geom_path, tmp_path, monkeypatch):
+        cache_dir = tmp_path / "cache"
+        monkeypatch.setattr(functions, "get_zone_grid", partial(get_zone_grid, cache_dir=cache_dir))
+        subset = synthetic_geometry.iloc[[3, 8, 9, 28]]
+        subset.to_file(geom_path, driver="GeoJSON")
+
+        raster, profile = crop_raster_with_geometry(raster_location=synthetic_raster, gdf=subset)
+        cached_raster, cached_profile = crop_raster_with_zone_grid(
+            raster_location=synthetic_raster, gdf=subset, geom_path=geom_path
+        )
+
+        np.testing.assert_array_equal(raster, cached_raster)
+        assert profile == cached_profile
+        assert len(list(cache_dir.glob("*.npy"))) == 1
@@ -10,7 +10,7 @@ def get_climatology_table():
             table_name = 'union_table'
             # Fetch the table data using a select query
             query = text(f"SELECT * FROM {schema_name}.{table_name}")
-            df = pd.read_sql(query, session.get_bind().connect(), )
+            df = pd.read_sql(query, session.connection())
             # columns_to_encode = ["admin0name", "admin1name", "admin2name"]
             # for column in df[columns_to_encode]:
             #     df[column] = df[column].str.decode("utf-8-sig")